@@ -0,0 +1,147 @@
+"""
+Локальный кэш аудио для часто играющих треков
+
+Трек, сыгранный заданное число раз, скачивается в фоне (Opus/WebM, без перекодирования)
+и при следующих воспроизведениях читается с диска, а не из сети. Общий размер кэша
+ограничен, при превышении удаляются давно не игравшие файлы (LRU).
+
+Кодек дорожки, который сообщил yt-dlp при скачивании, хранится в имени файла
+(<id>.<acodec>.<ext>), поэтому индекс восстанавливается после перезапуска без
+повторного анализа файлов.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+
+
+class CachedAudio:
+    """Файл трека в кэше"""
+    __slots__ = ('path', 'size', 'acodec')
+
+    def __init__(self, path, size, acodec=None):
+        self.path = path
+        self.size = size
+        self.acodec = acodec  # Кодек по данным yt-dlp или None, если неизвестен
+
+    @property
+    def is_opus(self):
+        """Можно ли воспроизвести файл без перекодирования (codec copy)"""
+        return self.acodec == 'opus'
+
+
+def parse_filename(name):
+    """<id>.<acodec>.<ext> -> (video_id, acodec); у файлов без кодека в имени acodec = None"""
+    video_id, _, rest = name.partition('.')
+    acodec, _, _ = rest.rpartition('.')
+    return video_id, acodec or None
+
+
+class AudioCache:
+    """Кэш аудиофайлов на диске с ограничением размера и вытеснением LRU"""
+
+    def __init__(self, directory, downloader, *, max_bytes=1024 ** 3, min_plays=2, max_duration=15 * 60):
+        self.directory = directory
+        self.downloader = downloader  # async (url) -> (путь к скачанному файлу, acodec)
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.max_duration = max_duration
+
+        os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()  # video_id -> CachedAudio, порядок = давность использования
+        self._bytes = 0
+        self._play_counts = OrderedDict()  # video_id -> число воспроизведений (ограниченный словарь)
+        self._downloading = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.download_errors = 0
+        self.evicted = 0
+        self._load()
+
+    def _load(self):
+        """Восстанавливает индекс по файлам, оставшимся с прошлого запуска"""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.part') or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, path, stat.st_size))
+        for _, name, path, size in sorted(files):
+            video_id, acodec = parse_filename(name)
+            self._entries[video_id] = CachedAudio(path, size, acodec)
+            self._bytes += size
+        self._evict()
+
+    async def lookup(self, video_id):
+        """Закэшированный файл трека (CachedAudio) или None; вызывается один раз на трек"""
+        entry = self._entries.get(video_id) if video_id else None
+        # Файл могли удалить вручную: проверка диска не выполняется в event loop
+        if entry is None or not await asyncio.to_thread(os.path.exists, entry.path):
+            if entry is not None and self._entries.get(video_id) is entry:
+                self._remove(video_id)
+            self.misses += 1
+            return None
+        if video_id in self._entries:
+            self._entries.move_to_end(video_id)
+        self.hits += 1
+        return entry
+
+    def record_play(self, track):
+        """Учитывает воспроизведение; возвращает True, если трек пора скачать в кэш"""
+        video_id = track.video_id
+        if not video_id or video_id in self._entries or video_id in self._downloading:
+            return False
+        if track.duration and track.duration > self.max_duration:
+            return False
+        count = self._play_counts.pop(video_id, 0) + 1
+        self._play_counts[video_id] = count
+        while len(self._play_counts) > 10000:
+            self._play_counts.popitem(last=False)
+        return count >= self.min_plays
+
+    async def download(self, track):
+        """Скачивает трек в кэш (вызывается в фоне)"""
+        video_id = track.video_id
+        self._downloading.add(video_id)
+        try:
+            path, acodec = await self.downloader(track.webpage_url)
+            size = await asyncio.to_thread(os.path.getsize, path)
+            self._entries[video_id] = CachedAudio(path, size, acodec)
+            self._bytes += size
+            self._play_counts.pop(video_id, None)
+            self.downloads += 1
+            self._evict()
+        except Exception as e:
+            self.download_errors += 1
+            print(f'⚠️ Не удалось сохранить трек в кэш ({track}): {e}')
+        finally:
+            self._downloading.discard(video_id)
+
+    def _remove(self, video_id):
+        entry = self._entries.pop(video_id)
+        self._bytes -= entry.size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            video_id = next(iter(self._entries))
+            self._remove(video_id)
+            self.evicted += 1
+
+    def stats(self):
+        """Состояние кэша для веб-панели"""
+        return {
+            'entries': len(self._entries),
+            'size_mb': round(self._bytes / 1024 ** 2, 1),
+            'max_size_mb': round(self.max_bytes / 1024 ** 2),
+            'hits': self.hits,
+            'misses': self.misses,
+            'downloads': self.downloads,
+            'download_errors': self.download_errors,
+            'evicted': self.evicted,
+        }
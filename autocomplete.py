@@ -0,0 +1,156 @@
+"""
+Движок автодополнения для /play
+
+Discord присылает запрос автодополнения на каждое нажатие клавиши, поэтому:
+- запросы одного пользователя откладываются (debounce), устаревшие отменяются;
+- результаты кэшируются (LRU), а более длинный запрос может переиспользовать
+  результаты своего префикса ("daft pu" фильтруется из результатов "daft p");
+- если поиск недоступен или не успевает, подсказки берутся из недавно игравших треков.
+"""
+import asyncio
+import re
+import time
+from collections import OrderedDict, deque
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def percentile(samples, fraction):
+    """Перцентиль по отсортированному списку"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class AutocompleteEngine:
+    """Подсказки треков с debounce, кэшем по префиксам и локальным запасным индексом"""
+
+    def __init__(self, search, *, debounce=0.3, timeout=2.0, cache_size=500, recent_size=500):
+        self.search = search  # async (query, limit) -> [{'name': ..., 'url': ...}]
+        self.debounce = debounce
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.recent_size = recent_size
+
+        self._cache = OrderedDict()  # нормализованный запрос -> (results, limit)
+        self._pending = {}  # user_id -> задача поиска
+        self._recent = OrderedDict()  # значение (URL/запрос) -> отображаемое имя
+
+        self.latencies = deque(maxlen=1000)
+        self.cache_hits = 0
+        self.prefix_hits = 0
+        self.remote_searches = 0
+        self.fallbacks = 0
+        self.superseded = 0
+
+    async def suggest(self, user_id, query, limit=25):
+        """Возвращает подсказки [{'name', 'url'}] для введённого текста"""
+        started = time.perf_counter()
+        try:
+            return await self._suggest(user_id, normalize(query), limit)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    async def _suggest(self, user_id, query, limit):
+        cached = self._from_cache(query, limit)
+        if cached is not None:
+            return cached
+
+        # Новый запрос пользователя отменяет его предыдущий, ещё не завершённый
+        previous = self._pending.pop(user_id, None)
+        if previous and not previous.done():
+            previous.cancel()
+            self.superseded += 1
+        task = asyncio.ensure_future(self._debounced_search(query, limit))
+        self._pending[user_id] = task
+
+        await asyncio.wait({task})
+        if self._pending.get(user_id) is task:
+            del self._pending[user_id]
+        if task.cancelled():
+            # Пользователь уже ввёл следующий символ - ответ больше никому не нужен
+            return []
+        results = task.result() if task.exception() is None else []
+        if not results:
+            self.fallbacks += 1
+            return self.local_matches(query, limit)
+
+        self._store(query, results, limit)
+        return results
+
+    async def _debounced_search(self, query, limit):
+        await asyncio.sleep(self.debounce)
+        self.remote_searches += 1
+        try:
+            return await asyncio.wait_for(self.search(query, limit), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return []
+
+    def _from_cache(self, query, limit):
+        """Точное совпадение или фильтрация результатов самого длинного закэшированного префикса"""
+        entry = self._cache.get(query)
+        if entry is not None:
+            self._cache.move_to_end(query)
+            self.cache_hits += 1
+            return entry[0][:limit]
+
+        tokens = query.split()
+        for end in range(len(query) - 1, 1, -1):
+            prefix = query[:end]
+            entry = self._cache.get(prefix)
+            if entry is None:
+                continue
+            results, searched_limit = entry
+            filtered = [r for r in results if all(t in r['name'].lower() for t in tokens)]
+            # Если по префиксу нашлось меньше лимита, это полный список - фильтр точен.
+            # Иначе используем его, только если после фильтрации осталось достаточно вариантов.
+            if len(results) < searched_limit or len(filtered) >= min(limit, 5):
+                self._cache.move_to_end(prefix)
+                self.prefix_hits += 1
+                return filtered[:limit]
+            return None
+        return None
+
+    def _store(self, query, results, limit):
+        self._cache[query] = (results, limit)
+        self._cache.move_to_end(query)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def remember_played(self, name, value):
+        """Добавляет сыгранный трек в локальный индекс подсказок"""
+        if not name or not value or len(value) > 100:
+            return
+        self._recent[value] = name
+        self._recent.move_to_end(value)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    def local_matches(self, query, limit=25):
+        """Поиск среди недавно игравших треков (свежие первыми)"""
+        tokens = query.split()
+        matches = []
+        for value, name in reversed(self._recent.items()):
+            if all(t in name.lower() for t in tokens):
+                matches.append({'name': name, 'url': value})
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def stats(self):
+        """Задержка автодополнения (p50/p99) и счётчики для веб-панели"""
+        ordered = sorted(self.latencies)
+        p50 = percentile(ordered, 0.5)
+        p99 = percentile(ordered, 0.99)
+        return {
+            'count': len(ordered),
+            'p50_ms': round(p50 * 1000) if p50 is not None else None,
+            'p99_ms': round(p99 * 1000) if p99 is not None else None,
+            'cache_hits': self.cache_hits,
+            'prefix_hits': self.prefix_hits,
+            'remote_searches': self.remote_searches,
+            'fallbacks': self.fallbacks,
+            'superseded': self.superseded,
+        }
@@ -0,0 +1,541 @@
+"""
+Локальные заменители Discord, yt-dlp и Spotify для нагрузочных тестов (bench/load_test.py)
+
+FakeDiscord подключает к настоящему боту настоящие объекты discord.py (Guild, Member,
+VoiceChannel, Message), созданные из JSON, как при подключении к шлюзу:
+  - события (MESSAGE_CREATE, VOICE_STATE_UPDATE, CHANNEL_CREATE...) проходят через парсеры
+    discord.py с задержкой шлюза и в исходном порядке;
+  - REST-запросы бота (отправка сообщений, создание/удаление каналов, перемещение участников,
+    вебхуки) обрабатываются на месте с задержкой API и порождают события, как в Discord;
+  - голосовые подключения заменены FakeVoiceClient: один поток "часов" каждые 20 мс
+    читает кадры у всех играющих источников, как поток AudioPlayer discord.py.
+
+Ограничения частоты запросов Discord не моделируются.
+"""
+import asyncio
+import itertools
+import random
+import threading
+import time
+import types
+from datetime import datetime, timezone
+
+import discord
+from discord.opus import OPUS_SILENCE
+from discord.webhook import async_ as webhook_async
+
+FRAME_SECONDS = 0.02
+PCM_FRAME = b'\x01\x00' * 1920  # 20 мс стерео PCM 48 кГц
+TEXT_CHANNEL = 0
+VOICE_CHANNEL = 2
+ALL_PERMISSIONS = str(discord.Permissions.all().value)
+
+
+def jitter(rng, latency):
+    """Задержка latency +-50%"""
+    return latency * (0.5 + rng.random()) if latency else 0
+
+
+# ---------- yt-dlp ----------
+
+def install_fake_ytdl(latency, *, track_seconds=180, seed=0):
+    """Подменяет модуль yt_dlp (до первого извлечения): extract_info блокирует рабочий поток на latency"""
+    import sys
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    calls = itertools.count(1)
+
+    class YoutubeDL:
+        def __init__(self, options):
+            self.options = options
+
+        def extract_info(self, query, download=False):
+            with lock:
+                delay = jitter(rng, latency)
+            next(calls)
+            time.sleep(delay)
+            video_id = f'v{abs(hash(query)) % 10 ** 10:010d}'
+            info = {
+                'id': video_id,
+                'title': f'Трек {query.removeprefix("ytsearch1:")[:60]}',
+                'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+                'url': f'https://rr1.googlevideo.com/videoplayback?id={video_id}&expire={int(time.time()) + 6 * 3600}',
+                'duration': track_seconds,
+            }
+            if query.startswith('ytsearch'):
+                return {'entries': [info]}
+            return info
+
+        def sanitize_info(self, info):
+            return info
+
+    module = types.ModuleType('yt_dlp')
+    module.YoutubeDL = YoutubeDL
+    module.calls = calls
+    sys.modules['yt_dlp'] = module
+    return module
+
+
+# ---------- Spotify ----------
+
+class FakeSpotify:
+    """Тот же интерфейс, что у spotify_client.SpotifyClient, с задержкой вместо HTTP"""
+
+    def __init__(self, latency, *, seed=0, page_size=50, collection_size=200):
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.page_size = page_size
+        self.collection_size = collection_size
+        self.requests = 0
+
+    async def _request(self):
+        self.requests += 1
+        await asyncio.sleep(jitter(self.rng, self.latency))
+
+    @staticmethod
+    def _track(track_id, name):
+        return {
+            'name': name,
+            'artists': [{'name': f'Исполнитель {track_id[:4]}'}],
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+            'type': 'track',
+        }
+
+    async def track(self, track_id):
+        await self._request()
+        return self._track(track_id, f'Песня {track_id}')
+
+    async def search(self, query, *, limit=5):
+        await self._request()
+        items = [self._track(f'{abs(hash((query, i))) % 10 ** 12:012d}', f'{query} {i}') for i in range(limit)]
+        return {'tracks': {'items': items}}
+
+    async def _paged(self, collection_id):
+        for offset in range(0, self.collection_size, self.page_size):
+            await self._request()
+            yield [
+                self._track(f'{collection_id}{i:06d}', f'Песня {i}')
+                for i in range(offset, min(offset + self.page_size, self.collection_size))
+            ]
+
+    def album_tracks(self, album_id, *, page_size=50):
+        return self._paged(album_id)
+
+    def playlist_tracks(self, playlist_id, *, page_size=100):
+        return self._paged(playlist_id)
+
+    async def close(self):
+        pass
+
+
+# ---------- Голос ----------
+
+class FakeTrackSource(discord.AudioSource):
+    """Трек без FFmpeg: заранее известное число PCM-кадров из памяти"""
+
+    def __init__(self, track, *, volume=0.5, start_at=0.0):
+        self.track = track
+        self.data = track.data
+        self.title = track.title
+        self.volume = volume
+        self.start_at = start_at
+        self._frames = int(((track.duration or 180) - start_at) / FRAME_SECONDS)
+
+    def read(self):
+        if self._frames <= 0:
+            return b''
+        self._frames -= 1
+        return PCM_FRAME
+
+    def is_opus(self):
+        return False
+
+
+class FakeVoiceClient(discord.VoiceProtocol):
+    """Голосовое подключение без UDP: кадры забирают общие часы AudioClock"""
+
+    def __init__(self, client, channel, clock):
+        super().__init__(client, channel)
+        self.guild = channel.guild
+        self.clock = clock
+        self.source = None
+        self._after = None
+        self._paused = False
+        self.frames = 0
+        self.silence_frames = 0
+        self.first_audio_at = None  # time.perf_counter() первого кадра со звуком
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self.source is not None and not self._paused
+
+    def is_paused(self):
+        return self.source is not None and self._paused
+
+    def play(self, source, *, after=None, **kwargs):
+        if self.source is not None:
+            raise discord.ClientException('Already playing audio.')
+        self.source = source
+        self._after = after
+        self._paused = False
+        self.clock.add(self)
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        self._finish(None)
+
+    def _finish(self, error):
+        source, after = self.source, self._after
+        if source is None:
+            return
+        self.source = self._after = None
+        self.clock.remove(self)
+        source.cleanup()
+        if after is not None:
+            after(error)
+
+    def tick(self):
+        """Вызывается потоком часов раз в 20 мс"""
+        if self._paused or self.source is None:
+            return
+        try:
+            frame = self.source.read()
+        except Exception as e:
+            self._finish(e)
+            return
+        if not frame:
+            self._finish(None)
+            return
+        self.frames += 1
+        if frame == OPUS_SILENCE:
+            self.silence_frames += 1
+        elif self.first_audio_at is None:
+            self.first_audio_at = time.perf_counter()
+
+    async def move_to(self, channel, **kwargs):
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.cleanup()
+
+    def cleanup(self):
+        self.client._connection._remove_voice_client(self.guild.id)
+
+
+class AudioClock:
+    """Один поток на все FakeVoiceClient: как AudioPlayer, но без потока на каждый сервер"""
+
+    def __init__(self):
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.late_ticks = 0
+        self._thread = threading.Thread(target=self._run, name='fake-audio-clock', daemon=True)
+        self._thread.start()
+
+    def add(self, client):
+        with self._lock:
+            self._clients.add(client)
+
+    def remove(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def _run(self):
+        next_tick = time.perf_counter()
+        while not self._stopped.is_set():
+            with self._lock:
+                clients = list(self._clients)
+            for client in clients:
+                client.tick()
+            next_tick += FRAME_SECONDS
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Не успели обойти все подключения за кадр
+                self.late_ticks += 1
+                next_tick = time.perf_counter()
+
+    def stop(self):
+        self._stopped.set()
+
+
+# ---------- Discord ----------
+
+class FakeDiscord:
+    """Шлюз и REST API Discord для одного бота в памяти"""
+
+    def __init__(self, client, *, rest_latency=0.02, gateway_latency=0.01, seed=0):
+        self.client = client
+        self.state = client._connection
+        self.rest_latency = rest_latency
+        self.gateway_latency = gateway_latency
+        self.rng = random.Random(seed)
+        self._ids = itertools.count(10 ** 17)
+        self._events = asyncio.Queue()
+        self._deliverer = None
+        self.clock = AudioClock()
+        self.requests = {}  # "METHOD путь" -> количество
+        self.sent_messages = 0
+        self.error_messages = 0  # Сообщения бота об ошибках ("❌ ...")
+        self.webhook_messages = 0
+        self.webhooks = {}  # channel_id -> webhook payload
+        self.voice = {}  # (guild_id, user_id) -> channel_id
+        self.channel_members = {}  # channel_id -> set(user_id) по состоянию "сервера"
+        self.voice_clients = []  # все голосовые подключения бота за время теста
+        self.on_move = None  # (guild_id, user_id, channel_id) -> None при перемещении участника ботом
+        self.members = {}  # guild_id -> [user_id] (без intent members их нет в кэше discord.py)
+
+        self.users = {}  # user_id -> payload пользователя
+        self.user = self._user(self.next_id(), 'bench-bot', bot=True)
+
+    def next_id(self):
+        return next(self._ids)
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).isoformat()
+
+    def _user(self, user_id, name, *, bot=False):
+        user = {'id': str(user_id), 'username': name, 'discriminator': '0', 'global_name': None,
+                'avatar': None, 'bot': bot}
+        self.users[user_id] = user
+        return user
+
+    def _member(self, user):
+        return {'user': user, 'roles': [], 'joined_at': self._now(), 'deaf': False, 'mute': False, 'flags': 0}
+
+    def _channel(self, guild_id, channel_id, name, kind):
+        channel = {'id': str(channel_id), 'guild_id': str(guild_id), 'name': name, 'type': kind,
+                   'position': 0, 'permission_overwrites': [], 'parent_id': None, 'nsfw': False}
+        if kind == VOICE_CHANNEL:
+            channel.update({'bitrate': 64000, 'user_limit': 0, 'rtc_region': None})
+        return channel
+
+    def _voice_state(self, guild_id, user_id, channel_id):
+        return {'guild_id': str(guild_id), 'channel_id': str(channel_id) if channel_id else None,
+                'user_id': str(user_id), 'session_id': f's{user_id}', 'deaf': False, 'mute': False,
+                'self_deaf': False, 'self_mute': False, 'self_video': False, 'suppress': False,
+                'request_to_speak_timestamp': None, 'member': self._member(self.users[user_id])}
+
+    # ---------- Подключение ----------
+
+    async def start(self):
+        """Готовит клиента к работе без подключения к Discord"""
+        await self.client._async_setup_hook()
+        self.state.user = discord.ClientUser(state=self.state, data=self.user)
+        self.client.http.request = self._rest
+        webhook_async.AsyncWebhookAdapter.request = lambda adapter, route, session, **kwargs: self._webhook_rest(
+            route, session, **kwargs
+        )
+
+        async def connect(channel, **kwargs):
+            return self.connect_voice(channel)
+        discord.VoiceChannel.connect = connect
+        self._deliverer = asyncio.get_running_loop().create_task(self._deliver())
+        self.client._ready.set()
+
+    def close(self):
+        if self._deliverer:
+            self._deliverer.cancel()
+        self.clock.stop()
+
+    def add_guild(self, name, *, text_channels=1, voice_channels=1, members=0):
+        """Создаёт сервер (как GUILD_CREATE) и возвращает discord.Guild"""
+        guild_id = self.next_id()
+        channels = [self._channel(guild_id, self.next_id(), f'text-{i}', TEXT_CHANNEL) for i in range(text_channels)]
+        channels += [self._channel(guild_id, self.next_id(), f'voice-{i}', VOICE_CHANNEL) for i in range(voice_channels)]
+        users = [self._user(self.next_id(), f'user{i}') for i in range(members)]
+        payload = {
+            'id': str(guild_id), 'name': name, 'owner_id': users[0]['id'] if users else self.user['id'],
+            'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': ALL_PERMISSIONS, 'position': 0,
+                       'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}],
+            'channels': channels,
+            'members': [self._member(user) for user in users] + [self._member(self.user)],
+            'member_count': members + 1,
+            'voice_states': [], 'emojis': [], 'stickers': [], 'features': [], 'premium_tier': 0,
+        }
+        guild = discord.Guild(data=payload, state=self.state)
+        self.state._add_guild(guild)
+        self.members[guild_id] = [int(user['id']) for user in users]
+        return guild
+
+    def connect_voice(self, channel):
+        """Голосовое подключение бота к каналу (без голосового шлюза)"""
+        voice_client = FakeVoiceClient(self.client, channel, self.clock)
+        self.state._add_voice_client(channel.guild.id, voice_client)
+        self.voice_clients.append(voice_client)
+        return voice_client
+
+    # ---------- Шлюз ----------
+
+    def dispatch(self, event, data):
+        """Событие шлюза: разбирается discord.py после задержки шлюза, в порядке отправки"""
+        self._events.put_nowait((time.perf_counter() + jitter(self.rng, self.gateway_latency), event, data))
+
+    def dispatch_now(self, event, data):
+        self.state.parsers[event](data)
+
+    async def _deliver(self):
+        while True:
+            due, event, data = await self._events.get()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                self.state.parsers[event](data)
+            except Exception as e:
+                print(f'⚠️ Ошибка разбора события {event}: {e!r}')
+            self._events.task_done()
+
+    async def drain(self):
+        """Ждёт доставки всех отправленных событий"""
+        await self._events.join()
+
+    def message(self, channel, user_id, content, *, attachments=(), nonce=None):
+        """Payload MESSAGE_CREATE от участника"""
+        return {'nonce': nonce,
+            'id': str(self.next_id()), 'channel_id': str(channel.id), 'guild_id': str(channel.guild.id),
+            'author': self.users[user_id], 'member': {'roles': [], 'joined_at': self._now(),
+                                                                   'deaf': False, 'mute': False, 'flags': 0},
+            'content': content, 'timestamp': self._now(), 'edited_timestamp': None, 'tts': False,
+            'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'embeds': [], 'pinned': False,
+            'type': 0, 'attachments': [
+                {'id': str(self.next_id()), 'filename': url.rsplit('/', 1)[-1], 'size': 1024, 'url': url,
+                 'proxy_url': url} for url in attachments
+            ],
+        }
+
+    def set_voice(self, guild, user_id, channel_id):
+        """Участник заходит в канал channel_id (None - выходит): состояние сервера и событие"""
+        key = (guild.id, user_id)
+        previous = self.voice.get(key)
+        if previous == channel_id:
+            return
+        if previous is not None:
+            self.channel_members.get(previous, set()).discard(user_id)
+        if channel_id is None:
+            self.voice.pop(key, None)
+        else:
+            self.voice[key] = channel_id
+            self.channel_members.setdefault(channel_id, set()).add(user_id)
+        self.dispatch('VOICE_STATE_UPDATE', self._voice_state(guild.id, user_id, channel_id))
+
+    # ---------- REST ----------
+
+    async def _rest(self, route, *, files=None, form=None, **kwargs):
+        key = f'{route.method} {route.path}'
+        self.requests[key] = self.requests.get(key, 0) + 1
+        await asyncio.sleep(jitter(self.rng, self.rest_latency))
+        handler = self._handlers.get((route.method, route.path))
+        if handler is None:
+            return {}
+        return handler(self, route, kwargs.get('json') or {})
+
+    def _send_message(self, route, payload):
+        self.sent_messages += 1
+        if (payload.get('content') or '').startswith('❌'):
+            self.error_messages += 1
+        return {
+            'id': str(self.next_id()), 'channel_id': str(route.channel_id), 'author': self.user,
+            'content': payload.get('content') or '', 'timestamp': self._now(), 'edited_timestamp': None,
+            'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [],
+            'embeds': [], 'pinned': False, 'type': 0,
+        }
+
+    def _create_channel(self, route, payload):
+        channel = self._channel(route.guild_id, self.next_id(), payload.get('name', 'channel'),
+                                payload.get('type', TEXT_CHANNEL))
+        self.dispatch('CHANNEL_CREATE', channel)
+        return channel
+
+    def _edit_channel(self, route, payload):
+        guild = self.state._get_guild(self._guild_of(route.channel_id))
+        channel = self._channel(guild.id if guild else 0, route.channel_id, payload.get('name', 'channel'),
+                                VOICE_CHANNEL)
+        if guild is not None:
+            self.dispatch('CHANNEL_UPDATE', channel)
+        return channel
+
+    def _delete_channel(self, route, payload):
+        guild_id = self._guild_of(route.channel_id)
+        guild = self.state._get_guild(guild_id)
+        for user_id in list(self.channel_members.pop(route.channel_id, ())):
+            # Discord отключает участников удалённого голосового канала
+            self.set_voice(guild, user_id, None)
+        channel = self._channel(guild_id, route.channel_id, 'deleted', VOICE_CHANNEL)
+        self.dispatch('CHANNEL_DELETE', channel)
+        return channel
+
+    def _edit_member(self, route, payload):
+        guild_id = route.guild_id
+        user_id = int(route.url.rsplit('/', 1)[-1])
+        guild = self.state._get_guild(guild_id)
+        if 'channel_id' in payload:
+            channel_id = payload['channel_id']
+            if (guild_id, user_id) not in self.voice:
+                raise discord.HTTPException(
+                    types.SimpleNamespace(status=400, reason='Bad Request'), 'Target user is not connected to voice'
+                )
+            channel_id = int(channel_id) if channel_id else None
+            self.set_voice(guild, user_id, channel_id)
+            if self.on_move:
+                self.on_move(guild_id, user_id, channel_id)
+        return self._member(self.users[user_id])
+
+    def _channel_webhooks(self, route, payload):
+        webhook = self.webhooks.get(route.channel_id)
+        return [webhook] if webhook else []
+
+    def _create_webhook(self, route, payload):
+        webhook = {
+            'id': str(self.next_id()), 'type': 1, 'channel_id': str(route.channel_id),
+            'guild_id': str(self._guild_of(route.channel_id)), 'name': payload.get('name'),
+            'token': f'token{self.next_id()}', 'application_id': self.user['id'], 'user': self.user,
+        }
+        self.webhooks[route.channel_id] = webhook
+        return webhook
+
+    async def _webhook_rest(self, route, session=None, **kwargs):
+        key = f'{route.method} {route.path}'
+        self.requests[key] = self.requests.get(key, 0) + 1
+        await asyncio.sleep(jitter(self.rng, self.rest_latency))
+        self.webhook_messages += 1
+        return None
+
+    def _guild_of(self, channel_id):
+        channel = self.state.get_channel(int(channel_id))
+        return channel.guild.id if channel is not None else None
+
+    _handlers = {
+        ('POST', '/channels/{channel_id}/messages'): _send_message,
+        ('POST', '/guilds/{guild_id}/channels'): _create_channel,
+        ('PATCH', '/channels/{channel_id}'): _edit_channel,
+        ('DELETE', '/channels/{channel_id}'): _delete_channel,
+        ('PATCH', '/guilds/{guild_id}/members/{user_id}'): _edit_member,
+        ('GET', '/channels/{channel_id}/webhooks'): _channel_webhooks,
+        ('POST', '/channels/{channel_id}/webhooks'): _create_webhook,
+    }
+
+
+class FakeInteraction:
+    """Минимум взаимодействия для play_autocomplete"""
+
+    def __init__(self, user_id):
+        self.user = types.SimpleNamespace(id=user_id)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
@@ -0,0 +1,534 @@
+"""
+Нагрузочный тест бота без Discord, YouTube и Spotify
+
+Запускает настоящий bot.py в одном процессе с заменителями из bench/fakes.py: событиями
+шлюза (разбираются discord.py), REST API Discord, yt-dlp (блокирующая задержка в рабочих
+потоках извлечения) и Spotify. Сценарии:
+  messages     - поток сообщений на всех серверах, часть каналов с маршрутами повтора;
+  voice        - одновременный заход участников в исходные голосовые каналы и выход из
+                 временных каналов (время до перемещения, удаление опустевших каналов);
+  play         - !play на многих серверах: время ответа команды, время до первого звука,
+                 паузы между треками и недогрузки буфера;
+  autocomplete - пользователи набирают запрос /play по букве, каждая буква - запрос подсказок;
+  panel        - параллельные запросы к API веб-панели и /metrics.
+
+Для каждого сценария выводятся пропускная способность, перцентили задержки, задержка
+event loop (опоздание sleep(10 мс)) и память процесса. Задержки событий включают
+задержку шлюза (--gateway-latency). Результат можно сохранить в JSON и сравнить
+с прошлым запуском, чтобы оценить изменение производительности.
+
+Использование:
+    python bench/load_test.py [--guilds 1000] [--scenarios messages,voice,play,autocomplete,panel]
+    python bench/load_test.py --json before.json
+    python bench/load_test.py --json after.json --compare before.json
+
+Данные бота (SQLite, кэши) пишутся во временный каталог. Логи бота скрыты (--verbose
+показывает их).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import FakeDiscord, FakeInteraction, FakeSpotify, FakeTrackSource, install_fake_ytdl, percentile  # noqa: E402
+
+SCENARIOS = ('messages', 'voice', 'play', 'autocomplete', 'panel')
+WORDS = ('лето', 'ночь', 'город', 'dance', 'remix', 'love', 'live', 'rock', 'lofi', 'океан', 'дорога', 'neon')
+
+
+def rss_mb():
+    """Текущая память процесса (RSS) в МБ"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LagSampler:
+    """Задержка event loop: насколько sleep(10 мс) просыпается позже срока"""
+
+    INTERVAL = 0.01
+
+    def __init__(self):
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.INTERVAL)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.INTERVAL))
+
+    def stop(self):
+        self._task.cancel()
+        return self.samples
+
+
+def summarize(operations, seconds, latencies, lag, **extra):
+    ms = [value * 1000 for value in latencies]
+    lag_ms = [value * 1000 for value in lag]
+    result = {
+        'operations': operations,
+        'seconds': round(seconds, 3),
+        'throughput': round(operations / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(percentile(ms, 0.5), 2),
+        'p95_ms': round(percentile(ms, 0.95), 2),
+        'p99_ms': round(percentile(ms, 0.99), 2),
+        'max_ms': round(max(ms, default=0.0), 2),
+        'loop_lag_p99_ms': round(percentile(lag_ms, 0.99), 2),
+        'loop_lag_max_ms': round(max(lag_ms, default=0.0), 2),
+        'rss_mb': round(rss_mb(), 1),
+    }
+    result.update(extra)
+    return result
+
+
+async def wait_until(condition, timeout, interval=0.05):
+    """Ждёт выполнения условия; возвращает False по истечении timeout"""
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+
+class LoadTest:
+    def __init__(self, bot, fake, guilds, args):
+        self.bot = bot  # модуль bot.py
+        self.client = bot.bot
+        self.fake = fake
+        self.guilds = guilds
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+    # ---------- Сообщения и повтор ----------
+
+    async def messages(self, lag):
+        args, fake, bot = self.args, self.fake, self.bot
+        relay_guilds = self.guilds[:max(1, len(self.guilds) // 10)]
+        for guild in relay_guilds:
+            source, target = guild.text_channels[:2]
+            bot.relay_routes.add(bot.RelayRoute(source.id, target.id, guild.id))
+
+        latencies = []
+        original = self.client.on_message
+
+        async def timed_on_message(message):
+            await original(message)
+            latencies.append(time.perf_counter() - float(message.nonce))
+        self.client.on_message = timed_on_message
+
+        relayed_before = bot.message_relay.sent_messages
+        batch = max(1, args.rate // 100)
+        started = time.perf_counter()
+        lag.start()
+        try:
+            for sent in range(0, args.messages, batch):
+                for _ in range(min(batch, args.messages - sent)):
+                    guild = self.rng.choice(self.guilds) if self.rng.random() > 0.2 else self.rng.choice(relay_guilds)
+                    channel = self.rng.choice(guild.text_channels)
+                    user_id = self.rng.choice(fake.members[guild.id])
+                    content = '!queue' if self.rng.random() < 0.01 else ' '.join(self.rng.choices(WORDS, k=6))
+                    fake.dispatch('MESSAGE_CREATE', fake.message(
+                        channel, user_id, content, nonce=str(time.perf_counter())
+                    ))
+                await asyncio.sleep(0.01)
+            await fake.drain()
+            await wait_until(lambda: len(latencies) >= args.messages, 30)
+            handled = time.perf_counter() - started
+            await wait_until(lambda: bot.message_relay.stats()['queued'] == 0, 60)
+            relayed = time.perf_counter() - started
+        finally:
+            self.client.on_message = original
+            samples = lag.stop()
+        return summarize(
+            len(latencies), handled, latencies, samples,
+            relay_routes=len(bot.relay_routes),
+            relayed_messages=bot.message_relay.sent_messages - relayed_before,
+            relay_drain_seconds=round(relayed, 3),
+            relay_dropped=bot.message_relay.dropped,
+            webhook_requests=fake.webhook_messages,
+        )
+
+    # ---------- Временные голосовые каналы ----------
+
+    async def voice(self, lag):
+        args, fake, bot = self.args, self.fake, self.bot
+        voice_guilds = self.guilds[:args.voice_guilds]
+        joined = {}  # (guild_id, user_id) -> время захода
+        moves = []
+
+        def on_move(guild_id, user_id, channel_id):
+            started = joined.pop((guild_id, user_id), None)
+            if started is not None and channel_id is not None:
+                moves.append(time.perf_counter() - started)
+        fake.on_move = on_move
+
+        for guild in voice_guilds:
+            bot.source_voice_channels[guild.id] = guild.voice_channels[0].id
+        expected = 0
+        started = time.perf_counter()
+        lag.start()
+        try:
+            # Все участники заходят в исходные каналы одновременно
+            for guild in voice_guilds:
+                for user_id in fake.members[guild.id][:args.joins]:
+                    joined[(guild.id, user_id)] = time.perf_counter()
+                    fake.set_voice(guild, user_id, guild.voice_channels[0].id)
+                    expected += 1
+            await fake.drain()
+            await wait_until(lambda: len(moves) >= expected, args.timeout)
+            moved = time.perf_counter() - started
+            created = sum(len(channels) for channels in bot.created_voice_channels.values())
+
+            # И выходят из временных каналов
+            for guild in voice_guilds:
+                for user_id in fake.members[guild.id][:args.joins]:
+                    fake.set_voice(guild, user_id, None)
+            await fake.drain()
+            left = time.perf_counter()
+            drained = await wait_until(lambda: not bot.created_voice_channels, args.delete_delay + args.timeout)
+            drain_seconds = time.perf_counter() - left
+        finally:
+            fake.on_move = None
+            for guild in voice_guilds:
+                bot.source_voice_channels.pop(guild.id, None)
+            samples = lag.stop()
+        return summarize(
+            len(moves), moved, moves, samples,
+            joins=expected,
+            not_moved=expected - len(moves),
+            channels_created=created,
+            channels_left=sum(len(channels) for channels in bot.created_voice_channels.values()),
+            delete_drain_seconds=round(drain_seconds, 3),
+            drained=drained,
+            errors=int(sum(bot.TEMP_CHANNEL_ERRORS._values.values())),
+            rest_requests=sum(fake.requests.values()),
+        )
+
+    # ---------- Воспроизведение ----------
+
+    async def play(self, lag):
+        args, fake, bot = self.args, self.fake, self.bot
+        play_guilds = self.guilds[:args.play_guilds]
+        for guild in play_guilds:
+            fake.set_voice(guild, fake.members[guild.id][0], guild.voice_channels[1].id)
+        await fake.drain()
+
+        sent = {}  # guild_id -> время отправки первого !play
+        command_latencies = []
+        finished_players = []
+
+        async def on_command_completion(ctx):
+            if ctx.command.name == 'play':
+                command_latencies.append(time.perf_counter() - float(ctx.message.nonce))
+        self.client.add_listener(on_command_completion)
+
+        original_finished = bot.on_player_finished
+
+        def on_player_finished(ctx, guild_id, player, error):
+            finished_players.append(player.stats())
+            original_finished(ctx, guild_id, player, error)
+        bot.on_player_finished = on_player_finished
+
+        def command(guild, content):
+            channel = guild.text_channels[0]
+            fake.dispatch('MESSAGE_CREATE', fake.message(
+                channel, fake.members[guild.id][0], content, nonce=str(time.perf_counter())
+            ))
+
+        def query(index):
+            if self.rng.random() < args.spotify_share:
+                return f'https://open.spotify.com/track/{index:022d}'
+            return ' '.join(self.rng.choices(WORDS, k=3)) + f' {index}'
+
+        gaps_before = bot.track_gap_stats.snapshot()
+        errors_before = fake.error_messages
+        started = time.perf_counter()
+        lag.start()
+        try:
+            for index, guild in enumerate(play_guilds):
+                sent[guild.id] = time.perf_counter()
+                command(guild, f'!play {query(index)}')
+            # Второй трек - в очередь, пока играет первый
+            await asyncio.sleep(0.5)
+            for index, guild in enumerate(play_guilds):
+                command(guild, f'!play {query(index + len(play_guilds))}')
+            await fake.drain()
+            await wait_until(lambda: len(command_latencies) >= 2 * len(play_guilds), args.timeout)
+            commands_done = time.perf_counter() - started
+            # Оба трека сыграны (или не найдены): ни у одного сервера нет плеера и очереди
+            await wait_until(lambda: not any(
+                bot.guild_players.get(guild.id) or bot.music_queues.get(guild.id) for guild in play_guilds
+            ), 2 * args.track_seconds + args.timeout)
+            played = time.perf_counter() - started
+        finally:
+            self.client.remove_listener(on_command_completion)
+            bot.on_player_finished = original_finished
+            for voice_client in list(self.client.voice_clients):
+                await voice_client.disconnect()
+            samples = lag.stop()
+
+        first_audio = [
+            voice_client.first_audio_at - sent[voice_client.guild.id]
+            for voice_client in self.played_clients(play_guilds) if voice_client.first_audio_at
+        ]
+        gaps = bot.track_gap_stats.snapshot()
+        return summarize(
+            len(command_latencies), commands_done, command_latencies, samples,
+            guilds=len(play_guilds),
+            first_audio_p50_ms=round(percentile(first_audio, 0.5) * 1000, 1),
+            first_audio_p95_ms=round(percentile(first_audio, 0.95) * 1000, 1),
+            no_audio=len(play_guilds) - len(first_audio),
+            error_messages=fake.error_messages - errors_before,
+            tracks_played=sum(stats['tracks_played'] for stats in finished_players),
+            underruns=sum(stats['underruns'] for stats in finished_players),
+            gapless_switches=sum(stats['gapless_switches'] for stats in finished_players),
+            track_gaps=gaps.get('count', 0) - gaps_before.get('count', 0),
+            track_gap_p95_ms=gaps.get('p95_ms'),
+            playback_seconds=round(played, 3),
+            audio_clock_late_ticks=fake.clock.late_ticks,
+            extractions=next(self.ytdl.calls) - 1,
+            spotify_requests=self.spotify.requests,
+        )
+
+    def played_clients(self, guilds):
+        return [client for client in self.fake.voice_clients if client.guild in guilds]
+
+    # ---------- Автодополнение ----------
+
+    async def autocomplete(self, lag):
+        args, bot = self.args, self.bot
+        latencies = []
+        spotify_before = self.spotify.requests
+
+        async def keystroke(user_id, text):
+            started = time.perf_counter()
+            await bot.play_autocomplete(FakeInteraction(user_id), text)
+            latencies.append(time.perf_counter() - started)
+
+        async def typist(user_id, text):
+            tasks = []
+            for length in range(1, len(text) + 1):
+                # Discord присылает запрос на каждую букву, не дожидаясь ответа на предыдущую
+                tasks.append(asyncio.get_running_loop().create_task(keystroke(user_id, text[:length])))
+                await asyncio.sleep(jitter_keystroke(self.rng))
+            await asyncio.gather(*tasks)
+
+        # Популярные запросы повторяются - как у настоящих пользователей
+        queries = [' '.join(self.rng.choices(WORDS, k=2)) for _ in range(max(1, args.typists // 4))]
+        started = time.perf_counter()
+        lag.start()
+        try:
+            await asyncio.gather(*(
+                typist(user_id, self.rng.choice(queries)) for user_id in range(1, args.typists + 1)
+            ))
+        finally:
+            samples = lag.stop()
+        stats = bot.autocomplete_engine.stats()
+        return summarize(
+            len(latencies), time.perf_counter() - started, latencies, samples,
+            users=args.typists,
+            spotify_requests=self.spotify.requests - spotify_before,
+            **{f'engine_{key}': value for key, value in stats.items() if isinstance(value, (int, float))}
+        )
+
+    # ---------- Веб-панель ----------
+
+    async def panel(self, lag):
+        from aiohttp.test_utils import TestClient, TestServer
+
+        import web_panel
+        args = self.args
+        client = TestClient(TestServer(web_panel.create_app()))
+        await client.start_server()
+        pages = max(1, len(self.guilds) // web_panel.GUILDS_PAGE_SIZE)
+        latencies = []
+        by_endpoint = {}
+        errors = 0
+
+        def next_request():
+            guild = self.rng.choice(self.guilds)
+            return self.rng.choice((
+                ('status', '/api/status'),
+                ('guilds', f'/api/guilds?page={self.rng.randint(1, pages)}'),
+                ('music', f'/api/guild/{guild.id}/music'),
+                ('voice_channels', f'/api/guild/{guild.id}/voice-channels'),
+                ('metrics', '/metrics'),
+            ))
+
+        async def worker(count):
+            nonlocal errors
+            for _ in range(count):
+                endpoint, path = next_request()
+                started = time.perf_counter()
+                async with client.get(path) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                elapsed = time.perf_counter() - started
+                latencies.append(elapsed)
+                by_endpoint.setdefault(endpoint, []).append(elapsed)
+
+        started = time.perf_counter()
+        lag.start()
+        try:
+            per_worker = max(1, args.panel_requests // args.panel_concurrency)
+            await asyncio.gather(*(worker(per_worker) for _ in range(args.panel_concurrency)))
+        finally:
+            samples = lag.stop()
+            await client.close()
+        return summarize(
+            len(latencies), time.perf_counter() - started, latencies, samples,
+            errors=errors,
+            concurrency=args.panel_concurrency,
+            **{f'{endpoint}_p95_ms': round(percentile(values, 0.95) * 1000, 2)
+               for endpoint, values in sorted(by_endpoint.items())}
+        )
+
+
+def jitter_keystroke(rng):
+    """Пауза между нажатиями клавиш: 60-200 мс"""
+    return rng.uniform(0.06, 0.2)
+
+
+def print_report(results):
+    print()
+    print(f'{"Сценарий":<13} {"Операций":>9} {"Оп/с":>9} {"p50 мс":>8} {"p95 мс":>8} {"p99 мс":>8} '
+          f'{"max мс":>8} {"Лаг p99":>8} {"Лаг max":>8} {"RSS МБ":>7}')
+    for name, result in results.items():
+        print(f'{name:<13} {result["operations"]:>9} {result["throughput"]:>9.1f} {result["p50_ms"]:>8.2f} '
+              f'{result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} {result["max_ms"]:>8.2f} '
+              f'{result["loop_lag_p99_ms"]:>8.2f} {result["loop_lag_max_ms"]:>8.2f} {result["rss_mb"]:>7.1f}')
+    for name, result in results.items():
+        extra = {key: value for key, value in result.items() if key not in (
+            'operations', 'seconds', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+            'loop_lag_p99_ms', 'loop_lag_max_ms', 'rss_mb'
+        )}
+        print(f'  {name}: ' + ', '.join(f'{key}={value}' for key, value in extra.items()))
+
+
+def print_comparison(results, baseline_path):
+    """Изменения числовых показателей относительно прошлого запуска"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['scenarios']
+    print(f'\nСравнение с {baseline_path}:')
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key, value in result.items():
+            old = before.get(key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            change = f'{(value - old) / old * 100:+.1f}%' if old else 'n/a'
+            print(f'  {name}.{key}: {old} -> {value} ({change})')
+
+
+async def run(args, bot, ytdl):
+    fake = FakeDiscord(bot.bot, rest_latency=args.rest_latency, gateway_latency=args.gateway_latency,
+                       seed=args.seed)
+    await fake.start()
+    bot.spotify = FakeSpotify(args.spotify_latency, seed=args.seed)
+    bot.create_source = lambda guild_id, track, start_at=0.0, cached=None: FakeTrackSource(
+        track, volume=bot.guild_volumes.get(guild_id, bot.DEFAULT_VOLUME), start_at=start_at
+    )
+
+    setup_started = time.perf_counter()
+    memory_before = rss_mb()
+    guilds = [
+        fake.add_guild(f'guild-{i}', text_channels=2, voice_channels=2, members=args.members)
+        for i in range(args.guilds)
+    ]
+    print(f'🏗️ {len(guilds)} серверов по {args.members} участников: {time.perf_counter() - setup_started:.2f} с, '
+          f'+{rss_mb() - memory_before:.1f} МБ')
+
+    test = LoadTest(bot, fake, guilds, args)
+    test.ytdl = ytdl
+    test.spotify = bot.spotify
+    lag = LagSampler()
+    results = {}
+    try:
+        for name in args.scenarios:
+            print(f'▶️ {name}...')
+            output = sys.stdout if args.verbose else open(os.devnull, 'w')
+            with contextlib.redirect_stdout(output):
+                results[name] = await getattr(test, name)(lag)
+            await asyncio.sleep(0.2)
+    finally:
+        fake.close()
+        bot.channel_store.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота с заменителями Discord, yt-dlp и Spotify')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='сценарии через запятую')
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=20, help='участников на сервере')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--rate', type=int, default=2000, help='сообщений в секунду')
+    parser.add_argument('--voice-guilds', type=int, default=200, help='серверов с исходным голосовым каналом')
+    parser.add_argument('--joins', type=int, default=3, help='участников, заходящих в исходный канал на сервере')
+    parser.add_argument('--delete-delay', type=float, default=1.0, help='TEMP_CHANNEL_DELETE_DELAY')
+    parser.add_argument('--play-guilds', type=int, default=50, help='серверов с !play')
+    parser.add_argument('--track-seconds', type=int, default=5, help='длительность треков')
+    parser.add_argument('--spotify-share', type=float, default=0.2, help='доля ссылок Spotify в !play')
+    parser.add_argument('--typists', type=int, default=200, help='пользователей автодополнения')
+    parser.add_argument('--panel-requests', type=int, default=2000)
+    parser.add_argument('--panel-concurrency', type=int, default=20)
+    parser.add_argument('--ytdl-latency', type=float, default=0.5, help='секунд на extract_info')
+    parser.add_argument('--spotify-latency', type=float, default=0.1, help='секунд на запрос Spotify')
+    parser.add_argument('--rest-latency', type=float, default=0.05, help='секунд на запрос REST API Discord')
+    parser.add_argument('--gateway-latency', type=float, default=0.01, help='задержка доставки событий шлюза')
+    parser.add_argument('--timeout', type=float, default=30, help='предельное ожидание завершения сценария')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    parser.add_argument('--compare', help='сравнить с результатами прошлого запуска (JSON)')
+    parser.add_argument('--verbose', action='store_true', help='показывать логи бота')
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(sorted(unknown))}')
+    json_path = os.path.abspath(args.json) if args.json else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    # Бот читает настройки при импорте и пишет данные в ./data
+    os.chdir(tempfile.mkdtemp(prefix='bot-load-test-'))
+    os.environ['WEB_PANEL_ENABLED'] = 'true'
+    os.environ['TEMP_CHANNEL_DELETE_DELAY'] = str(args.delete_delay)
+    os.environ.pop('SPOTIFY_CLIENT_ID', None)
+    ytdl = install_fake_ytdl(args.ytdl_latency, track_seconds=args.track_seconds, seed=args.seed)
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, 'w')):
+        import bot
+
+    results = asyncio.run(run(args, bot, ytdl))
+    print_report(results)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({'config': {key: value for key, value in vars(args).items() if key not in ('json', 'compare')},
+                       'scenarios': results}, f, ensure_ascii=False, indent=2)
+        print(f'\n💾 Результаты сохранены в {json_path}')
+    if compare_path:
+        print_comparison(results, compare_path)
+
+
+if __name__ == '__main__':
+    main()
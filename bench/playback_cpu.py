@@ -0,0 +1,118 @@
+"""
+Сравнение нагрузки на CPU режимов воспроизведения (PLAYBACK_MODE=pcm и opus)
+
+Для каждого режима несколько раз воспроизводит тестовый файл так же, как это делает
+AudioPlayer discord.py (чтение кадров и, для PCM, кодирование в Opus), но без пауз
+между кадрами. Выводит процессорное время на секунду звука отдельно для Python
+и для процессов FFmpeg.
+
+Использование:
+    python bench/playback_cpu.py [--streams 5] [--seconds 30]
+
+Нужен FFmpeg в PATH. Без libopus кодирование PCM не измеряется (будет предупреждение),
+и результат режима pcm окажется заниженным.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import discord  # noqa: E402
+
+import bot  # noqa: E402
+from audio_cache import CachedAudio  # noqa: E402
+from track_queue import ResolvedTrack  # noqa: E402
+
+
+def make_test_file(directory, seconds):
+    """Генерирует тестовый трек (шум, Opus в WebM) - как типичный аудиопоток YouTube"""
+    path = os.path.join(directory, 'bench.webm')
+    subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+         '-f', 'lavfi', '-i', f'anoisesrc=color=pink:duration={seconds}:sample_rate=48000',
+         '-ac', '2', '-c:a', 'libopus', '-b:a', '128k', path],
+        check=True
+    )
+    return path
+
+
+def cpu_times():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def play_through(source, encoder):
+    """Читает источник до конца, как AudioPlayer; возвращает число кадров"""
+    frames = 0
+    while True:
+        data = source.read()
+        if not data:
+            break
+        if encoder is not None and not source.is_opus():
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    source.cleanup()
+    return frames
+
+
+def run_mode(mode, path, streams, encoder):
+    track = ResolvedTrack(path, data={'id': 'bench', 'title': 'bench', 'webpage_url': path, 'url': path})
+    own_before, children_before = cpu_times()
+    started = time.perf_counter()
+    frames = 0
+    for _ in range(streams):
+        if mode == 'opus':
+            source = bot.OpusTrackSource(track, cached=CachedAudio(path, 0, 'opus'), volume=0.5)
+        else:
+            source = bot.YTDLSource(
+                discord.FFmpegPCMAudio(path, options='-vn'),
+                data=track.data, volume=0.5, track=track
+            )
+        frames += play_through(source, encoder)
+    wall = time.perf_counter() - started
+    own_after, children_after = cpu_times()
+    audio_seconds = frames * discord.opus.Encoder.FRAME_LENGTH / 1000
+    return {
+        'mode': mode,
+        'audio_seconds': audio_seconds,
+        'python_ms': (own_after - own_before) * 1000 / audio_seconds,
+        'ffmpeg_ms': (children_after - children_before) * 1000 / audio_seconds,
+        'wall_s': wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=5, help='сколько раз воспроизвести трек в каждом режиме')
+    parser.add_argument('--seconds', type=int, default=30, help='длительность тестового трека')
+    args = parser.parse_args()
+
+    encoder = None
+    if not discord.opus.is_loaded():
+        try:
+            discord.opus._load_default()
+        except Exception:
+            pass
+    if discord.opus.is_loaded():
+        encoder = discord.opus.Encoder()
+    else:
+        print('⚠️ libopus не найдена: кодирование PCM в Opus не измеряется, режим pcm занижен')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_test_file(directory, args.seconds)
+        results = [run_mode(mode, path, args.streams, encoder) for mode in ('pcm', 'opus')]
+
+    print(f'{"режим":<6} {"звук, с":>8} {"Python, мс/с":>13} {"FFmpeg, мс/с":>13} {"всего, мс/с":>12}')
+    for r in results:
+        total = r['python_ms'] + r['ffmpeg_ms']
+        print(f'{r["mode"]:<6} {r["audio_seconds"]:>8.1f} {r["python_ms"]:>13.2f} {r["ffmpeg_ms"]:>13.2f} {total:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
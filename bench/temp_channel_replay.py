@@ -0,0 +1,326 @@
+"""
+Воспроизведение всплесков событий голосовых каналов против менеджера временных каналов
+
+Поддельный сервер ведёт себя как Discord: создание, перемещение и удаление каналов
+занимают время, а события голосовых каналов приходят после изменения состояния
+(иногда дважды). Сценарии проверяют, что:
+  - канал не удаляется, пока в нём есть участники или в него перемещают участника;
+  - повторное событие не создаёт второй канал для того же участника;
+  - участника не перемещают в уже удалённый канал;
+  - канал с участниками, о которых бот уже получил событие, не удаляется;
+  - после ухода всех участников каналы удаляются.
+
+Использование:
+    python bench/temp_channel_replay.py [--members 50] [--seed 1] [--rounds 20]
+
+Код возврата 1, если хотя бы один сценарий нарушил проверки.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import discord  # noqa: E402
+
+from temp_channels import RateBucket, TempChannelManager  # noqa: E402
+
+SOURCE_CHANNEL_ID = 1
+DELETE_DELAY = 0.2
+
+
+def http_error(cls, status, message):
+    return cls(types.SimpleNamespace(status=status, reason=message), message)
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.category = None
+        self.members = []
+        # Участники по доставленным событиям - то, что видит бот в кэше discord.py
+        self.seen_members = set()
+
+    async def edit(self, name):
+        await self.guild.api_call()
+        self.name = name
+
+    async def delete(self):
+        guild = self.guild
+        if self.seen_members:
+            guild.violation(f'удалён канал {self.name} с участниками')
+        # Зашедших напрямую, чьё событие ещё не дошло, Discord отключит - этой гонки бот не видит
+        guild.kicked += len(self.members)
+        if any(target is self for target in guild.moving.values()):
+            guild.violation(f'удалён канал {self.name}, в который перемещают участника')
+        await guild.api_call()
+        if guild.channels.pop(self.id, None) is None:
+            raise http_error(discord.NotFound, 404, 'Unknown Channel')
+        guild.deleted += 1
+        # Discord отключает участников удалённого канала
+        for member in list(self.members):
+            guild.set_voice(member, None)
+
+
+class FakeMember:
+    def __init__(self, guild, member_id):
+        self.guild = guild
+        self.id = member_id
+        self.bot = False
+        self.display_name = f'user{member_id}'
+        self.voice = None
+
+    async def move_to(self, channel):
+        guild = self.guild
+        if channel is None or channel.id not in guild.channels:
+            guild.violation(f'{self.display_name} перемещают в удалённый канал')
+            raise http_error(discord.NotFound, 404, 'Unknown Channel')
+        guild.moving[self.id] = channel
+        try:
+            await guild.api_call()
+            if self.voice is None:
+                # Участник вышел из голосового канала, пока шёл запрос
+                raise http_error(discord.HTTPException, 400, 'Target user is not connected to voice')
+            if channel.id not in guild.channels:
+                raise http_error(discord.NotFound, 404, 'Unknown Channel')
+            guild.set_voice(self, channel)
+        finally:
+            guild.moving.pop(self.id, None)
+
+
+class FakeGuild:
+    """Сервер с задержками API и асинхронной доставкой событий голосовых каналов"""
+
+    def __init__(self, rng, *, latency=0.005, duplicate_rate=0.0):
+        self.id = 1
+        self.rng = rng
+        self.latency = latency
+        self.duplicate_rate = duplicate_rate
+        self.bitrate_limit = 96000
+        self.channels = {}
+        self.members = {}
+        self.moving = {}  # member_id -> канал, в который идёт перемещение
+        self.manager = None
+        self.events = asyncio.Queue()
+        self.violations = []
+        self.created = 0
+        self.deleted = 0
+        self.kicked = 0
+        self._next_id = 100
+        self.channels[SOURCE_CHANNEL_ID] = FakeChannel(self, SOURCE_CHANNEL_ID, 'Создать канал')
+
+    def violation(self, message):
+        self.violations.append(message)
+
+    async def api_call(self):
+        await asyncio.sleep(self.latency * (0.5 + self.rng.random()))
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def member(self, member_id):
+        if member_id not in self.members:
+            self.members[member_id] = FakeMember(self, member_id)
+        return self.members[member_id]
+
+    async def create_voice_channel(self, name, category, bitrate, user_limit):
+        await self.api_call()
+        if name != '🎵 Свободный канал' and any(c.name == name for c in self.channels.values()):
+            self.violation(f'второй канал {name}')
+        self._next_id += 1
+        channel = self.channels[self._next_id] = FakeChannel(self, self._next_id, name)
+        self.created += 1
+        return channel
+
+    def set_voice(self, member, channel):
+        """Меняет состояние участника и отправляет событие, как шлюз Discord"""
+        before = member.voice.channel if member.voice else None
+        if before is channel:
+            return
+        if before is not None:
+            before.members.remove(member)
+        if channel is not None:
+            channel.members.append(member)
+        member.voice = types.SimpleNamespace(channel=channel) if channel else None
+        due = time.monotonic() + self.latency * self.rng.random()
+        self.events.put_nowait((due, member, before, channel))
+        if self.rng.random() < self.duplicate_rate:
+            self.events.put_nowait((due, member, before, channel))
+
+    async def deliver_events(self):
+        """Доставляет события по порядку, каждое - с задержкой шлюза от момента изменения"""
+        while True:
+            due, member, before, after = await self.events.get()
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            if before is not None:
+                before.seen_members.discard(member.id)
+            if after is not None:
+                after.seen_members.add(member.id)
+            self.manager.voice_update(member, before, after)
+            self.events.task_done()
+
+    def temp_channels(self):
+        return [c for c in self.channels.values() if c.id != SOURCE_CHANNEL_ID]
+
+
+async def settle(guild, manager, timeout=10.0):
+    """Ждёт, пока все события доставлены, очередь менеджера пуста и таймеры удаления сработали"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await guild.events.join()
+        busy = manager._worker is not None and not manager._worker.done()
+        grace = any(channel.grace is not None for channel in manager.channels.values())
+        if not busy and not grace and not manager._joins and not manager._deletes and guild.events.empty():
+            return
+        await asyncio.sleep(0.02)
+    guild.violation('менеджер не успокоился за отведённое время')
+
+
+async def run_scenario(name, scenario, args, *, pool_size=0, duplicate_rate=0.0):
+    rng = random.Random(args.seed)
+    guild = FakeGuild(rng, duplicate_rate=duplicate_rate)
+    temp = set()
+    manager = guild.manager = TempChannelManager(
+        guild,
+        source_channel_id=lambda: SOURCE_CHANNEL_ID,
+        is_temp=lambda channel_id: channel_id in temp,
+        on_created=temp.add,
+        on_deleted=temp.discard,
+        bucket=RateBucket(1000, 1),
+        pool_size=pool_size,
+        delete_delay=DELETE_DELAY
+    )
+    deliverer = asyncio.create_task(guild.deliver_events())
+    started = time.perf_counter()
+    try:
+        await scenario(guild, manager, rng, args)
+        await settle(guild, manager)
+        # Все уходят - каналы (кроме запаса) должны быть удалены
+        for member in list(guild.members.values()):
+            guild.set_voice(member, None)
+        await settle(guild, manager)
+        leftover = len(guild.temp_channels()) - len(manager._pool)
+        if leftover:
+            guild.violation(f'не удалено пустых каналов: {leftover}')
+        if len(manager.channels) != len(manager._pool):
+            guild.violation(f'менеджер отслеживает лишние каналы: {len(manager.channels) - len(manager._pool)}')
+    finally:
+        deliverer.cancel()
+    elapsed = time.perf_counter() - started
+    status = 'OK' if not guild.violations else 'FAIL'
+    print(f'{name:<28} {status:<5} создано {guild.created:>4}  удалено {guild.deleted:>4}  отключено {guild.kicked:>3}  {elapsed:6.2f} с')
+    for message in sorted(set(guild.violations)):
+        print(f'    ⚠️ {message}')
+    return not guild.violations
+
+
+# ---------- Сценарии ----------
+
+async def join_storm(guild, manager, rng, args):
+    """Все участники одновременно заходят в исходный канал"""
+    source = guild.get_channel(SOURCE_CHANNEL_ID)
+    for member_id in range(1, args.members + 1):
+        guild.set_voice(guild.member(member_id), source)
+    await settle(guild, manager)
+    owned = [m for m in guild.members.values() if m.voice and m.voice.channel is not source]
+    if len(owned) != args.members or guild.created != args.members:
+        guild.violation(f'перемещено {len(owned)}, создано {guild.created} из {args.members}')
+
+
+async def rejoin_during_grace(guild, manager, rng, args):
+    """Участник выходит в исходный канал и возвращается до удаления своего канала"""
+    source = guild.get_channel(SOURCE_CHANNEL_ID)
+    members = [guild.member(member_id) for member_id in range(1, args.members + 1)]
+    for member in members:
+        guild.set_voice(member, source)
+    await settle(guild, manager)
+    own = {member.id: member.voice.channel for member in members}
+    for _ in range(args.rounds):
+        for member in rng.sample(members, max(1, len(members) // 4)):
+            guild.set_voice(member, None)
+            guild.set_voice(member, source)
+        await asyncio.sleep(DELETE_DELAY / 4)
+    await settle(guild, manager)
+    moved = sum(1 for member in members if member.voice and member.voice.channel is own[member.id])
+    if moved != len(members) or guild.deleted:
+        guild.violation(f'вернулись в свой канал {moved} из {len(members)}, удалено {guild.deleted}')
+
+
+async def leave_during_move(guild, manager, rng, args):
+    """Участник отключается, пока бот создаёт для него канал или перемещает его"""
+    source = guild.get_channel(SOURCE_CHANNEL_ID)
+    for member_id in range(1, args.members + 1):
+        member = guild.member(member_id)
+        guild.set_voice(member, source)
+        await asyncio.sleep(guild.latency * rng.random() * 3)
+        guild.set_voice(member, None)
+
+
+async def join_while_delete_queued(guild, manager, rng, args):
+    """Участник возвращается в канал, удаление которого уже стоит в очереди за созданием других"""
+    source = guild.get_channel(SOURCE_CHANNEL_ID)
+    first = guild.member(1)
+    guild.set_voice(first, source)
+    await settle(guild, manager)
+    channel = first.voice.channel
+    guild.set_voice(first, None)
+    await asyncio.sleep(DELETE_DELAY * 0.9)
+    # Очередь занята созданием каналов для других участников, когда истекает задержка удаления
+    for member_id in range(2, args.members + 2):
+        guild.set_voice(guild.member(member_id), source)
+    await asyncio.sleep(DELETE_DELAY * 0.15)
+    if channel.id in guild.channels:
+        guild.set_voice(first, channel)
+    await settle(guild, manager)
+    if first.voice is None or first.voice.channel is not channel:
+        guild.violation('вернувшийся участник потерял свой канал')
+
+
+async def random_walk(guild, manager, rng, args):
+    """Случайные заходы, выходы и переходы между каналами"""
+    source = guild.get_channel(SOURCE_CHANNEL_ID)
+    members = [guild.member(member_id) for member_id in range(1, args.members + 1)]
+    for _ in range(args.rounds * args.members):
+        member = rng.choice(members)
+        choice = rng.random()
+        if choice < 0.4:
+            guild.set_voice(member, source)
+        elif choice < 0.6:
+            guild.set_voice(member, None)
+        else:
+            channels = guild.temp_channels()
+            if channels:
+                guild.set_voice(member, rng.choice(channels))
+        await asyncio.sleep(guild.latency * rng.random())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--members', type=int, default=50, help='Участников в сценарии')
+    parser.add_argument('--seed', type=int, default=1, help='Зерно генератора случайных чисел')
+    parser.add_argument('--rounds', type=int, default=20, help='Повторов в сценариях с циклами')
+    args = parser.parse_args()
+
+    results = [
+        await run_scenario('Одновременный заход', join_storm, args),
+        await run_scenario('Двойные события', join_storm, args, duplicate_rate=0.5),
+        await run_scenario('Возврат до удаления', rejoin_during_grace, args),
+        await run_scenario('Уход во время перемещения', leave_during_move, args),
+        await run_scenario('Заход при удалении в очереди', join_while_delete_queued, args),
+        await run_scenario('Случайные переходы', random_walk, args, duplicate_rate=0.2),
+        await run_scenario('Случайные переходы с запасом', random_walk, args, pool_size=3, duplicate_rate=0.2),
+    ]
+    return all(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
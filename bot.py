@@ -1,26 +1,41 @@
+import time
+STARTUP_STARTED = time.perf_counter()  # Отсчёт этапов запуска - до импорта тяжёлых модулей
 import discord
 from discord.ext import commands
 from discord import app_commands
 import os
 import asyncio
 import re
+import traceback
+import weakref
+from collections import deque
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import yt_dlp
-
-import json
+from extraction import ExtractionCancelled, ExtractionService
+from search_cache import SearchCache, query_key, spotify_key
+from spotify_client import SpotifyClient
+from autocomplete import AutocompleteEngine
+from track_queue import STREAM_URL_EXPIRY_MARGIN, ResolvedTrack, TrackQueue
+from audio_cache import AudioCache
+from player_engine import GuildPlayer
+from cluster import CHANNEL_STORE_FILE, VOICE_CHANNELS_FILE, ClusterHealthServer
+from channel_store import ChannelStore
+from temp_channels import EMPTY_GRACE, RateBucket, TempChannelManager
+from relay import FILTER_REGEX, MessageRelay, RelayRoute, RelayTable, check_regex, parse_filter
+import metrics
+from loop_watchdog import LoopWatchdog
+from startup import StartupTimer, sync_commands
+from idle_sessions import EMPTY_CHANNEL, PAUSED, QUEUE_EMPTY, REASON_TITLES, IdleSessionReaper
 
 # Загружаем переменные окружения
 load_dotenv()
 
 # Настройки бота
 TOKEN = os.getenv('DISCORD_TOKEN')
+# Маршрут повтора из переменных окружения (остальные маршруты настраиваются командой !relay)
 SOURCE_CHANNEL_ID = int(os.getenv('SOURCE_CHANNEL_ID', 0))  # ID канала, из которого повторять
 TARGET_CHANNEL_ID = int(os.getenv('TARGET_CHANNEL_ID', 0))  # ID канала, в который повторять (0 = тот же канал)
-
-# Файл для хранения настроек голосовых каналов
-VOICE_CHANNELS_FILE = os.path.join('data', 'voice_channels.json')
+# Сколько сообщений может ждать отправки в очереди целевого канала (остальные отбрасываются)
+RELAY_QUEUE_SIZE = int(os.getenv('RELAY_QUEUE_SIZE', 100))
 
 # Убедимся, что директория data существует
 os.makedirs('data', exist_ok=True)
@@ -34,53 +49,122 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
 
+# Кластерный режим (cluster.py): лаунчер передаёт процессу его диапазон шардов
+CLUSTER_ID = os.getenv('CLUSTER_ID')
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()]
+
+class MusicBotHooks:
+    """Запуск фоновых служб перед подключением к Discord и их остановка при завершении"""
+
+    async def setup_hook(self):
+        await start_services()
+
+    async def close(self):
+        await stop_services()
+        await super().close()
+
+
+class MusicBot(MusicBotHooks, commands.Bot):
+    pass
+
+
+class ShardedMusicBot(MusicBotHooks, commands.AutoShardedBot):
+    pass
+
+
 # Создаём бота
-bot = commands.Bot(command_prefix='!', intents=intents)
+if SHARD_COUNT or SHARD_IDS:
+    bot = ShardedMusicBot(
+        command_prefix='!',
+        intents=intents,
+        shard_count=SHARD_COUNT or None,
+        shard_ids=SHARD_IDS or None
+    )
+else:
+    bot = MusicBot(command_prefix='!', intents=intents)
 tree = bot.tree  # Для слэш-команд и autocomplete
 
 # Инициализация Spotify (если указаны ключи)
+# Асинхронный клиент: запросы к Spotify не блокируют event loop бота
+SPOTIFY_MAX_CONCURRENCY = int(os.getenv('SPOTIFY_MAX_CONCURRENCY', 4))
+# Максимум треков, добавляемых в очередь из одного альбома или плейлиста
+SPOTIFY_COLLECTION_LIMIT = int(os.getenv('SPOTIFY_COLLECTION_LIMIT', 1000))
+
+SPOTIFY_REQUEST_SECONDS = metrics.registry.histogram(
+    'bot_spotify_request_seconds', 'Время запроса к Spotify API', ('endpoint', 'status')
+)
+
 spotify = None
 if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
     try:
-        client_credentials_manager = SpotifyClientCredentials(
-            client_id=SPOTIFY_CLIENT_ID,
-            client_secret=SPOTIFY_CLIENT_SECRET
+        spotify = SpotifyClient(
+            SPOTIFY_CLIENT_ID,
+            SPOTIFY_CLIENT_SECRET,
+            max_concurrency=SPOTIFY_MAX_CONCURRENCY,
+            on_request=lambda endpoint, seconds, status: SPOTIFY_REQUEST_SECONDS.observe(
+                seconds, endpoint=endpoint, status=status
+            )
         )
-        spotify = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
         print("✅ Spotify API подключен")
     except Exception as e:
         print(f"⚠️ Ошибка подключения к Spotify API: {e}")
 
 # Словарь для хранения очередей воспроизведения для каждого сервера
+# Ключ: guild_id, Значение: TrackQueue
 music_queues = {}
 
-def load_voice_channels():
-    """Загружает настройки голосовых каналов из файла"""
-    if os.path.exists(VOICE_CHANNELS_FILE):
-        try:
-            with open(VOICE_CHANNELS_FILE, 'r') as f:
-                data = json.load(f)
-                # Конвертируем ключи (guild_id) обратно в int
-                return {int(k): v for k, v in data.items()}
-        except Exception as e:
-            print(f"Ошибка загрузки настроек каналов: {e}")
-    return {}
 
-def save_voice_channels():
-    """Сохраняет настройки голосовых каналов в файл"""
+def get_queue(guild_id):
+    """Возвращает (создаёт при необходимости) очередь сервера"""
+    if guild_id not in music_queues:
+        music_queues[guild_id] = TrackQueue()
+    return music_queues[guild_id]
+
+# Уведомление веб-панели об изменениях (устанавливается, если панель включена)
+panel_notify = None
+
+
+def notify_panel(kind, guild_id=None):
+    """Сообщает открытым вкладкам веб-панели, что состояние бота или сервера изменилось"""
+    if panel_notify:
+        panel_notify(kind, guild_id)
+
+# Настройки каналов пишутся в SQLite в фоне: изменения за CHANNEL_STORE_FLUSH_DELAY секунд - одной транзакцией
+CHANNEL_STORE_FLUSH_DELAY = float(os.getenv('CHANNEL_STORE_FLUSH_DELAY', 1))
+
+channel_store = ChannelStore(CHANNEL_STORE_FILE, flush_delay=CHANNEL_STORE_FLUSH_DELAY)
+# Старый JSON-файл переносится в базу при первом запуске; в кластере это делает лаунчер
+if CLUSTER_ID is None:
     try:
-        with open(VOICE_CHANNELS_FILE, 'w') as f:
-            json.dump(source_voice_channels, f)
+        imported = channel_store.import_json(VOICE_CHANNELS_FILE)
+        if imported:
+            print(f'✅ Настройки {imported} голосовых каналов перенесены из {VOICE_CHANNELS_FILE}')
     except Exception as e:
-        print(f"Ошибка сохранения настроек каналов: {e}")
+        print(f"Ошибка переноса настроек каналов: {e}")
 
 # Словарь для хранения исходных голосовых каналов для каждого сервера
 # Ключ: guild_id, Значение: voice_channel_id
-source_voice_channels = load_voice_channels()
+source_voice_channels = channel_store.load_source_channels()
 
-# Множество для хранения созданных ботом голосовых каналов
+# Множество для хранения созданных ботом голосовых каналов (сохраняется, чтобы удалить их после перезапуска)
 # Ключ: guild_id, Значение: set(channel_id)
-created_voice_channels = {}
+created_voice_channels = channel_store.load_temp_channels()
+
+
+def remember_temp_channel(guild_id, channel_id):
+    created_voice_channels.setdefault(guild_id, set()).add(channel_id)
+    channel_store.add_temp_channel(guild_id, channel_id)
+
+
+def forget_temp_channel(guild_id, channel_id):
+    channels = created_voice_channels.get(guild_id)
+    if channels is not None:
+        channels.discard(channel_id)
+        if not channels:
+            del created_voice_channels[guild_id]
+    channel_store.remove_temp_channel(channel_id)
+
 
 # Настройки yt-dlp
 ytdl_format_options = {
@@ -102,113 +186,724 @@ ffmpeg_options = {
     'options': '-vn'
 }
 
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+# Пул извлечения: у каждого рабочего потока (или процесса) свой YoutubeDL
+YTDL_WORKERS = int(os.getenv('YTDL_WORKERS', 4))
+YTDL_WORKER_MODE = os.getenv('YTDL_WORKER_MODE', 'thread')  # thread или process
+YTDL_MAX_PENDING = int(os.getenv('YTDL_MAX_PENDING', 100))
+# Потоки скачивания в локальный кэш аудио (отдельно от пула и очереди извлечения)
+AUDIO_CACHE_DOWNLOAD_WORKERS = int(os.getenv('AUDIO_CACHE_DOWNLOAD_WORKERS', 1))
+
+extraction_service = ExtractionService(
+    ytdl_format_options,
+    workers=YTDL_WORKERS,
+    mode=YTDL_WORKER_MODE,
+    max_pending=YTDL_MAX_PENDING,
+    download_workers=AUDIO_CACHE_DOWNLOAD_WORKERS,
+)
+
+# Постоянный кэш результатов поиска: запрос / Spotify ID -> видео на YouTube
+SEARCH_CACHE_ENABLED = os.getenv('SEARCH_CACHE_ENABLED', 'true').lower() == 'true'
+SEARCH_CACHE_FILE = os.path.join('data', 'search_cache.db')
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 7 * 24 * 60 * 60))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 5000))
+
+search_cache = None
+if SEARCH_CACHE_ENABLED:
+    try:
+        search_cache = SearchCache(SEARCH_CACHE_FILE, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+    except Exception as e:
+        print(f"⚠️ Ошибка открытия кэша поиска: {e}")
+
+# Локальный кэш аудио для часто играющих треков (по умолчанию выключен)
+AUDIO_CACHE_ENABLED = os.getenv('AUDIO_CACHE_ENABLED', 'false').lower() == 'true'
+AUDIO_CACHE_DIR = os.path.join('data', 'audio_cache')
+AUDIO_CACHE_MAX_MB = int(os.getenv('AUDIO_CACHE_MAX_MB', 1024))
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv('AUDIO_CACHE_MIN_PLAYS', 2))
+if CLUSTER_ID is not None:
+    # У каждого процесса кластера свой каталог и своя доля общего размера кэша
+    AUDIO_CACHE_DIR = os.path.join(AUDIO_CACHE_DIR, f'cluster-{CLUSTER_ID}')
+    AUDIO_CACHE_MAX_MB //= max(1, int(os.getenv('CLUSTER_COUNT', 1)))
+
+# Опции yt-dlp для скачивания в кэш: предпочитаем Opus, чтобы играть его без перекодирования
+audio_cache_ytdl_options = {
+    **ytdl_format_options,
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
+    # Кодек в имени файла: по нему кэш решает, можно ли отдать файл без перекодирования
+    'outtmpl': os.path.join(AUDIO_CACHE_DIR, '%(id)s.%(acodec)s.%(ext)s'),
+}
+
+# Предзагрузка очереди: сколько следующих треков готовить заранее
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', 2))
+# Ссылки, которые истекут раньше этого запаса (секунды), предзагрузка обновляет заранее
+PREFETCH_REFRESH_MARGIN = int(os.getenv('PREFETCH_REFRESH_MARGIN', 15 * 60))
+# Как часто (секунды) предзагрузка сама перепроверяет очередь
+PREFETCH_INTERVAL = 60
+
+
+EXTRACTION_SECONDS = metrics.registry.histogram(
+    'bot_extraction_seconds', 'Время извлечения информации о треке через yt-dlp (с ожиданием в очереди)',
+    ('kind',), buckets=metrics.EXTRACTION_BUCKETS
+)
+EXTRACTION_ERRORS = metrics.registry.counter(
+    'bot_extraction_errors_total', 'Ошибки извлечения информации о треке', ('kind',)
+)
+
+
+async def extract_info(query, *, guild_id=None, download=False):
+    """Извлекает информацию о треке через пул yt-dlp без блокировки event loop"""
+    kind = 'search' if query.startswith('ytsearch') else 'download' if download else 'url'
+    try:
+        with EXTRACTION_SECONDS.time(kind=kind):
+            data = await extraction_service.extract(query, guild_id=guild_id, download=download)
+    except ExtractionCancelled:
+        raise
+    except Exception:
+        EXTRACTION_ERRORS.inc(kind=kind)
+        raise
+
+    if 'entries' in data:
+        # Берём первый результат, если это плейлист или поиск
+        if not data['entries']:
+            raise ValueError(f'Ничего не найдено по запросу: {query}')
+        data = data['entries'][0]
+    return data
+
+
+async def _resolve_cached(track, keys, guild_id):
+    """Пробует найти видео в кэше поиска и получить ссылку на поток без поиска"""
+    if not search_cache:
+        return False
+    for key in keys:
+        cached = await search_cache.get(key)
+        if not cached:
+            continue
+        try:
+            track.update(await extract_info(cached['webpage_url'], guild_id=guild_id))
+            return True
+        except ExtractionCancelled:
+            raise
+        except Exception as e:
+            # Видео могло быть удалено - ищем заново
+            print(f'⚠️ Закэшированное видео недоступно ({cached["webpage_url"]}): {e}')
+    return False
+
+
+async def _resolve(track, margin, guild_id):
+    """Находит трек на YouTube или обновляет истёкшую ссылку на поток"""
+    if track.is_resolved:
+        # Трек уже найден: обновляем ссылку по странице видео, без повторного поиска
+        if track.is_expired(margin):
+            track.update(await extract_info(track.webpage_url or track.query, guild_id=guild_id))
+        return track
+
+    search_query = track.search_query or track.query
+    cache_keys = []
+    kind, spotify_id = parse_spotify_url(track.query)
+    if kind == 'track':
+        cache_keys.append(spotify_key(spotify_id))
+    if not extract_spotify_url(search_query) and not search_query.startswith('http'):
+        cache_keys.append(query_key(search_query))
+    if await _resolve_cached(track, cache_keys, guild_id):
+        return track
+
+    if extract_spotify_url(search_query):
+        # Заготовка из Spotify: сначала получаем название трека
+        track_info = await get_spotify_track_info(search_query)
+        if track_info:
+            search_query = track_info['search_query']
+            track.search_query = search_query
+            cache_keys.append(query_key(search_query))
+            if await _resolve_cached(track, cache_keys[-1:], guild_id):
+                return track
+    # Прямые ссылки отдаём yt-dlp как есть, всё остальное (включая Spotify URL) ищем на YouTube
+    if not search_query.startswith('http') or extract_spotify_url(search_query):
+        search_query = f"ytsearch1:{search_query}"
+    track.update(await extract_info(search_query, guild_id=guild_id))
+    if search_cache and cache_keys:
+        await search_cache.put(cache_keys, track.data)
+    return track
+
+
+async def ensure_resolved(track, *, margin=STREAM_URL_EXPIRY_MARGIN, guild_id=None):
+    """Гарантирует, что у трека есть действующая ссылка на поток.
+
+    Одновременные вызовы (воспроизведение и предзагрузка) ждут одну и ту же задачу.
+    """
+    if track.is_resolved and not track.is_expired(margin):
+        return track
+    if track._resolving is None or track._resolving.done():
+        track._resolving = asyncio.ensure_future(_resolve(track, margin, guild_id))
+    return await asyncio.shield(track._resolving)
+
+
+async def resolve_track(query, search_query=None, *, guild_id=None):
+    """Находит трек на YouTube один раз и возвращает ResolvedTrack для очереди"""
+    return await ensure_resolved(ResolvedTrack(query, search_query=search_query), guild_id=guild_id)
+
+
+# Громкость по умолчанию и выбранная громкость для каждого сервера (0.0 - 1.0).
+# С кэшем аудио - 100%: только без изменения громкости Opus из кэша уходит в Discord без перекодирования
+DEFAULT_VOLUME = 1.0 if AUDIO_CACHE_ENABLED else 0.5
+guild_volumes = {}
+
+# Режим воспроизведения:
+# pcm  - FFmpeg отдаёт PCM, громкость и кодирование в Opus выполняет discord.py в Python
+# opus - FFmpeg сам применяет громкость и кодирует в Opus, Python только пересылает пакеты
+PLAYBACK_MODE = os.getenv('PLAYBACK_MODE', 'pcm').lower()
+# Нормализация громкости (фильтр loudnorm FFmpeg, только в режиме opus)
+AUDIO_LOUDNORM = os.getenv('AUDIO_LOUDNORM', 'false').lower() == 'true'
+
+# Плеер сервера: длительность плавного перехода между треками (0 - переход без паузы, но и без смешивания),
+# за сколько секунд до конца трека запускать следующий и сколько звука держать в буфере
+PLAYER_CROSSFADE = float(os.getenv('PLAYER_CROSSFADE', 0))
+PLAYER_PRELOAD_SECONDS = float(os.getenv('PLAYER_PRELOAD_SECONDS', 15))
+PLAYER_BUFFER_SECONDS = float(os.getenv('PLAYER_BUFFER_SECONDS', 2))
+# Сколько раз подряд перезапускать трек с позиции обрыва потока (0 - обрыв считается концом трека)
+PLAYER_MAX_RESUMES = int(os.getenv('PLAYER_MAX_RESUMES', 3))
+
+
+# Созданные источники FFmpeg: по ним считается число запущенных процессов для метрик
+ffmpeg_sources = weakref.WeakSet()
+
+
+def _ffmpeg_running(source):
+    process = getattr(source, '_process', None)
+    return hasattr(process, 'poll') and process.poll() is None
+
+
+def ffmpeg_process_count():
+    return sum(1 for source in list(ffmpeg_sources) if _ffmpeg_running(source))
+
+
+def kill_orphan_ffmpeg(connected_guilds):
+    """Завершает FFmpeg серверов, где бот не подключён к голосу; возвращает число процессов"""
+    killed = 0
+    for source in list(ffmpeg_sources):
+        guild_id = getattr(source, 'guild_id', None)
+        if guild_id is not None and guild_id not in connected_guilds and _ffmpeg_running(source):
+            source.cleanup()
+            killed += 1
+    return killed
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
+    def __init__(self, source, *, data, volume=DEFAULT_VOLUME, track=None, start_at=0.0):
         super().__init__(source, volume)
+        ffmpeg_sources.add(source)
         self.data = data
         self.title = data.get('title')
         self.url = data.get('url')
+        self.track = track  # ResolvedTrack, из которого создан источник
+        self.start_at = start_at  # С какой секунды трека запущен FFmpeg
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(
-            None, lambda: ytdl.extract_info(url, download=not stream)
+    def from_track(cls, track, volume=DEFAULT_VOLUME, start_at=0.0):
+        """Создаёт источник из уже найденного трека без повторного обращения к yt-dlp"""
+        before_options = ffmpeg_options['before_options'] + (f' -ss {start_at:.2f}' if start_at else '')
+        return cls(
+            discord.FFmpegPCMAudio(track.stream_url, before_options=before_options, options=ffmpeg_options['options']),
+            data=track.data, volume=volume, track=track, start_at=start_at
+        )
+
+
+class OpusTrackSource(discord.FFmpegOpusAudio):
+    """Трек в режиме Opus: громкость применяет FFmpeg, он же кодирует звук в Opus.
+
+    Python не трогает PCM-кадры (нет PCMVolumeTransformer и кодирования в discord.py),
+    поэтому смена громкости перезапускает FFmpeg с текущей позиции.
+    """
+
+    def __init__(self, track, *, cached=None, volume=DEFAULT_VOLUME, start_at=0.0):
+        self.track = track
+        self.data = track.data
+        self.title = track.title
+        self.cached = cached  # Файл из локального кэша (CachedAudio) или None для потока из сети
+        path = cached.path if cached else None
+        self.url = path or track.stream_url
+        self.volume = volume
+        self.start_at = start_at
+        self.guild_id = None  # Сервер, для которого запущен FFmpeg
+
+        before_options = [] if path else [ffmpeg_options['before_options']]
+        if start_at:
+            before_options.append(f'-ss {start_at:.2f}')
+        filters = []
+        if AUDIO_LOUDNORM:
+            filters.append('loudnorm')
+        if volume != 1.0:
+            filters.append(f'volume={volume:.2f}')
+        options = '-vn' + (f' -filter:a "{",".join(filters)}"' if filters else '')
+        # Без фильтров Opus из кэша уходит в Discord как есть
+        codec = 'copy' if cached and not filters and cached.is_opus else None
+
+        super().__init__(
+            self.url,
+            codec=codec,
+            before_options=' '.join(before_options) or None,
+            options=options
+        )
+        ffmpeg_sources.add(self)
+
+    def restarted(self, *, volume, start_at):
+        """Новый источник того же трека с другой громкостью и позицией (новый процесс FFmpeg).
+
+        Позицию передаёт плеер (BufferedTrack.position): он считает отправленные, а не прочитанные кадры.
+        """
+        source = OpusTrackSource(self.track, cached=self.cached, volume=volume, start_at=start_at)
+        source.guild_id = self.guild_id
+        return source
+
+
+def create_source(guild_id, track, *, start_at=0.0, cached=None):
+    """Создаёт источник звука для трека с учётом режима, локального кэша и громкости сервера.
+
+    cached - файл трека в локальном кэше, найденный вызывающим (CachedAudio или None).
+    """
+    source = _create_source(guild_id, track, start_at, cached)
+    # FFmpeg помечается сервером: после отключения от голоса оставшиеся процессы завершаются
+    getattr(source, 'original', source).guild_id = guild_id
+    return source
+
+
+def _create_source(guild_id, track, start_at, cached):
+    volume = guild_volumes.get(guild_id, DEFAULT_VOLUME)
+    if PLAYBACK_MODE == 'opus':
+        return OpusTrackSource(track, cached=cached, volume=volume, start_at=start_at)
+    if cached:
+        if volume == 1.0 and cached.is_opus:
+            # Громкость 100%: Opus с диска уходит в Discord как есть, без кодирования в Python
+            return OpusTrackSource(track, cached=cached, volume=volume, start_at=start_at)
+        return YTDLSource(
+            discord.FFmpegPCMAudio(cached.path, before_options=f'-ss {start_at:.2f}' if start_at else None, options='-vn'),
+            data=track.data, volume=volume, track=track, start_at=start_at
+        )
+    return YTDLSource.from_track(track, volume, start_at)
+
+
+def set_guild_volume(guild_id, volume):
+    """Запоминает громкость сервера; возвращает True, если она применена к текущему треку"""
+    guild_volumes[guild_id] = volume
+    notify_panel('music', guild_id)
+    player = guild_players.get(guild_id)
+    if player is None or player.current is None:
+        return False
+    # PCM - сразу, треки с громкостью в FFmpeg перезапускаются с текущей позиции
+    player.set_volume(volume)
+    return True
+
+
+async def download_to_cache(url):
+    """Скачивает аудио трека в каталог локального кэша; возвращает путь к файлу и кодек"""
+    data = await extraction_service.download(url, audio_cache_ytdl_options)
+    download = data['requested_downloads'][0]
+    return download['filepath'], download.get('acodec') or data.get('acodec')
+
+
+audio_cache = None
+if AUDIO_CACHE_ENABLED:
+    try:
+        audio_cache = AudioCache(
+            AUDIO_CACHE_DIR,
+            download_to_cache,
+            max_bytes=AUDIO_CACHE_MAX_MB * 1024 ** 2,
+            min_plays=AUDIO_CACHE_MIN_PLAYS
         )
+    except Exception as e:
+        print(f"⚠️ Ошибка инициализации кэша аудио: {e}")
 
-        if 'entries' in data:
-            # Берём первый результат, если это плейлист
-            data = data['entries'][0]
 
-        filename = data['url'] if stream else ytdl.prepare_filename(data)
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+def cluster_health():
+    """Состояние процесса для лаунчера и веб-панели кластера"""
+    if isinstance(bot, commands.AutoShardedBot):
+        latencies = {shard_id: latency for shard_id, latency in bot.latencies}
+    else:
+        latencies = {0: bot.latency}
+    return {
+        'cluster_id': int(CLUSTER_ID or 0),
+        'pid': os.getpid(),
+        'status': 'online' if bot.is_ready() else 'starting',
+        'shard_ids': SHARD_IDS or sorted(latencies),
+        'shard_count': bot.shard_count or 1,
+        # До подключения шарда задержка неизвестна (NaN)
+        'latency_ms': {
+            str(shard_id): None if latency != latency else round(latency * 1000)
+            for shard_id, latency in latencies.items()
+        },
+        'guilds': len(bot.guilds),
+        'voice_connections': len(bot.voice_clients),
+        'players': len(guild_players),
+        'uptime': int(metrics.uptime()),
+    }
+
+
+def gateway_latencies():
+    """Задержка шлюза Discord по шардам (секунды); неподключённые шарды пропускаются"""
+    if isinstance(bot, commands.AutoShardedBot):
+        latencies = bot.latencies
+    else:
+        latencies = [(0, bot.latency)]
+    return {str(shard_id): latency for shard_id, latency in latencies if latency == latency}
+
+
+metrics.registry.gauge('bot_gateway_latency_seconds', 'Задержка шлюза Discord', gateway_latencies, ('shard',))
+metrics.registry.gauge('bot_guilds', 'Число серверов', lambda: len(bot.guilds))
+metrics.registry.gauge('bot_voice_connections', 'Активные голосовые подключения', lambda: len(bot.voice_clients))
+metrics.registry.gauge('bot_players', 'Плееры серверов', lambda: len(guild_players))
+metrics.registry.gauge('bot_ffmpeg_processes', 'Запущенные процессы FFmpeg', ffmpeg_process_count)
+metrics.registry.gauge('bot_queue_depth', 'Треков в очереди сервера (только непустые очереди)', lambda: {
+    str(guild_id): len(queue) for guild_id, queue in list(music_queues.items()) if queue
+}, ('guild',))
+
+# Сторож event loop: при задержке дольше порога в лог и веб-панель попадает стек блокирующего кода
+LOOP_WATCHDOG_THRESHOLD_MS = int(os.getenv('LOOP_WATCHDOG_THRESHOLD_MS', 250))
+LOOP_WATCHDOG_INCIDENTS = int(os.getenv('LOOP_WATCHDOG_INCIDENTS', 50))
+
+loop_watchdog = LoopWatchdog(
+    threshold=LOOP_WATCHDOG_THRESHOLD_MS / 1000,
+    max_incidents=LOOP_WATCHDOG_INCIDENTS,
+    on_lag=metrics.LOOP_LAG.observe
+)
+metrics.registry.function_counter(
+    'bot_event_loop_stalls_total', 'Блокировки event loop дольше порога сторожа', lambda: loop_watchdog.total_incidents
+)
+
+# Отдельный HTTP-сервер метрик (0 - только /metrics веб-панели); в кластере порт + CLUSTER_ID
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Синхронизация слэш-команд: auto - только при изменении схемы команд, always - при каждом запуске, never - не синхронизировать
+COMMAND_SYNC = os.getenv('COMMAND_SYNC', 'auto').lower()
+COMMAND_HASH_FILE = os.path.join('data', 'command_tree.json')
+
+startup_timer = StartupTimer(STARTUP_STARTED)
+metrics.registry.gauge(
+    'bot_startup_phase_seconds', 'Длительность этапов запуска', lambda: dict(startup_timer.phases), ('phase',)
+)
+# Первый on_ready процесса; при переподключениях к шлюзу команды не синхронизируются повторно
+first_ready = True
+
+
+async def start_services():
+    """Вызывается один раз перед подключением к Discord (setup_hook)"""
+    startup_timer.begin('setup_hook')
+    if CLUSTER_ID is not None:
+        # Лаунчер и веб-панель опрашивают процесс через Unix-сокет
+        health_server = ClusterHealthServer(int(CLUSTER_ID), {'health': cluster_health})
+        await health_server.start()
+        print(f'✅ Кластер {CLUSTER_ID}: шарды {SHARD_IDS}, сокет {health_server.path}')
+    
+    loop_watchdog.start(asyncio.get_running_loop())
+    idle_reaper.start(asyncio.get_running_loop())
+    if METRICS_PORT:
+        port = METRICS_PORT + int(CLUSTER_ID or 0)
+        try:
+            await metrics.start_metrics_server(port=port)
+            print(f'📈 Метрики доступны на http://0.0.0.0:{port}/metrics')
+        except Exception as e:
+            print(f'❌ Ошибка запуска сервера метрик: {e}')
+    
+    if start_web_panel:
+        try:
+            await start_web_panel(host='0.0.0.0', port=WEB_PANEL_PORT)
+            print(f'🚀 Веб-панель запущена на порту {WEB_PANEL_PORT}')
+        except Exception as e:
+            print(f'❌ Ошибка в веб-панели: {e}')
+            traceback.print_exc()
+    startup_timer.end('setup_hook')
+    startup_timer.begin('gateway')
+
+
+async def stop_services():
+    """Завершение работы (close): закрывает HTTP-сессию Spotify и пулы yt-dlp, дописывает кэш поиска"""
+    if spotify:
+        try:
+            await spotify.close()
+        except Exception as e:
+            print(f'⚠️ Ошибка закрытия сессии Spotify: {e}')
+    # Рабочие потоки/процессы извлечения и скачивания в кэш; ожидающие поиски отменяются
+    extraction_service.shutdown()
+    if search_cache:
+        try:
+            await search_cache.flush()
+        except Exception as e:
+            print(f'⚠️ Ошибка записи кэша поиска: {e}')
 
 
 @bot.event
 async def on_ready():
-    """Вызывается при готовности бота"""
+    """Вызывается при готовности бота (и после переподключения к шлюзу с новой сессией)"""
+    global first_ready
     print(f'{bot.user} подключился к Discord!')
     print(f'Бот работает на {len(bot.guilds)} серверах')
+    startup_timer.end('gateway')
+    
+    with startup_timer.phase('reconcile'):
+        await reconcile_temp_channels()
+    
+    if not first_ready:
+        return
+    first_ready = False
     
     # Выводим список всех загруженных команд
     print(f'📋 Загружено команд: {len(bot.commands)}')
     for cmd in bot.commands:
         print(f'  - {cmd.name} (алиасы: {cmd.aliases})')
     
-    # Синхронизируем команды (для autocomplete)
-    try:
-        synced = await tree.sync()
-        print(f'✅ Синхронизировано {len(synced)} команд')
-    except Exception as e:
-        print(f'❌ Ошибка синхронизации команд: {e}')
+    # Синхронизируем команды (для autocomplete) только при изменении их схемы;
+    # в кластере это делает только первый процесс
+    if CLUSTER_ID in (None, '0') and COMMAND_SYNC != 'never':
+        with startup_timer.phase('command_sync'):
+            try:
+                synced = await sync_commands(
+                    tree, bot.application_id, COMMAND_HASH_FILE, force=COMMAND_SYNC == 'always'
+                )
+                if synced is None:
+                    print('✅ Команды не изменились, синхронизация пропущена')
+                else:
+                    print(f'✅ Синхронизировано {synced} команд')
+            except Exception as e:
+                print(f'❌ Ошибка синхронизации команд: {e}')
+    startup_timer.since_start('ready')
+
+
+def owns_guild(guild_id):
+    """Относится ли сервер к шардам этого процесса"""
+    if not SHARD_IDS:
+        return True
+    return (guild_id >> 22) % (bot.shard_count or 1) in SHARD_IDS
+
+
+async def reconcile_temp_channels():
+    """Сверяет сохранённые временные каналы с Discord после запуска или переподключения.
+
+    Каналы, опустевшие, пока бот был выключен, удаляются, а удалённые вручную или
+    на серверах, откуда бот ушёл, - забываются. Занятость каналов считывается один раз,
+    дальше менеджер сервера следит за ней по событиям голосовых каналов.
+    """
+    empty = 0
+    forgotten = 0
+    for guild_id, channel_ids in list(created_voice_channels.items()):
+        if not owns_guild(guild_id):
+            # Сервер другого процесса кластера
+            continue
+        guild = bot.get_guild(guild_id)
+        for channel_id in list(channel_ids):
+            channel = guild.get_channel(channel_id) if guild else None
+            if channel is None:
+                forget_temp_channel(guild_id, channel_id)
+                forgotten += 1
+            elif channel.id not in get_temp_channel_manager(guild).channels:
+                # Пустые каналы удаляются очередью менеджера, пустые каналы запаса снова становятся запасом
+                if get_temp_channel_manager(guild).track(channel).state == EMPTY_GRACE:
+                    empty += 1
+    if TEMP_CHANNEL_POOL_SIZE:
+        for guild_id in source_voice_channels:
+            guild = bot.get_guild(guild_id)
+            if guild:
+                get_temp_channel_manager(guild).ensure_pool()
+    if empty or forgotten:
+        print(f'🧹 Сверка временных каналов: пустых к удалению {empty}, забыто отсутствующих {forgotten}')
+
+
+RELAY_SENT = metrics.registry.counter(
+    'bot_relay_messages_sent_total', 'Повторённые сообщения по способу отправки', ('method',)
+)
+RELAY_SEND_SECONDS = metrics.registry.histogram(
+    'bot_relay_send_seconds', 'Время отправки пачки повторённых сообщений', ('method',)
+)
+RELAY_DROPPED = metrics.registry.counter(
+    'bot_relay_messages_dropped_total', 'Отброшенные сообщения повтора', ('reason',)
+)
+
+
+def on_relay_sent(method, count, seconds):
+    RELAY_SENT.inc(count, method=method)
+    RELAY_SEND_SECONDS.observe(seconds, method=method)
+
+
+# Повтор сообщений: очередь и вебхук на каждый целевой канал, отправка не задерживает on_message
+message_relay = MessageRelay(
+    queue_size=RELAY_QUEUE_SIZE,
+    on_sent=on_relay_sent,
+    on_dropped=lambda reason, count: RELAY_DROPPED.inc(count, reason=reason)
+)
+metrics.registry.gauge(
+    'bot_relay_queue_depth', 'Сообщения в очереди повтора по целевым каналам', message_relay.queue_depths, ('channel',)
+)
+
+# Маршруты повтора сообщений: ID исходного канала -> маршруты (из базы и переменных окружения)
+relay_routes = RelayTable()
+for source_id, target_id, route_guild_id, route_filter, pattern in channel_store.load_relay_routes():
+    if route_filter == FILTER_REGEX:
+        # Маршруты, сохранённые до ограничения сложности выражений
+        try:
+            check_regex(pattern)
+        except ValueError as e:
+            print(f'⚠️ Маршрут повтора {source_id} -> {target_id} пропущен: {e}')
+            continue
+    relay_routes.add(RelayRoute(source_id, target_id, route_guild_id, route_filter, pattern))
+if SOURCE_CHANNEL_ID:
+    relay_routes.add(RelayRoute(SOURCE_CHANNEL_ID, TARGET_CHANNEL_ID or SOURCE_CHANNEL_ID))
+metrics.registry.gauge('bot_relay_routes', 'Маршруты повтора сообщений', lambda: len(relay_routes))
 
 
 @bot.event
 async def on_message(message):
     """Обработчик всех сообщений"""
-    # Игнорируем сообщения от ботов (включая самого себя)
-    if message.author.bot:
+    # Игнорируем сообщения от ботов (включая самого себя) и вебхуков (в том числе повторённые)
+    if message.author.bot or message.webhook_id:
         return
     
-    # Проверяем, что сообщение из нужного канала
-    if SOURCE_CHANNEL_ID and message.channel.id == SOURCE_CHANNEL_ID:
-        # Если TARGET_CHANNEL_ID указан, отправляем в другой канал
-        if TARGET_CHANNEL_ID:
-            target_channel = bot.get_channel(TARGET_CHANNEL_ID)
-            if target_channel:
-                # Повторяем сообщение
-                content = f"**{message.author.name}**: {message.content}"
-                if message.attachments:
-                    # Если есть вложения, добавляем их
-                    for attachment in message.attachments:
-                        content += f"\n{attachment.url}"
-                await target_channel.send(content)
-        else:
-            # Если TARGET_CHANNEL_ID не указан, повторяем в том же канале (после оригинального сообщения)
-            if message.content:
-                await message.channel.send(f"🔄 {message.content}")
+    # Сообщения из каналов без маршрутов отсекаются одной проверкой по словарю
+    routes = relay_routes.get(message.channel.id)
+    if routes:
+        for route in routes:
+            if not route.matches(message):
+                continue
+            if route.echo:
+                # Повтор в том же канале (после оригинального сообщения)
+                message_relay.submit(message.channel, message, echo=True)
+            else:
+                # bot.get_channel перебирает все серверы - сначала ищем на сервере сообщения
+                target_channel = message.guild.get_channel(route.target_id) if message.guild else None
+                if target_channel is None:
+                    target_channel = bot.get_channel(route.target_id)
+                if target_channel:
+                    message_relay.submit(target_channel, message)
     
     # Позволяем командам работать
     await bot.process_commands(message)
 
 
+COMMANDS_TOTAL = metrics.registry.counter('bot_commands_total', 'Вызовы команд', ('command',))
+COMMAND_ERRORS_TOTAL = metrics.registry.counter('bot_command_errors_total', 'Ошибки команд', ('command',))
+
+
+@bot.listen('on_command')
+async def count_command(ctx):
+    COMMANDS_TOTAL.inc(command=ctx.command.qualified_name)
+
+
+@bot.listen('on_command_error')
+async def count_command_error(ctx, error):
+    COMMAND_ERRORS_TOTAL.inc(command=ctx.command.qualified_name if ctx.command else 'unknown')
+    if isinstance(error, commands.CommandNotFound):
+        return
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send('❌ Для этой команды нужно право «Управлять сервером»')
+        return
+    # Слушатель отключает стандартный вывод ошибок discord.py, поэтому печатаем их сами
+    print(f'❌ Ошибка в команде {ctx.command}: {error}')
+    traceback.print_exception(type(error), error, error.__traceback__)
+
+
+@bot.after_invoke
+async def notify_panel_after_command(ctx):
+    """После команды на сервере обновляем панель: очередь, громкость, голосовые каналы"""
+    if ctx.guild:
+        notify_panel('music', ctx.guild.id)
+        notify_panel('voice_channels', ctx.guild.id)
+
+
+@bot.event
+async def on_guild_join(guild):
+    """Бот добавлен на сервер"""
+    notify_panel('guilds')
+
+
+@bot.event
+async def on_guild_remove(guild):
+    """Бот удалён с сервера"""
+    notify_panel('guilds')
+
+
 @bot.command(name='ping')
 async def ping(ctx):
     """Проверка работоспособности бота"""
     await ctx.send(f'Понг! Задержка: {round(bot.latency * 1000)}ms')
 
 
+def add_relay_route(guild, source, target, route_filter=None):
+    """Добавляет (заменяет) маршрут повтора и сохраняет его в базу; ValueError - неверный фильтр"""
+    kind, pattern = parse_filter(route_filter)
+    route = RelayRoute(source.id, target.id, guild.id, kind, pattern)
+    relay_routes.add(route)
+    channel_store.set_relay_route(source.id, target.id, guild.id, kind, pattern)
+    return route
+
+
+def format_relay_route(route):
+    target = 'тот же канал' if route.echo else f'<#{route.target_id}>'
+    return f'<#{route.source_id}> → {target} ({route.describe()})'
+
+
 @bot.command(name='setup')
+@commands.has_permissions(manage_guild=True)
 async def setup(ctx, source: discord.TextChannel = None, target: discord.TextChannel = None):
-    """Настройка каналов для повтора сообщений (для текущей сессии)"""
-    global SOURCE_CHANNEL_ID, TARGET_CHANNEL_ID
-    
-    if source:
-        SOURCE_CHANNEL_ID = source.id
-        await ctx.send(f'✅ Исходный канал установлен: {source.mention}')
-    
-    if target:
-        TARGET_CHANNEL_ID = target.id
-        await ctx.send(f'✅ Целевой канал установлен: {target.mention}')
-    
-    if not source and not target:
+    """Настройка повтора сообщений из канала source в target (без target - в тот же канал)"""
+    if not source:
         await ctx.send('Использование: `!setup #исходный_канал #целевой_канал`\n'
-                      'Или: `!setup #канал` (для повтора в тот же канал)')
+                      'Или: `!setup #канал` (для повтора в тот же канал)\n'
+                      'Фильтры и несколько маршрутов: `!relay`')
+        return
+    route = add_relay_route(ctx.guild, source, target or source)
+    await ctx.send(f'✅ Маршрут повтора добавлен: {format_relay_route(route)}')
+
+
+# Маршруты копируют сообщения между каналами (в том числе из закрытых) через вебхуки,
+# поэтому управлять ими могут только администраторы сервера
+@bot.group(name='relay', invoke_without_command=True)
+@commands.has_permissions(manage_guild=True)
+async def relay(ctx):
+    """Маршруты повтора сообщений сервера"""
+    routes = relay_routes.for_guild(ctx.guild)
+    lines = [f'{i}. {format_relay_route(route)}' for i, route in enumerate(routes, 1)]
+    await ctx.send(
+        ('📋 Маршруты повтора:\n' + '\n'.join(lines) if lines else '📋 Маршрутов повтора нет') +
+        '\n\nКоманды: `!relay add #исходный #целевой [фильтр]`, `!relay remove #исходный [#целевой]`\n'
+        'Фильтры: `attachments` (только с вложениями), `prefix:<текст>`, `regex:<выражение>`'
+    )
+
+
+@relay.command(name='add')
+@commands.has_permissions(manage_guild=True)
+async def relay_add(ctx, source: discord.TextChannel, target: discord.TextChannel, *, route_filter: str = None):
+    """Добавление маршрута повтора (тот же целевой канал - замена фильтра)"""
+    try:
+        route = add_relay_route(ctx.guild, source, target, route_filter)
+    except ValueError as e:
+        await ctx.send(f'❌ {e}')
+        return
+    await ctx.send(f'✅ Маршрут повтора добавлен: {format_relay_route(route)}')
+
+
+@relay.command(name='remove', aliases=['rm'])
+@commands.has_permissions(manage_guild=True)
+async def relay_remove(ctx, source: discord.TextChannel, target: discord.TextChannel = None):
+    """Удаление маршрутов повтора из канала (всех или в один целевой канал)"""
+    removed = relay_routes.remove(source.id, target.id if target else None)
+    for route in removed:
+        channel_store.remove_relay_route(route.source_id, route.target_id)
+        if not relay_routes.has_target(route.target_id):
+            message_relay.forget(route.target_id)
+    if removed:
+        await ctx.send(f'✅ Удалено маршрутов повтора: {len(removed)}')
+    else:
+        await ctx.send('❌ Таких маршрутов повтора нет')
 
 
 # ==================== МУЗЫКАЛЬНЫЕ КОМАНДЫ ====================
 
-def get_spotify_track_info(url):
+async def get_spotify_track_info(url):
     """Получает информацию о треке из Spotify"""
     if not spotify:
         return None
     
+    kind, track_id = parse_spotify_url(url)
+    if kind != 'track':
+        return None
+    
     try:
-        track_id = url.split('/')[-1].split('?')[0]
-        track = spotify.track(track_id)
+        track = await spotify.track(track_id)
         
         artists = ', '.join([artist['name'] for artist in track['artists']])
         title = track['name']
@@ -225,13 +920,13 @@ def get_spotify_track_info(url):
         return None
 
 
-def search_spotify_tracks(query, limit=5):
+async def search_spotify_tracks(query, limit=5):
     """Поиск треков в Spotify для autocomplete"""
     if not spotify or not query or len(query) < 2:
         return []
     
     try:
-        results = spotify.search(q=query, type='track', limit=limit)
+        results = await spotify.search(query, limit=limit)
         tracks = []
         
         for item in results['tracks']['items']:
@@ -252,6 +947,17 @@ def search_spotify_tracks(query, limit=5):
         return []
 
 
+# Автодополнение /play: debounce, кэш по префиксам и подсказки из недавно игравших треков
+AUTOCOMPLETE_DEBOUNCE = float(os.getenv('AUTOCOMPLETE_DEBOUNCE', 0.3))
+AUTOCOMPLETE_CACHE_SIZE = int(os.getenv('AUTOCOMPLETE_CACHE_SIZE', 500))
+
+autocomplete_engine = AutocompleteEngine(
+    search_spotify_tracks,
+    debounce=AUTOCOMPLETE_DEBOUNCE,
+    cache_size=AUTOCOMPLETE_CACHE_SIZE
+)
+
+
 def extract_spotify_url(text):
     """Извлекает URL Spotify из текста"""
     spotify_url_pattern = r'(https?://(?:open\.)?spotify\.com/(?:track|album|playlist)/[a-zA-Z0-9]+)'
@@ -259,43 +965,221 @@ def extract_spotify_url(text):
     return match.group(1) if match else None
 
 
+def parse_spotify_url(text):
+    """Возвращает тип (track/album/playlist) и ID объекта Spotify из ссылки"""
+    match = re.search(r'spotify\.com/(track|album|playlist)/([a-zA-Z0-9]+)', text)
+    return (match.group(1), match.group(2)) if match else (None, None)
+
+
+def spotify_placeholder(item):
+    """Заготовка трека Spotify для очереди: YouTube ищется позже, перед воспроизведением"""
+    spotify_url = (item.get('external_urls') or {}).get('spotify')
+    if not spotify_url:
+        # Локальные файлы в плейлистах не имеют ссылки
+        return None
+    artists = ', '.join([artist['name'] for artist in item['artists']])
+    return ResolvedTrack(spotify_url, search_query=f"{artists} {item['name']}")
+
+
+class TrackGapStats:
+    """Статистика пауз между треками: от окончания трека до запуска следующего"""
+
+    def __init__(self, maxlen=200):
+        self.samples = deque(maxlen=maxlen)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def snapshot(self):
+        """Сводка в миллисекундах для веб-панели"""
+        if not self.samples:
+            return {'count': 0}
+        ordered = sorted(self.samples)
+        return {
+            'count': len(ordered),
+            'last_ms': round(self.samples[-1] * 1000),
+            'avg_ms': round(sum(ordered) / len(ordered) * 1000),
+            'p50_ms': round(ordered[len(ordered) // 2] * 1000),
+            'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000),
+            'max_ms': round(ordered[-1] * 1000),
+        }
+
+
+track_gap_stats = TrackGapStats()
+
+
+class QueuePrefetcher:
+    """Фоновая подготовка следующих треков очереди, пока играет текущий.
+
+    Находит на YouTube заготовки (в том числе из Spotify) и обновляет ссылки на поток,
+    которые скоро истекут, чтобы переход к следующему треку занимал только запуск FFmpeg.
+    """
+
+    def __init__(self, guild_id, depth=PREFETCH_DEPTH):
+        self.guild_id = guild_id
+        self.depth = depth
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def wake(self):
+        """Просит проверить начало очереди (после добавления трека или смены текущего)"""
+        if self._task is None or self._task.done():
+            self._task = bot.loop.create_task(self._run())
+        self._wakeup.set()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Периодически просыпаемся сами, чтобы обновить ссылки, которые истекают в очереди
+                await asyncio.wait_for(self._wakeup.wait(), timeout=PREFETCH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            for track in get_queue(self.guild_id).peek(self.depth):
+                if track.is_resolved and not track.is_expired(PREFETCH_REFRESH_MARGIN):
+                    continue
+                try:
+                    await ensure_resolved(track, margin=PREFETCH_REFRESH_MARGIN, guild_id=self.guild_id)
+                except ExtractionCancelled:
+                    pass
+                except Exception as e:
+                    print(f'⚠️ Ошибка предзагрузки трека {track}: {e}')
+
+
+# Предзагрузчики очередей для каждого сервера
+queue_prefetchers = {}
+
+
+def get_prefetcher(guild_id):
+    """Возвращает (создаёт при необходимости) предзагрузчик очереди сервера"""
+    if guild_id not in queue_prefetchers:
+        queue_prefetchers[guild_id] = QueuePrefetcher(guild_id)
+    return queue_prefetchers[guild_id]
+
+
+def stop_prefetcher(guild_id):
+    """Останавливает и удаляет предзагрузчик очереди сервера"""
+    prefetcher = queue_prefetchers.pop(guild_id, None)
+    if prefetcher:
+        prefetcher.stop()
+
+
+# Плееры серверов: один долгоживущий источник звука на сервер, который сам переключает треки
+guild_players = {}
+
+
+async def prepare_track(guild_id, track):
+    """Готовит источник звука для трека очереди (вызывается плеером заранее)"""
+    cached = None
+    try:
+        # Обычно трек уже подготовлен предзагрузкой, иначе находим его или обновляем ссылку сейчас.
+        # Для трека из локального кэша ссылка на поток не нужна.
+        known = track.is_resolved
+        if audio_cache and known:
+            cached = await audio_cache.lookup(track.video_id)
+        if cached is None:
+            await ensure_resolved(track, guild_id=guild_id)
+            if audio_cache and not known:
+                # Видео стало известно только после поиска
+                cached = await audio_cache.lookup(track.video_id)
+    except ExtractionCancelled:
+        # Поиск отменён пропуском, остановкой или выходом из канала
+        return None
+    return create_source(guild_id, track, cached=cached)
+
+
+async def resume_track(guild_id, track, position):
+    """Источник оборвавшегося трека с позиции обрыва.
+
+    Трек уже найден, поэтому заново запрашивается только ссылка на поток по странице
+    видео, без поиска. Ссылка могла перестать работать раньше срока подписи, поэтому
+    она обновляется в любом случае (кроме трека из локального кэша).
+    """
+    try:
+        cached = await audio_cache.lookup(track.video_id) if audio_cache else None
+        if cached is None:
+            track.expires_at = 0
+            await ensure_resolved(track, guild_id=guild_id)
+    except ExtractionCancelled:
+        return None
+    return create_source(guild_id, track, start_at=position, cached=cached)
+
+
+def create_player(ctx, guild_id):
+    """Создаёт плеер сервера; сообщения о треках отправляются в канал ctx"""
+    def on_track_start(track, source, gap):
+        if gap is not None:
+            track_gap_stats.record(gap)
+        notify_panel('music', guild_id)
+        # Пока играет трек, готовим следующие в очереди
+        get_prefetcher(guild_id).wake()
+        # Запоминаем трек для подсказок автодополнения
+        autocomplete_engine.remember_played(str(track), track.query if len(track.query) <= 100 else track.webpage_url)
+        # Часто играющие треки скачиваются в локальный кэш
+        if audio_cache and audio_cache.record_play(track):
+            bot.loop.create_task(audio_cache.download(track))
+        bot.loop.create_task(ctx.send(f'🎵 Сейчас играет: **{source.title}**'))
+
+    def on_track_error(track, error):
+        bot.loop.create_task(ctx.send(f'❌ Ошибка воспроизведения **{track}**: {error}'))
+
+    player = GuildPlayer(
+        guild_id,
+        get_queue(guild_id),
+        loop=bot.loop,
+        prepare=lambda track: prepare_track(guild_id, track),
+        on_track_start=on_track_start,
+        on_track_error=on_track_error,
+        opus=PLAYBACK_MODE == 'opus',
+        crossfade=PLAYER_CROSSFADE,
+        preload_seconds=PLAYER_PRELOAD_SECONDS,
+        buffer_frames=max(1, int(PLAYER_BUFFER_SECONDS * 50)),
+        resume=(lambda track, position: resume_track(guild_id, track, position)) if PLAYER_MAX_RESUMES else None,
+        max_resumes=PLAYER_MAX_RESUMES,
+    )
+    guild_players[guild_id] = player
+    return player
+
+
 async def play_next(ctx, guild_id):
-    """Воспроизводит следующий трек из очереди"""
+    """Запускает плеер сервера, если сейчас ничего не играет; дальше он сам идёт по очереди"""
     if guild_id not in music_queues or not music_queues[guild_id]:
         return
     
-    voice_client = discord.utils.get(bot.voice_clients, guild=ctx.guild)
+    voice_client = ctx.guild.voice_client
     if not voice_client:
         return
     
-    if voice_client.is_playing():
+    if voice_client.is_playing() or voice_client.is_paused():
         return
     
-    query = music_queues[guild_id].pop(0)
+    player = create_player(ctx, guild_id)
     
-    try:
-        # Если это поисковый запрос, добавляем префикс ytsearch
-        if not query.startswith('http'):
-            query = f"ytsearch1:{query}"
-        elif query.startswith('https://open.spotify.com'):
-            # Если это Spotify URL, получаем информацию о треке
-            track_info = get_spotify_track_info(query)
-            if track_info:
-                query = f"ytsearch1:{track_info['search_query']}"
-        
-        player = await YTDLSource.from_url(query, loop=bot.loop, stream=True)
-        voice_client.play(
-            player,
-            after=lambda e: asyncio.run_coroutine_threadsafe(
-                play_next(ctx, guild_id), bot.loop
-            ) if e is None else print(f'Ошибка воспроизведения: {e}')
-        )
-        await ctx.send(f'🎵 Сейчас играет: **{player.title}**')
-    except Exception as e:
-        await ctx.send(f'❌ Ошибка воспроизведения: {str(e)}')
-        # Пробуем следующий трек
-        if music_queues[guild_id]:
-            await play_next(ctx, guild_id)
+    def after(error):
+        # Вызывается из потока отправки звука - обработка переносится в event loop
+        bot.loop.call_soon_threadsafe(on_player_finished, ctx, guild_id, player, error)
+    
+    voice_client.play(player, after=after)
+
+
+def on_player_finished(ctx, guild_id, player, error):
+    """Плеер остановился: очередь закончилась, воспроизведение остановлено или произошла ошибка"""
+    if guild_players.get(guild_id) is player:
+        del guild_players[guild_id]
+    notify_panel('music', guild_id)
+    if error is not None:
+        print(f'❌ Ошибка плеера на сервере {guild_id}:')
+        traceback.print_exception(type(error), error, error.__traceback__)
+        bot.loop.create_task(ctx.send(f'❌ Ошибка воспроизведения: {error}'))
+    # Трек могли добавить, пока плеер останавливался, или после ошибки - продолжаем очередь
+    if music_queues.get(guild_id):
+        bot.loop.create_task(play_next(ctx, guild_id))
 
 
 @bot.command(name='join')
@@ -312,20 +1196,32 @@ async def join(ctx):
         await ctx.send('❌ Вы должны находиться в голосовом канале!')
 
 
+async def end_voice_session(voice_client):
+    """Отключает бота от голоса и останавливает всё, что работало для очереди сервера"""
+    guild_id = voice_client.guild.id
+    if guild_id in music_queues:
+        music_queues[guild_id].clear()
+    stop_prefetcher(guild_id)
+    cancel_collection_loaders(guild_id)
+    extraction_service.cancel_guild(guild_id)
+    await voice_client.disconnect()
+
+
 @bot.command(name='leave')
 async def leave(ctx):
     """Отключение бота от голосового канала"""
     if ctx.voice_client:
-        if ctx.guild.id in music_queues:
-            music_queues[ctx.guild.id].clear()
-        await ctx.voice_client.disconnect()
+        await end_voice_session(ctx.voice_client)
         await ctx.send('👋 Отключился от голосового канала')
     else:
         await ctx.send('❌ Бот не подключен к голосовому каналу')
 
 
+AUTOCOMPLETE_SECONDS = metrics.registry.histogram('bot_autocomplete_seconds', 'Время ответа автодополнения /play')
+
+
 async def play_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-    """Autocomplete для команды play - поиск треков в Spotify"""
+    """Autocomplete для команды play - поиск треков в Spotify и среди недавно игравших"""
     if not current or len(current) < 2:
         return []
     
@@ -333,13 +1229,9 @@ async def play_autocomplete(interaction: discord.Interaction, current: str) -> l
     if current.startswith('http') and 'spotify.com' in current:
         return []
     
-    # Ищем в Spotify
-    if not spotify:
-        # Если Spotify API не настроен, возвращаем пустой список
-        return []
-    
     try:
-        results = search_spotify_tracks(current, limit=25)
+        with AUTOCOMPLETE_SECONDS.time():
+            results = await autocomplete_engine.suggest(interaction.user.id, current, limit=25)
         
         # Формируем список для Discord (максимум 25 вариантов)
         choices = []
@@ -356,6 +1248,78 @@ async def play_autocomplete(interaction: discord.Interaction, current: str) -> l
         return []
 
 
+# Фоновые задачи догрузки альбомов/плейлистов Spotify для каждого сервера
+collection_loaders = {}
+
+
+def enqueue_placeholders(guild_id, items, limit):
+    """Добавляет в очередь заготовки треков, не больше limit; возвращает количество"""
+    tracks = [track for track in map(spotify_placeholder, items) if track][:max(0, limit)]
+    get_queue(guild_id).extend(tracks)
+    return len(tracks)
+
+
+async def load_remaining_pages(ctx, pages, added, label):
+    """Догружает остальные страницы коллекции, пока уже играет первый трек"""
+    guild_id = ctx.guild.id
+    try:
+        async for items in pages:
+            added += enqueue_placeholders(guild_id, items, SPOTIFY_COLLECTION_LIMIT - added)
+            get_prefetcher(guild_id).wake()
+            notify_panel('music', guild_id)
+            if added >= SPOTIFY_COLLECTION_LIMIT:
+                break
+        await ctx.send(f'✅ Из {label} добавлено всего {added} треков')
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await ctx.send(f'⚠️ Не удалось загрузить весь список {label}: {e}')
+
+
+def cancel_collection_loaders(guild_id):
+    """Останавливает догрузку коллекций сервера (stop/leave)"""
+    for loader in collection_loaders.pop(guild_id, set()):
+        loader.cancel()
+
+
+async def enqueue_spotify_collection(ctx, kind, collection_id):
+    """Добавляет альбом или плейлист Spotify в очередь.
+
+    Первая страница сразу попадает в очередь заготовками и начинает играть,
+    остальные догружаются в фоне; поиск на YouTube делает предзагрузка перед воспроизведением.
+    """
+    guild_id = ctx.guild.id
+    label = 'альбома' if kind == 'album' else 'плейлиста'
+    if not spotify:
+        await ctx.send('❌ Spotify API не настроен, альбомы и плейлисты недоступны')
+        return
+    
+    pages = spotify.album_tracks(collection_id) if kind == 'album' else spotify.playlist_tracks(collection_id)
+    try:
+        first_page = await pages.__anext__()
+    except StopAsyncIteration:
+        first_page = []
+    except Exception as e:
+        await ctx.send(f'❌ Не удалось получить список {label}: {e}')
+        return
+    
+    added = enqueue_placeholders(guild_id, first_page, SPOTIFY_COLLECTION_LIMIT)
+    if not added:
+        await ctx.send(f'❌ В составе {label} не найдено треков')
+        return
+    await ctx.send(f'📥 Добавлено {added} треков из {label}, остальные загружаются...')
+    
+    loader = bot.loop.create_task(load_remaining_pages(ctx, pages, added, label))
+    loaders = collection_loaders.setdefault(guild_id, set())
+    loaders.add(loader)
+    loader.add_done_callback(loaders.discard)
+    
+    if ctx.voice_client.is_playing():
+        get_prefetcher(guild_id).wake()
+    else:
+        await play_next(ctx, guild_id)
+
+
 @bot.hybrid_command(name='play', aliases=['p'], description='Воспроизведение музыки из Spotify или поиск на YouTube')
 @app_commands.autocomplete(query=play_autocomplete)
 @app_commands.describe(query='Название трека или ссылка на Spotify')
@@ -367,15 +1331,24 @@ async def play(ctx, *, query: str):
     
     # Проверяем, является ли запрос URL Spotify
     spotify_url = extract_spotify_url(query)
+    spotify_kind, spotify_id = parse_spotify_url(spotify_url) if spotify_url else (None, None)
     search_query = query
-    queue_item = query  # Что сохраним в очередь (может быть Spotify URL или поисковый запрос)
+    queue_item = query  # Исходный запрос трека в очереди (может быть Spotify URL или поисковый запрос)
+    
+    if spotify_kind in ('album', 'playlist'):
+        # Альбомы и плейлисты добавляются заготовками без ожидания поиска на YouTube
+        if not ctx.voice_client:
+            await ctx.author.voice.channel.connect()
+        get_queue(ctx.guild.id)
+        await enqueue_spotify_collection(ctx, spotify_kind, spotify_id)
+        return
     
     if spotify_url:
         await ctx.send(f'🔍 Ищу трек в Spotify...')
-        track_info = get_spotify_track_info(spotify_url)
+        track_info = await get_spotify_track_info(spotify_url)
         if track_info:
             search_query = track_info['search_query']
-            queue_item = spotify_url  # Сохраняем оригинальный Spotify URL в очередь
+            queue_item = spotify_url  # Запоминаем оригинальный Spotify URL
             await ctx.send(f'🎵 Найден: **{track_info["artists"]} - {track_info["title"]}**\n'
                          f'🔗 {track_info["url"]}\n'
                          f'📥 Ищу на YouTube...')
@@ -388,32 +1361,32 @@ async def play(ctx, *, query: str):
         await ctx.author.voice.channel.connect()
     
     # Инициализируем очередь для сервера, если её нет
-    if ctx.guild.id not in music_queues:
-        music_queues[ctx.guild.id] = []
+    get_queue(ctx.guild.id)
     
-    # Ищем на YouTube
+    # Ищем на YouTube один раз: найденный трек либо играет сразу, либо ждёт в очереди
     try:
         await ctx.send(f'🔍 Ищу: **{search_query}**')
-        yt_search = f"ytsearch1:{search_query}"
-        player = await YTDLSource.from_url(yt_search, loop=bot.loop, stream=True)
+        track = await resolve_track(queue_item, search_query, guild_id=ctx.guild.id)
         
         voice_client = ctx.voice_client
+        if voice_client is None:
+            # Пока шёл поиск, бот отключился от голоса (!leave или сторож простаивающих сессий)
+            await ctx.send('❌ Бот не подключен к голосовому каналу, трек не добавлен')
+            return
+        # Очередь берётся заново: пока шёл поиск, сторож мог удалить состояние сервера
+        get_queue(ctx.guild.id).append(track)
         
-        if voice_client.is_playing():
-            # Если что-то уже играет, добавляем в очередь (сохраняем оригинальный запрос или Spotify URL)
-            music_queues[ctx.guild.id].append(queue_item)
-            await ctx.send(f'✅ Добавлено в очередь: **{player.title}**\n'
+        if voice_client.is_playing() or voice_client.is_paused():
+            # Если что-то уже играет, трек ждёт в очереди - плеер запустит его заранее
+            get_prefetcher(ctx.guild.id).wake()
+            await ctx.send(f'✅ Добавлено в очередь: **{track.title}**\n'
                          f'📍 Позиция в очереди: {len(music_queues[ctx.guild.id])}')
         else:
-            # Воспроизводим сразу
-            voice_client.play(
-                player,
-                after=lambda e: asyncio.run_coroutine_threadsafe(
-                    play_next(ctx, ctx.guild.id), bot.loop
-                ) if e is None else print(f'Ошибка воспроизведения: {e}')
-            )
-            await ctx.send(f'🎵 Сейчас играет: **{player.title}**')
+            # Воспроизводим сразу: плеер возьмёт трек из очереди и сообщит о начале
+            await play_next(ctx, ctx.guild.id)
             
+    except ExtractionCancelled:
+        await ctx.send('⏹️ Поиск трека отменён')
     except Exception as e:
         await ctx.send(f'❌ Ошибка: {str(e)}')
 
@@ -438,13 +1411,21 @@ async def resume(ctx):
         await ctx.send('❌ Воспроизведение не приостановлено')
 
 
+def stop_playback(guild_id, voice_client):
+    """Останавливает воспроизведение: очищает очередь, отменяет загрузку плейлистов и поиски сервера"""
+    # Очередь очищается до остановки, чтобы плеер не перешёл к следующему треку
+    if guild_id in music_queues:
+        music_queues[guild_id].clear()
+    cancel_collection_loaders(guild_id)
+    extraction_service.cancel_guild(guild_id)
+    voice_client.stop()
+
+
 @bot.command(name='stop')
 async def stop(ctx):
     """Остановка воспроизведения и очистка очереди"""
     if ctx.voice_client:
-        if ctx.guild.id in music_queues:
-            music_queues[ctx.guild.id].clear()
-        ctx.voice_client.stop()
+        stop_playback(ctx.guild.id, ctx.voice_client)
         await ctx.send('⏹️ Воспроизведение остановлено, очередь очищена')
     else:
         await ctx.send('❌ Бот не подключен к голосовому каналу')
@@ -454,11 +1435,15 @@ async def stop(ctx):
 async def skip(ctx):
     """Пропуск текущего трека"""
     if ctx.voice_client and ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
+        player = guild_players.get(ctx.guild.id)
+        if player:
+            # Плеер сразу переходит к заранее запущенному следующему треку. Ожидающие
+            # извлечения сервера не отменяются: среди них подготовка следующего трека,
+            # отменяют их только !stop и !leave
+            player.skip()
+        else:
+            ctx.voice_client.stop()
         await ctx.send('⏭️ Трек пропущен')
-        # Воспроизводим следующий трек
-        if ctx.guild.id in music_queues and music_queues[ctx.guild.id]:
-            await play_next(ctx, ctx.guild.id)
     else:
         await ctx.send('❌ Ничего не воспроизводится')
 
@@ -467,27 +1452,95 @@ async def skip(ctx):
 async def queue(ctx):
     """Показать очередь воспроизведения"""
     if ctx.guild.id in music_queues and music_queues[ctx.guild.id]:
-        queue_list = music_queues[ctx.guild.id][:10]  # Показываем первые 10
-        queue_text = '\n'.join([f'{i+1}. {query}' for i, query in enumerate(queue_list)])
+        queue_list = music_queues[ctx.guild.id].peek(10)  # Показываем первые 10
+        queue_text = '\n'.join([f'{i+1}. {track}' for i, track in enumerate(queue_list)])
         await ctx.send(f'📋 Очередь воспроизведения ({len(music_queues[ctx.guild.id])} треков):\n{queue_text}')
     else:
         await ctx.send('📋 Очередь пуста')
 
 
+@bot.command(name='shuffle')
+async def shuffle(ctx):
+    """Перемешать очередь воспроизведения"""
+    if ctx.guild.id in music_queues and music_queues[ctx.guild.id]:
+        music_queues[ctx.guild.id].shuffle()
+        get_prefetcher(ctx.guild.id).wake()
+        await ctx.send('🔀 Очередь перемешана')
+    else:
+        await ctx.send('📋 Очередь пуста')
+
+
+@bot.command(name='remove', aliases=['rm'])
+async def remove(ctx, start: int, end: int = None):
+    """Удалить трек или диапазон треков из очереди (позиции как в !queue)"""
+    if ctx.guild.id not in music_queues or not music_queues[ctx.guild.id]:
+        await ctx.send('📋 Очередь пуста')
+        return
+    
+    end = end or start
+    removed = music_queues[ctx.guild.id].remove_range(start - 1, end)
+    if removed:
+        await ctx.send(f'🗑️ Удалено из очереди треков: {len(removed)}')
+    else:
+        await ctx.send('❌ В очереди нет треков на этих позициях')
+
+
+@bot.command(name='move', aliases=['mv'])
+async def move(ctx, source: int, target: int):
+    """Переместить трек в очереди с одной позиции на другую"""
+    track_queue = music_queues.get(ctx.guild.id)
+    if not track_queue or not (1 <= source <= len(track_queue)) or not (1 <= target <= len(track_queue)):
+        await ctx.send('❌ Неверная позиция в очереди')
+        return
+    
+    track = track_queue.move(source - 1, target - 1)
+    get_prefetcher(ctx.guild.id).wake()
+    await ctx.send(f'↕️ **{track}** перемещён на позицию {target}')
+
+
+@bot.command(name='dedupe')
+async def dedupe(ctx):
+    """Удалить повторяющиеся треки из очереди"""
+    if ctx.guild.id in music_queues and music_queues[ctx.guild.id]:
+        removed = music_queues[ctx.guild.id].dedupe()
+        await ctx.send(f'🧹 Удалено повторов: {removed}')
+    else:
+        await ctx.send('📋 Очередь пуста')
+
+
+@bot.command(name='playnext', aliases=['pn'])
+async def playnext(ctx, *, query: str):
+    """Поставить трек первым в очереди"""
+    if not ctx.voice_client:
+        await ctx.send('❌ Бот не подключен к голосовому каналу')
+        return
+    
+    # Трек найдёт предзагрузка: он первый в очереди, поэтому готовится сразу
+    track = ResolvedTrack(query)
+    get_queue(ctx.guild.id).play_next(track)
+    await ctx.send(f'⏫ Следующим будет: **{query}**')
+    # Пока отправлялось сообщение, бот мог отключиться от голоса
+    if ctx.voice_client is None:
+        return
+    if ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
+        get_prefetcher(ctx.guild.id).wake()
+    else:
+        await play_next(ctx, ctx.guild.id)
+
+
 @bot.command(name='volume', aliases=['vol'])
 async def volume(ctx, volume: int = None):
     """Установка громкости (0-100)"""
     if ctx.voice_client:
         if volume is None:
-            current_volume = int(ctx.voice_client.source.volume * 100) if ctx.voice_client.source else 50
+            current_volume = int(guild_volumes.get(ctx.guild.id, DEFAULT_VOLUME) * 100)
             await ctx.send(f'🔊 Текущая громкость: {current_volume}%')
         else:
             if 0 <= volume <= 100:
-                if ctx.voice_client.source:
-                    ctx.voice_client.source.volume = volume / 100
+                if set_guild_volume(ctx.guild.id, volume / 100):
                     await ctx.send(f'🔊 Громкость установлена: {volume}%')
                 else:
-                    await ctx.send('❌ Ничего не воспроизводится')
+                    await ctx.send(f'🔊 Громкость {volume}% будет применена со следующего трека')
             else:
                 await ctx.send('❌ Громкость должна быть от 0 до 100')
     else:
@@ -518,8 +1571,14 @@ async def set_voice_channel(ctx, channel: discord.VoiceChannel = None):
         await ctx.send('❌ Указанный канал не является голосовым каналом!')
         return
     
+    previous = source_voice_channels.get(ctx.guild.id)
     source_voice_channels[ctx.guild.id] = channel.id
-    save_voice_channels()
+    channel_store.set_source_channel(ctx.guild.id, channel.id)
+    manager = get_temp_channel_manager(ctx.guild)
+    if previous and previous != channel.id:
+        # Запас создан в категории старого исходного канала
+        manager.drain_pool()
+    manager.ensure_pool()
     await ctx.send(f'✅ Исходный голосовой канал установлен: {channel.mention}\n'
                    f'Теперь при заходе в этот канал будет создаваться новый канал с максимальным качеством.')
 
@@ -529,135 +1588,196 @@ async def remove_voice_channel(ctx):
     """Удаление настройки исходного голосового канала"""
     if ctx.guild.id in source_voice_channels:
         del source_voice_channels[ctx.guild.id]
-        save_voice_channels()
+        channel_store.remove_source_channel(ctx.guild.id)
+        get_temp_channel_manager(ctx.guild).drain_pool()
         await ctx.send('✅ Настройка исходного голосового канала удалена')
     else:
         await ctx.send('❌ Исходный голосовой канал не установлен')
 
 
+TEMP_CHANNELS_CREATED = metrics.registry.counter('bot_temp_channels_created_total', 'Созданные временные голосовые каналы')
+TEMP_CHANNELS_DELETED = metrics.registry.counter('bot_temp_channels_deleted_total', 'Удалённые временные голосовые каналы')
+TEMP_CHANNEL_ERRORS = metrics.registry.counter(
+    'bot_temp_channel_errors_total', 'Ошибки операций с временными каналами', ('operation',)
+)
+
+# Временные каналы: запас заранее созданных каналов на сервер (0 - создавать по заходу),
+# задержка удаления опустевшего канала и лимит создания каналов на сервер (штук за 10 секунд)
+TEMP_CHANNEL_POOL_SIZE = int(os.getenv('TEMP_CHANNEL_POOL_SIZE', 0))
+TEMP_CHANNEL_DELETE_DELAY = float(os.getenv('TEMP_CHANNEL_DELETE_DELAY', 10))
+TEMP_CHANNEL_CREATE_RATE = int(os.getenv('TEMP_CHANNEL_CREATE_RATE', 5))
+
+# Менеджеры временных каналов серверов: создание и перемещение по очереди, с лимитом запросов
+temp_channel_managers = {}
+
+
+def on_temp_channel_created(guild_id, channel_id):
+    remember_temp_channel(guild_id, channel_id)
+    TEMP_CHANNELS_CREATED.inc()
+    notify_panel('voice_channels', guild_id)
+
+
+def on_temp_channel_deleted(guild_id, channel_id):
+    forget_temp_channel(guild_id, channel_id)
+    TEMP_CHANNELS_DELETED.inc()
+    notify_panel('voice_channels', guild_id)
+
+
+def get_temp_channel_manager(guild):
+    """Возвращает (создаёт при необходимости) менеджер временных каналов сервера"""
+    if guild.id not in temp_channel_managers:
+        temp_channel_managers[guild.id] = TempChannelManager(
+            guild,
+            source_channel_id=lambda: source_voice_channels.get(guild.id),
+            is_temp=lambda channel_id: channel_id in created_voice_channels.get(guild.id, ()),
+            on_created=lambda channel_id: on_temp_channel_created(guild.id, channel_id),
+            on_deleted=lambda channel_id: on_temp_channel_deleted(guild.id, channel_id),
+            on_error=lambda operation, error: TEMP_CHANNEL_ERRORS.inc(operation=operation),
+            bucket=RateBucket(TEMP_CHANNEL_CREATE_RATE, 10),
+            pool_size=TEMP_CHANNEL_POOL_SIZE,
+            delete_delay=TEMP_CHANNEL_DELETE_DELAY
+        )
+    return temp_channel_managers[guild.id]
+
+
 @bot.event
 async def on_voice_state_update(member, before, after):
     """Обработчик изменений состояния голосовых каналов"""
+    # Веб-панель показывает участников созданных каналов и подключение самого бота
+    notify_panel('voice_channels', member.guild.id)
+    if member == member.guild.me:
+        notify_panel('music', member.guild.id)
+        notify_panel('guilds')
+    
     # Игнорируем ботов
-    if member.bot:
+    if member.bot or before.channel == after.channel:
         return
     
     guild_id = member.guild.id
-    
-    # Проверяем, установлен ли исходный канал для этого сервера
-    if guild_id not in source_voice_channels:
-        # Проверяем удаление пустых созданных каналов даже если исходный канал не установлен
-        # (на случай, если настройка была удалена, но каналы остались)
-        if before and before.channel:
-            await check_and_delete_empty_channel(before.channel, guild_id)
-        return
-    
-    source_channel_id = source_voice_channels[guild_id]
-    
-    # Проверяем, зашёл ли пользователь в исходный канал
-    if after.channel and after.channel.id == source_channel_id:
-        try:
-            # Получаем максимальный битрейт для сервера
-            # Для обычных серверов: 96000, для VIP: 128000, для Boost Level 2: 256000, для Boost Level 3: 384000
-            max_bitrate = min(384000, member.guild.bitrate_limit)
-            
-            # Создаём новый голосовой канал с максимальным качеством
-            category = after.channel.category
-            new_channel = await member.guild.create_voice_channel(
-                name=f'🎵 {member.display_name}',
-                category=category,
-                bitrate=max_bitrate,
-                user_limit=0  # Без ограничения пользователей
-            )
-            
-            # Добавляем канал в список созданных каналов
-            if guild_id not in created_voice_channels:
-                created_voice_channels[guild_id] = set()
-            created_voice_channels[guild_id].add(new_channel.id)
-            
-            # Перемещаем пользователя в новый канал
-            await member.move_to(new_channel)
-            
-            # Отправляем уведомление (если есть текстовый канал)
-            # Можно настроить отправку в определённый канал или в канал, где была команда
-            print(f'✅ Создан новый голосовой канал {new_channel.name} для {member.display_name} с битрейтом {max_bitrate} bps')
-            
-        except discord.Forbidden:
-            print(f'❌ Нет прав для создания голосового канала или перемещения пользователя')
-        except discord.HTTPException as e:
-            print(f'❌ Ошибка при создании канала или перемещении пользователя: {e}')
-        except Exception as e:
-            print(f'❌ Неожиданная ошибка: {e}')
-    
-    # Проверяем, покинул ли пользователь канал, который был создан ботом
-    if before and before.channel:
-        await check_and_delete_empty_channel(before.channel, guild_id)
-
-
-async def check_and_delete_empty_channel(channel, guild_id):
-    """Проверяет, является ли канал пустым созданным каналом, и удаляет его если да"""
-    # Проверяем, был ли этот канал создан ботом
-    if guild_id not in created_voice_channels:
-        return
-    
-    if channel.id not in created_voice_channels[guild_id]:
+    if guild_id not in created_voice_channels and guild_id not in source_voice_channels:
         return
     
-    # Проверяем, пуст ли канал (только боты или вообще никого)
-    members = [m for m in channel.members if not m.bot]
-    
-    if len(members) == 0:
-        try:
-            # Удаляем канал из списка созданных
-            created_voice_channels[guild_id].discard(channel.id)
-            # Если список пуст, можно удалить ключ (опционально)
-            if not created_voice_channels[guild_id]:
-                del created_voice_channels[guild_id]
-            
-            # Удаляем канал
-            await channel.delete()
-            print(f'🗑️ Удалён пустой голосовой канал {channel.name}')
-        except discord.Forbidden:
-            print(f'❌ Нет прав для удаления голосового канала {channel.name}')
-        except discord.HTTPException as e:
-            print(f'❌ Ошибка при удалении канала {channel.name}: {e}')
-        except Exception as e:
-            print(f'❌ Неожиданная ошибка при удалении канала: {e}')
+    # Менеджер сервера ведёт занятость временных каналов: заход в исходный канал ставит
+    # в очередь создание (или выдачу из запаса), опустевший канал удаляется с задержкой.
+    # Удаление пустых созданных каналов работает, даже если настройка исходного канала удалена
+    get_temp_channel_manager(member.guild).voice_update(member, before.channel, after.channel)
+
+
+# Простаивающие голосовые сессии: таймауты в секундах (0 - не отключать по этой причине)
+IDLE_EMPTY_CHANNEL_TIMEOUT = float(os.getenv('IDLE_EMPTY_CHANNEL_TIMEOUT', 120))
+IDLE_PAUSED_TIMEOUT = float(os.getenv('IDLE_PAUSED_TIMEOUT', 900))
+IDLE_QUEUE_TIMEOUT = float(os.getenv('IDLE_QUEUE_TIMEOUT', 300))
+IDLE_CHECK_INTERVAL = float(os.getenv('IDLE_CHECK_INTERVAL', 30))
+
+IDLE_SESSIONS_REAPED = metrics.registry.counter(
+    'bot_idle_sessions_reaped_total', 'Отключённые простаивающие голосовые сессии', ('reason',)
+)
+GUILD_STATE_EVICTED = metrics.registry.counter(
+    'bot_guild_state_evicted_total', 'Удалённое состояние серверов без голосового подключения'
+)
+FFMPEG_KILLED = metrics.registry.counter(
+    'bot_ffmpeg_orphans_killed_total', 'Завершённые процессы FFmpeg серверов без голосового подключения'
+)
+
+
+async def release_idle_session(voice_client, reason):
+    """Отключает простаивающую сессию; ресурсы освобождаются при той же проверке в evict_guild_state"""
+    guild = voice_client.guild
+    await end_voice_session(voice_client)
+    notify_panel('music', guild.id)
+    print(f'💤 Отключился от голосового канала на сервере {guild.name}: {REASON_TITLES[reason]}')
+
+
+def evict_guild_state():
+    """Удаляет состояние серверов, где бот не подключён к голосу; возвращает число серверов"""
+    connected = {voice_client.guild.id for voice_client in bot.voice_clients}
+    evicted = set()
+    # Сначала останавливаем то, что наполняет состояние: иначе догрузка плейлиста
+    # сразу создаст очередь заново, а ожидающие поиски запустят подготовку треков
+    stale = (set(music_queues) | set(queue_prefetchers) | set(guild_players) | set(collection_loaders)) - connected
+    for guild_id in stale:
+        cancel_collection_loaders(guild_id)
+        extraction_service.cancel_guild(guild_id)
+    # Очередь без подключения уже не заиграет: бот ушёл сам, отключён сторожем или выгнан из канала
+    for guild_id in [guild_id for guild_id in music_queues if guild_id not in connected]:
+        del music_queues[guild_id]
+        evicted.add(guild_id)
+    for guild_id in [guild_id for guild_id in queue_prefetchers if guild_id not in connected]:
+        stop_prefetcher(guild_id)
+        evicted.add(guild_id)
+    for guild_id in [guild_id for guild_id in guild_players if guild_id not in connected]:
+        guild_players.pop(guild_id).cleanup()
+        evicted.add(guild_id)
+    for guild_id in [guild_id for guild_id, loaders in collection_loaders.items() if not loaders]:
+        # Подключённые серверы, у которых все загрузки уже закончились
+        del collection_loaders[guild_id]
+    for guild_id in [guild_id for guild_id, manager in temp_channel_managers.items() if manager.is_idle]:
+        del temp_channel_managers[guild_id]
+    killed = kill_orphan_ffmpeg(connected)
+    if killed:
+        FFMPEG_KILLED.inc(killed)
+        print(f'🧹 Завершено {killed} процессов FFmpeg без голосового подключения')
+    if evicted:
+        GUILD_STATE_EVICTED.inc(len(evicted))
+    return len(evicted)
+
+
+idle_reaper = IdleSessionReaper(
+    voice_clients=lambda: bot.voice_clients,
+    release=release_idle_session,
+    evict=evict_guild_state,
+    timeouts={
+        EMPTY_CHANNEL: IDLE_EMPTY_CHANNEL_TIMEOUT,
+        PAUSED: IDLE_PAUSED_TIMEOUT,
+        QUEUE_EMPTY: IDLE_QUEUE_TIMEOUT,
+    },
+    interval=IDLE_CHECK_INTERVAL,
+    on_reaped=lambda reason: IDLE_SESSIONS_REAPED.inc(reason=reason)
+)
 
 
 # Инициализация веб-панели (опционально)
 WEB_PANEL_ENABLED = os.getenv('WEB_PANEL_ENABLED', 'false').lower() == 'true'
 WEB_PANEL_PORT = int(os.getenv('WEB_PANEL_PORT', 5000))
 
+# Запуск веб-панели (aiohttp в event loop бота) - вызывается из setup_hook
+start_web_panel = None
 if WEB_PANEL_ENABLED:
     try:
-        from web_panel import init_web_panel, run_web_panel
-        import threading
-        import time
+        from web_panel import init_web_panel, register_stats_provider, register_volume_setter, register_loop_incidents
+        from web_panel import register_volume_getter
+        from web_panel import register_stop_handler
+        from web_panel import notify as panel_notify, start_web_panel
         
-        def start_web_panel():
-            """Запуск веб-панели в отдельном потоке"""
-            # Небольшая задержка, чтобы бот успел инициализироваться
-            time.sleep(2)
-            try:
-                init_web_panel(bot, music_queues, source_voice_channels, created_voice_channels)
-                print(f'🚀 Запуск веб-панели на порту {WEB_PANEL_PORT}...')
-                run_web_panel(host='0.0.0.0', port=WEB_PANEL_PORT)
-            except Exception as e:
-                print(f'❌ Ошибка в веб-панели: {e}')
-                import traceback
-                traceback.print_exc()
-        
-        # Запускаем веб-панель в отдельном потоке
-        web_thread = threading.Thread(target=start_web_panel, daemon=True)
-        web_thread.start()
+        init_web_panel(bot, music_queues, source_voice_channels, created_voice_channels)
+        register_stats_provider('track_gap', track_gap_stats.snapshot)
+        register_stats_provider('extraction', extraction_service.stats)
+        if search_cache:
+            register_stats_provider('search_cache', search_cache.stats)
+        register_stats_provider('autocomplete', autocomplete_engine.stats)
+        register_stats_provider('players', lambda: {
+            str(guild_id): player.stats() for guild_id, player in list(guild_players.items())
+        })
+        if audio_cache:
+            register_stats_provider('audio_cache', audio_cache.stats)
+        register_stats_provider('loop_watchdog', loop_watchdog.stats)
+        register_stats_provider('channel_store', channel_store.stats)
+        register_stats_provider('relay', message_relay.stats)
+        register_stats_provider('idle_sessions', idle_reaper.stats)
+        register_stats_provider('temp_channels', lambda: {
+            key: sum(manager.stats()[key] for manager in list(temp_channel_managers.values()))
+            for key in ('pending_requests', 'pending_deletes', 'pool', 'occupied', 'empty_grace', 'pool_hits', 'reused')
+        })
+        register_loop_incidents(loop_watchdog.recent)
+        register_volume_setter(set_guild_volume)
+        register_volume_getter(lambda guild_id: guild_volumes.get(guild_id, DEFAULT_VOLUME))
+        register_stop_handler(stop_playback)
         print(f'✅ Веб-панель инициализирована, будет доступна на http://0.0.0.0:{WEB_PANEL_PORT}')
     except ImportError as e:
-        print(f'⚠️ Flask не установлен. Веб-панель недоступна. Установите: pip install flask flask-cors')
+        print(f'⚠️ aiohttp не установлен. Веб-панель недоступна. Установите: pip install aiohttp')
         print(f'   Детали ошибки: {e}')
     except Exception as e:
         print(f'⚠️ Ошибка запуска веб-панели: {e}')
-        import traceback
         traceback.print_exc()
 else:
     print('ℹ️ Веб-панель отключена. Установите WEB_PANEL_ENABLED=true для включения.')
@@ -665,8 +1785,13 @@ else:
 
 # Запуск бота
 if __name__ == '__main__':
+    startup_timer.since_start('imports')
     if not TOKEN:
         print('Ошибка: DISCORD_TOKEN не найден в .env файле!')
     else:
-        bot.run(TOKEN)
+        try:
+            bot.run(TOKEN)
+        finally:
+            # Изменения, ещё не записанные в фоне
+            channel_store.close()
 
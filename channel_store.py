@@ -0,0 +1,186 @@
+"""
+Хранилище настроек каналов (SQLite)
+
+Хранит исходные голосовые каналы серверов, временные каналы, созданные ботом (чтобы
+после перезапуска удалить опустевшие за это время каналы), и маршруты повтора
+сообщений между текстовыми каналами. Изменения копятся в памяти
+и записываются одной транзакцией в фоновом потоке, не блокируя event loop; частые
+изменения одного и того же канала схлопываются в одну запись.
+
+Каждый сервер и канал - отдельная строка, поэтому процессы кластера пишут в общую базу,
+не затирая данные друг друга.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Таблицы в ключах очереди изменений
+_SOURCE = 'source'
+_TEMP = 'temp'
+_ROUTE = 'route'
+
+
+class ChannelStore:
+    def __init__(self, path, *, flush_delay=1.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Процессы кластера пишут в одну базу - ждём блокировку, а не падаем
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS source_channels ('
+            ' guild_id INTEGER PRIMARY KEY,'
+            ' channel_id INTEGER NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS temp_channels ('
+            ' channel_id INTEGER PRIMARY KEY,'
+            ' guild_id INTEGER NOT NULL,'
+            ' created_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS relay_routes ('
+            ' source_channel_id INTEGER NOT NULL,'
+            ' target_channel_id INTEGER NOT NULL,'
+            ' guild_id INTEGER NOT NULL,'
+            ' filter TEXT NOT NULL,'
+            ' pattern TEXT,'
+            ' PRIMARY KEY (source_channel_id, target_channel_id))'
+        )
+        self._conn.commit()
+
+        self._pending = {}  # (таблица, ключ) -> значение или None для удаления
+        self._flush_task = None
+        self.writes = 0
+        self.write_errors = 0
+
+    def import_json(self, json_path):
+        """Переносит настройки из старого voice_channels.json (один раз, если база пуста)"""
+        if not os.path.exists(json_path):
+            return 0
+        with self._lock:
+            if self._conn.execute('SELECT COUNT(*) FROM source_channels').fetchone()[0]:
+                return 0
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO source_channels VALUES (?, ?)',
+                [(int(guild_id), int(channel_id)) for guild_id, channel_id in data.items()]
+            )
+            self._conn.commit()
+        os.replace(json_path, json_path + '.bak')
+        return len(data)
+
+    def load_source_channels(self):
+        """guild_id -> channel_id исходного канала"""
+        with self._lock:
+            return dict(self._conn.execute('SELECT guild_id, channel_id FROM source_channels'))
+
+    def load_temp_channels(self):
+        """guild_id -> set(channel_id) временных каналов"""
+        channels = {}
+        with self._lock:
+            for channel_id, guild_id in self._conn.execute('SELECT channel_id, guild_id FROM temp_channels'):
+                channels.setdefault(guild_id, set()).add(channel_id)
+        return channels
+
+    def load_relay_routes(self):
+        """Список (source_id, target_id, guild_id, фильтр, шаблон) маршрутов повтора"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT source_channel_id, target_channel_id, guild_id, filter, pattern FROM relay_routes'
+            ).fetchall()
+
+    # Изменения: применяются к базе в фоне, пачкой
+
+    def set_source_channel(self, guild_id, channel_id):
+        self._queue((_SOURCE, guild_id), channel_id)
+
+    def remove_source_channel(self, guild_id):
+        self._queue((_SOURCE, guild_id), None)
+
+    def add_temp_channel(self, guild_id, channel_id):
+        self._queue((_TEMP, channel_id), guild_id)
+
+    def remove_temp_channel(self, channel_id):
+        self._queue((_TEMP, channel_id), None)
+
+    def set_relay_route(self, source_id, target_id, guild_id, filter, pattern):
+        self._queue((_ROUTE, (source_id, target_id)), (guild_id, filter, pattern))
+
+    def remove_relay_route(self, source_id, target_id):
+        self._queue((_ROUTE, (source_id, target_id)), None)
+
+    def _queue(self, key, value):
+        self._pending[key] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения в базу (в фоновом потоке)"""
+        changes, self._pending = self._pending, {}
+        if not changes:
+            return
+        try:
+            await asyncio.to_thread(self._write, changes)
+        except Exception as e:
+            self.write_errors += 1
+            print(f'⚠️ Ошибка сохранения настроек каналов: {e}')
+            # Возвращаем изменения в очередь, если за это время их не перезаписали более новые
+            for key, value in changes.items():
+                self._pending.setdefault(key, value)
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    def _write(self, changes):
+        now = time.time()
+        upsert_source, delete_source, upsert_temp, delete_temp = [], [], [], []
+        upsert_route, delete_route = [], []
+        for (table, key), value in changes.items():
+            if table == _SOURCE:
+                if value is None:
+                    delete_source.append((key,))
+                else:
+                    upsert_source.append((key, value))
+            elif table == _ROUTE:
+                if value is None:
+                    delete_route.append(key)
+                else:
+                    upsert_route.append(key + value)
+            elif value is None:
+                delete_temp.append((key,))
+            else:
+                upsert_temp.append((key, value, now))
+        with self._lock:
+            # Одна транзакция: после сбоя в базе либо все изменения пачки, либо ни одного
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO source_channels VALUES (?, ?)', upsert_source)
+                self._conn.executemany('DELETE FROM source_channels WHERE guild_id = ?', delete_source)
+                self._conn.executemany('INSERT OR REPLACE INTO temp_channels VALUES (?, ?, ?)', upsert_temp)
+                self._conn.executemany('DELETE FROM temp_channels WHERE channel_id = ?', delete_temp)
+                self._conn.executemany('INSERT OR REPLACE INTO relay_routes VALUES (?, ?, ?, ?, ?)', upsert_route)
+                self._conn.executemany(
+                    'DELETE FROM relay_routes WHERE source_channel_id = ? AND target_channel_id = ?', delete_route
+                )
+        self.writes += 1
+
+    def stats(self):
+        """Счётчики записи для веб-панели"""
+        return {'pending': len(self._pending), 'writes': self.writes, 'write_errors': self.write_errors}
+
+    def close(self):
+        """Синхронно дописывает оставшиеся изменения (при остановке, когда event loop уже закрыт)"""
+        if self._pending:
+            changes, self._pending = self._pending, {}
+            self._write(changes)
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,308 @@
+"""
+Кластерный режим: несколько процессов бота, каждый со своим диапазоном шардов
+
+Запуск:
+    python cluster.py
+
+Лаунчер узнаёт рекомендованное число шардов у Discord (или берёт SHARD_COUNT),
+делит их между CLUSTER_COUNT процессами и запускает в каждом bot.py с переменными
+SHARD_IDS, SHARD_COUNT и CLUSTER_ID. Упавший процесс перезапускается с задержкой.
+
+Каждый процесс отвечает о своём состоянии через Unix-сокет в каталоге CLUSTER_SOCKET_DIR
+(по одной JSON-строке на запрос), а веб-панель собирает ответы всех процессов.
+
+Общие данные (база настроек каналов и перенос старого voice_channels.json) лаунчер
+готовит один раз до запуска процессов; локальный кэш аудио у каждого процесса свой.
+"""
+import asyncio
+import glob
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from dotenv import load_dotenv
+
+from channel_store import ChannelStore
+
+# Общие для всех процессов файлы настроек каналов
+CHANNEL_STORE_FILE = os.path.join('data', 'channels.db')
+VOICE_CHANNELS_FILE = os.path.join('data', 'voice_channels.json')
+CLUSTER_SOCKET_DIR = os.getenv('CLUSTER_SOCKET_DIR', os.path.join('data', 'clusters'))
+# Discord разрешает max_concurrency подключений шардов (IDENTIFY) за 5 секунд
+IDENTIFY_INTERVAL = 5
+# Как часто лаунчер выводит сводку о состоянии процессов (секунды)
+CLUSTER_HEALTH_INTERVAL = int(os.getenv('CLUSTER_HEALTH_INTERVAL', 60))
+
+
+def socket_path(cluster_id, directory=CLUSTER_SOCKET_DIR):
+    return os.path.join(directory, f'cluster-{cluster_id}.sock')
+
+
+# ---------- Процесс бота: ответы о состоянии ----------
+
+class ClusterHealthServer:
+    """Unix-сокет, через который процесс бота сообщает о своём состоянии.
+
+    handlers - словарь "операция -> функция без аргументов, возвращающая dict".
+    """
+
+    def __init__(self, cluster_id, handlers, *, directory=CLUSTER_SOCKET_DIR):
+        self.cluster_id = cluster_id
+        self.handlers = handlers
+        self.path = socket_path(cluster_id, directory)
+        self._server = None
+
+    async def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            # Сокет остался от предыдущего запуска этого кластера
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def _handle(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            request = json.loads(line or b'{}')
+            handler = self.handlers.get(request.get('op', 'health'))
+            if handler is None:
+                response = {'error': f"unknown op: {request.get('op')}"}
+            else:
+                response = handler()
+        except Exception as e:
+            response = {'error': str(e)}
+        try:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# ---------- Веб-панель: опрос всех процессов ----------
+
+def query_cluster(path, op='health', timeout=1.0):
+    """Отправляет запрос процессу кластера и возвращает его ответ (блокирующий вызов)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps({'op': op}).encode() + b'\n')
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks))
+
+
+def query_clusters(op='health', directory=CLUSTER_SOCKET_DIR, timeout=1.0):
+    """Опрашивает все процессы кластера; недоступные помечаются status=unreachable"""
+    results = []
+    for path in sorted(glob.glob(os.path.join(directory, 'cluster-*.sock'))):
+        cluster_id = os.path.basename(path)[len('cluster-'):-len('.sock')]
+        try:
+            response = query_cluster(path, op, timeout)
+        except (OSError, ValueError) as e:
+            response = {'cluster_id': int(cluster_id) if cluster_id.isdigit() else cluster_id,
+                        'status': 'unreachable', 'error': str(e)}
+        results.append(response)
+    return results
+
+
+# ---------- Лаунчер ----------
+
+def fetch_gateway_info(token):
+    """Рекомендованное число шардов и лимит одновременных подключений от Discord"""
+    request = urllib.request.Request(
+        'https://discord.com/api/v10/gateway/bot',
+        headers={'Authorization': f'Bot {token}', 'User-Agent': 'DiscordBot (cluster launcher, 1.0)'}
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        payload = json.load(response)
+    return payload['shards'], payload.get('session_start_limit', {}).get('max_concurrency', 1)
+
+
+def prepare_shared_data():
+    """Создаёт общую базу настроек и переносит в неё voice_channels.json - один раз для всех процессов"""
+    os.makedirs(os.path.dirname(CHANNEL_STORE_FILE), exist_ok=True)
+    store = ChannelStore(CHANNEL_STORE_FILE)
+    try:
+        imported = store.import_json(VOICE_CHANNELS_FILE)
+        if imported:
+            print(f'✅ Настройки {imported} голосовых каналов перенесены из {VOICE_CHANNELS_FILE}')
+    finally:
+        store.close()
+
+
+def split_shards(shard_count, cluster_count):
+    """Делит шарды 0..shard_count-1 на cluster_count непрерывных диапазонов"""
+    cluster_count = max(1, min(cluster_count, shard_count))
+    per_cluster, extra = divmod(shard_count, cluster_count)
+    ranges = []
+    start = 0
+    for cluster_id in range(cluster_count):
+        size = per_cluster + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class ClusterProcess:
+    """Процесс bot.py одного кластера с перезапуском при падении"""
+
+    # Процесс, проработавший столько секунд, считается стабильным - задержка перезапуска сбрасывается
+    STABLE_AFTER = 300
+    MAX_RESTART_DELAY = 60
+
+    def __init__(self, cluster_id, shard_ids, shard_count, cluster_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.cluster_count = cluster_count
+        self.process = None
+        self.started_at = 0
+        self.restarts = 0
+        self.restart_at = None
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            'CLUSTER_ID': str(self.cluster_id),
+            'SHARD_IDS': ','.join(map(str, self.shard_ids)),
+            'SHARD_COUNT': str(self.shard_count),
+            'CLUSTER_COUNT': str(self.cluster_count),
+            'CLUSTER_SOCKET_DIR': CLUSTER_SOCKET_DIR,
+        })
+        if self.cluster_id != 0:
+            # Веб-панель работает только в первом процессе и опрашивает остальные через сокеты
+            env['WEB_PANEL_ENABLED'] = 'false'
+        self.process = subprocess.Popen([sys.executable, 'bot.py'], env=env)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        print(f'🚀 Кластер {self.cluster_id}: PID {self.process.pid}, шарды {self.shard_ids[0]}-{self.shard_ids[-1]}')
+
+    def poll(self):
+        """Проверяет процесс и перезапускает его, если он упал и задержка истекла"""
+        now = time.monotonic()
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        if now - self.started_at > self.STABLE_AFTER:
+            self.restarts = 0
+        delay = min(self.MAX_RESTART_DELAY, 2 ** self.restarts)
+        self.restarts += 1
+        self.restart_at = now + delay
+        print(f'⚠️ Кластер {self.cluster_id} завершился с кодом {code}, перезапуск через {delay} с')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, timeout):
+        if not self.process:
+            return
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def log_health():
+    """Выводит сводку о состоянии процессов кластера"""
+    clusters = query_clusters()
+    online = [c for c in clusters if c.get('status') == 'online']
+    guilds = sum(c.get('guilds', 0) for c in online)
+    print(f'📊 Кластеры: в сети {len(online)} из {len(clusters)}, серверов {guilds}')
+    for c in clusters:
+        if c.get('status') != 'online':
+            print(f"   ⚠️ Кластер {c.get('cluster_id')}: {c.get('status', 'error')} {c.get('error', '')}".rstrip())
+
+
+def main():
+    load_dotenv()
+    token = os.getenv('DISCORD_TOKEN')
+    if not token:
+        print('Ошибка: DISCORD_TOKEN не найден в .env файле!')
+        sys.exit(1)
+
+    shard_count = int(os.getenv('SHARD_COUNT', 0))
+    max_concurrency = 1
+    try:
+        recommended, max_concurrency = fetch_gateway_info(token)
+        shard_count = shard_count or recommended
+    except Exception as e:
+        if not shard_count:
+            print(f'❌ Не удалось получить число шардов от Discord ({e}), укажите SHARD_COUNT')
+            sys.exit(1)
+        print(f'⚠️ Не удалось получить данные шлюза Discord: {e}')
+
+    cluster_count = int(os.getenv('CLUSTER_COUNT', 0)) or os.cpu_count() or 1
+    ranges = split_shards(shard_count, cluster_count)
+    clusters = [ClusterProcess(i, shard_ids, shard_count, len(ranges)) for i, shard_ids in enumerate(ranges)]
+    print(f'📦 Шардов: {shard_count}, процессов: {len(clusters)}')
+
+    try:
+        prepare_shared_data()
+    except Exception as e:
+        print(f'❌ Ошибка подготовки базы настроек каналов: {e}')
+        sys.exit(1)
+
+    # Сокеты прошлого запуска (в том числе с другим числом процессов) больше не нужны
+    for path in glob.glob(os.path.join(CLUSTER_SOCKET_DIR, 'cluster-*.sock')):
+        os.remove(path)
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    for cluster in clusters:
+        if stopping:
+            break
+        cluster.start()
+        # Не даём процессам одновременно подключать шарды сверх лимита Discord
+        waves = math.ceil(len(cluster.shard_ids) / max_concurrency)
+        deadline = time.monotonic() + waves * IDENTIFY_INTERVAL
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+    next_report = time.monotonic() + CLUSTER_HEALTH_INTERVAL
+    while not stopping:
+        for cluster in clusters:
+            cluster.poll()
+        if time.monotonic() >= next_report:
+            next_report = time.monotonic() + CLUSTER_HEALTH_INTERVAL
+            log_health()
+        time.sleep(1)
+
+    print('⏹️ Остановка кластеров...')
+    for cluster in clusters:
+        cluster.stop()
+    for cluster in clusters:
+        cluster.wait(timeout=15)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Пул извлечения информации о треках через yt-dlp
+
+Каждый рабочий поток (или процесс) держит собственный экземпляр YoutubeDL,
+поэтому один объект никогда не используется из нескольких потоков одновременно.
+Очередь ограничена по размеру, задачи разных серверов выбираются по кругу,
+одинаковые запросы объединяются, а ожидание можно отменить для всего сервера.
+Фоновые скачивания (локальный кэш аудио) идут в отдельных потоках мимо очереди,
+чтобы не занимать рабочих и место в очереди интерактивных запросов.
+"""
+import asyncio
+import importlib
+import multiprocessing
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class ExtractionQueueFull(Exception):
+    """Очередь извлечения переполнена"""
+
+
+class ExtractionCancelled(Exception):
+    """Ожидание результата отменено (пропуск трека, остановка или выход из канала)"""
+
+
+# Свой YoutubeDL для каждого потока/процесса: ключ - набор опций
+_local = threading.local()
+
+
+def _get_ytdl(options):
+    """Возвращает YoutubeDL текущего потока для указанных опций"""
+    instances = getattr(_local, 'instances', None)
+    if instances is None:
+        instances = _local.instances = {}
+    key = repr(sorted(options.items()))
+    if key not in instances:
+        # yt-dlp импортируется при первом извлечении, а не при запуске бота (~0.1-0.2 с)
+        import yt_dlp
+        instances[key] = yt_dlp.YoutubeDL(options)
+    return instances[key]
+
+
+def _extract(query, options, download):
+    """Выполняется в рабочем потоке/процессе"""
+    ytdl = _get_ytdl(options)
+    info = ytdl.extract_info(query, download=download)
+    # Приводим ответ к простому dict, чтобы его можно было передать между процессами
+    return ytdl.sanitize_info(info)
+
+
+def _warmup():
+    # Рабочие процессы импортируют yt-dlp сразу, параллельно с запуском бота
+    importlib.import_module('yt_dlp')
+
+
+class _Job:
+    __slots__ = ('key', 'query', 'options', 'download', 'waiters')
+
+    def __init__(self, key, query, options, download):
+        self.key = key
+        self.query = query
+        self.options = options
+        self.download = download
+        self.waiters = []  # Список (guild_id, future) ожидающих результат
+
+
+class ExtractionService:
+    """Ограниченный пул извлечения с честной очередью по серверам"""
+
+    def __init__(self, options, *, workers=4, mode='thread', max_pending=100, download_workers=1):
+        self.options = options
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.max_pending = max_pending
+        self.download_workers = max(1, download_workers)
+
+        if mode == 'process':
+            # fork: дочерним процессам не нужно заново импортировать bot.py.
+            # Прогреваем пул сразу, пока в процессе ещё нет рабочих потоков.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('fork')
+            )
+            for _ in range(self.workers):
+                self._executor.submit(_warmup)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ytdl')
+        # Скачивание упирается в сеть и диск, а не в CPU, поэтому всегда в потоках
+        self._download_executor = ThreadPoolExecutor(
+            max_workers=self.download_workers, thread_name_prefix='ytdl-download'
+        )
+
+        self._queues = OrderedDict()  # guild_id -> deque(_Job), порядок = очередь обхода по кругу
+        self._inflight = {}  # key -> _Job (в очереди или выполняется)
+        self._pending = 0
+        self._running = 0
+        self._downloads = {}  # (query, options) -> Future скачивания
+        self._closed = False
+
+        self.completed = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    async def extract(self, query, *, guild_id=None, download=False, options=None):
+        """Извлекает информацию о треке; одинаковые запросы выполняются один раз"""
+        if self._closed:
+            raise ExtractionCancelled()
+        loop = asyncio.get_running_loop()
+        options = options or self.options
+        key = (query, download, repr(sorted(options.items())))
+
+        job = self._inflight.get(key)
+        if job is None:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise ExtractionQueueFull('Очередь поиска треков переполнена, попробуйте позже')
+            job = _Job(key, query, options, download)
+            self._inflight[key] = job
+            self._queues.setdefault(guild_id, deque()).append(job)
+            self._pending += 1
+        else:
+            self.deduplicated += 1
+
+        waiter = loop.create_future()
+        job.waiters.append((guild_id, waiter))
+        self._dispatch(loop)
+        return await waiter
+
+    async def download(self, query, options):
+        """Скачивает трек в собственных потоках, не занимая пул и очередь извлечения"""
+        if self._closed:
+            raise ExtractionCancelled()
+        key = (query, repr(sorted(options.items())))
+        future = self._downloads.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._download_executor, _extract, query, options, True)
+            self._downloads[key] = future
+            future.add_done_callback(lambda f: self._downloads.pop(key, None))
+        return await asyncio.shield(future)
+
+    def cancel_guild(self, guild_id):
+        """Отменяет ожидание всех извлечений сервера.
+
+        Задачи в очереди, которые больше никому не нужны, удаляются;
+        уже выполняющиеся дорабатывают, но их результат никому не отдаётся.
+        """
+        for job in list(self._inflight.values()):
+            remaining = []
+            for waiter_guild, waiter in job.waiters:
+                if waiter_guild == guild_id and not waiter.done():
+                    waiter.set_exception(ExtractionCancelled())
+                    self.cancelled += 1
+                else:
+                    remaining.append((waiter_guild, waiter))
+            job.waiters = remaining
+
+        queue = self._queues.get(guild_id)
+        if queue:
+            for job in [job for job in queue if not job.waiters]:
+                queue.remove(job)
+                self._inflight.pop(job.key, None)
+                self._pending -= 1
+            if not queue:
+                del self._queues[guild_id]
+
+    def _next_job(self):
+        """Берёт следующую задачу, обходя серверы по кругу"""
+        while self._queues:
+            guild_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+            self._pending -= 1
+            if job.waiters:
+                return job
+            # Все ожидающие отменились, пока задача лежала в очереди
+            self._inflight.pop(job.key, None)
+        return None
+
+    def _dispatch(self, loop):
+        while not self._closed and self._running < self.workers:
+            job = self._next_job()
+            if job is None:
+                return
+            self._running += 1
+            future = loop.run_in_executor(self._executor, _extract, job.query, job.options, job.download)
+            future.add_done_callback(lambda f, job=job: self._finish(job, f, loop))
+
+    def _finish(self, job, future, loop):
+        self._running -= 1
+        self._inflight.pop(job.key, None)
+        self.completed += 1
+        for _, waiter in job.waiters:
+            if waiter.done():
+                continue
+            if future.cancelled():
+                waiter.set_exception(ExtractionCancelled())
+            elif future.exception() is not None:
+                waiter.set_exception(future.exception())
+            else:
+                waiter.set_result(future.result())
+        self._dispatch(loop)
+
+    def stats(self):
+        """Состояние пула для веб-панели"""
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'running': self._running,
+            'pending': self._pending,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'deduplicated': self.deduplicated,
+            'rejected': self.rejected,
+            'cancelled': self.cancelled,
+            'downloads': len(self._downloads),
+            'download_workers': self.download_workers,
+        }
+
+    def shutdown(self):
+        """Останавливает пулы при завершении бота; ожидающие результат получают ExtractionCancelled"""
+        self._closed = True
+        for job in list(self._inflight.values()):
+            for _, waiter in job.waiters:
+                if not waiter.done():
+                    waiter.set_exception(ExtractionCancelled())
+            job.waiters = []
+        for queue in self._queues.values():
+            for job in queue:
+                self._inflight.pop(job.key, None)
+        self._queues.clear()
+        self._pending = 0
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._download_executor.shutdown(wait=False, cancel_futures=True)
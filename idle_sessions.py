@@ -0,0 +1,122 @@
+"""
+Освобождение простаивающих голосовых сессий
+
+Без этого бот остаётся в голосовом канале до перезапуска: подключение, плеер, процессы
+FFmpeg и состояние сервера живут, даже когда очередь давно закончилась. Сторож раз
+в interval секунд проверяет голосовые подключения и отключает те, что простаивают
+дольше таймаута своей причины:
+  - в канале не осталось слушателей (кроме ботов);
+  - воспроизведение стоит на паузе;
+  - ничего не играет и не стоит на паузе (очередь пуста или плеер остановлен с треками
+    в очереди - например, после ошибки подготовки трека).
+Таймаут 0 отключает проверку причины. На той же проверке удаляется состояние серверов,
+где бот больше не подключён к голосу (очереди, предзагрузчики, оставшиеся процессы FFmpeg).
+"""
+import asyncio
+import time
+from collections import Counter
+
+# Причины простоя в порядке проверки
+EMPTY_CHANNEL = 'empty_channel'
+PAUSED = 'paused'
+QUEUE_EMPTY = 'queue_empty'
+
+REASON_TITLES = {
+    EMPTY_CHANNEL: 'в канале нет слушателей',
+    PAUSED: 'воспроизведение на паузе',
+    QUEUE_EMPTY: 'очередь пуста',
+}
+
+
+def idle_reasons(voice_client):
+    """Причины, по которым голосовое подключение сейчас простаивает (в порядке проверки)"""
+    reasons = []
+    channel = voice_client.channel
+    if channel is not None and not any(not member.bot for member in channel.members):
+        reasons.append(EMPTY_CHANNEL)
+    if voice_client.is_paused():
+        reasons.append(PAUSED)
+    elif not voice_client.is_playing():
+        # Треки в очереди не мешают простою: если плеер остановился, сам он их не запустит
+        reasons.append(QUEUE_EMPTY)
+    return reasons
+
+
+class IdleSessionReaper:
+    def __init__(self, *, voice_clients, release, evict, timeouts, interval=30.0, on_reaped=None):
+        self.voice_clients = voice_clients  # () -> голосовые подключения бота
+        self.release = release  # корутина (voice_client, причина): отключение и освобождение ресурсов
+        self.evict = evict  # () -> число серверов, чьё состояние удалено
+        self.timeouts = timeouts  # причина -> секунд простоя до отключения (0 - не отключать)
+        self.interval = interval
+        self.on_reaped = on_reaped  # (причина) -> None
+        self._idle = {}  # guild_id -> (причина, time.monotonic() начала простоя)
+        self._task = None
+
+        self.reaped = Counter()  # причина -> отключённых сессий
+        self.evicted = 0
+        self.sweeps = 0
+
+    def start(self, loop):
+        if self.interval > 0 and self._task is None:
+            self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f'❌ Ошибка проверки простаивающих сессий: {e}')
+
+    def _reason(self, voice_client):
+        for reason in idle_reasons(voice_client):
+            if self.timeouts.get(reason):
+                return reason
+        return None
+
+    async def sweep(self):
+        """Одна проверка: отключает сессии, простаивающие дольше таймаута, и удаляет лишнее состояние"""
+        now = time.monotonic()
+        idle = {}
+        expired = []
+        for voice_client in list(self.voice_clients()):
+            reason = self._reason(voice_client)
+            if reason is None:
+                continue
+            guild_id = voice_client.guild.id
+            previous = self._idle.get(guild_id)
+            # Отсчёт начинается заново, если сменилась причина простоя
+            since = previous[1] if previous is not None and previous[0] == reason else now
+            idle[guild_id] = (reason, since)
+            if now - since >= self.timeouts[reason]:
+                expired.append((voice_client, reason))
+        self._idle = idle
+
+        for voice_client, reason in expired:
+            self._idle.pop(voice_client.guild.id, None)
+            try:
+                await self.release(voice_client, reason)
+            except Exception as e:
+                print(f'❌ Ошибка отключения простаивающей сессии на сервере {voice_client.guild.id}: {e}')
+                continue
+            self.reaped[reason] += 1
+            if self.on_reaped:
+                self.on_reaped(reason)
+        self.evicted += self.evict()
+        self.sweeps += 1
+
+    def stats(self):
+        """Счётчики для веб-панели"""
+        return {
+            'idle': len(self._idle),
+            'reaped': sum(self.reaped.values()),
+            'reaped_by_reason': dict(self.reaped),
+            'evicted': self.evicted,
+            'timeouts': dict(self.timeouts),
+        }
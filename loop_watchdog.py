@@ -0,0 +1,99 @@
+"""
+Сторож event loop: находит код, который блокирует цикл событий бота
+
+Event loop отмечается через равные промежутки (call_later), а отдельный поток проверяет,
+как давно была последняя отметка. Если задержка превысила порог, поток снимает стек
+потока event loop в этот момент - это и есть блокирующий вызов. Последние инциденты
+хранятся в кольцевом буфере для веб-панели и выводятся в лог.
+"""
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+# Сколько кадров стека сохранять (самые глубокие, ближе к блокирующему вызову)
+STACK_LIMIT = 25
+
+
+class LoopWatchdog:
+    def __init__(self, *, threshold=0.25, interval=0.1, max_incidents=50, on_lag=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.on_lag = on_lag  # (секунды опоздания) -> None, вызывается в event loop на каждой отметке
+        self.incidents = deque(maxlen=max_incidents)
+        self.total_incidents = 0
+        self.max_lag = 0.0
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = 0.0
+        self._current = None  # Инцидент, который продолжается сейчас
+        self._stopped = threading.Event()
+
+    def start(self, loop):
+        """Запускает отметки в loop (вызывать из потока этого loop) и поток проверки"""
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        loop.call_later(self.interval, self._beat, self._last_beat + self.interval)
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _beat(self, expected):
+        now = time.monotonic()
+        self._last_beat = now
+        if self.on_lag:
+            self.on_lag(max(0.0, now - expected))
+        if not self._stopped.is_set():
+            self._loop.call_later(self.interval, self._beat, now + self.interval)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            lag = time.monotonic() - self._last_beat - self.interval
+            if lag < self.threshold:
+                if self._current is not None:
+                    self._finish(self._current)
+                    self._current = None
+                continue
+            if self._current is None:
+                self._current = self._capture(lag)
+            else:
+                self._current['lag_ms'] = round(lag * 1000)
+
+    def _capture(self, lag):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame else ''
+        incident = {
+            'time': time.time(),
+            'lag_ms': round(lag * 1000),
+            'finished': False,
+            'stack': stack,
+        }
+        # Инцидент виден в панели сразу, даже если event loop так и не освободится
+        self.incidents.append(incident)
+        self.total_incidents += 1
+        print(f'⚠️ Event loop заблокирован дольше {self.threshold * 1000:.0f} мс, стек:\n{stack}', end='')
+        return incident
+
+    def _finish(self, incident):
+        incident['finished'] = True
+        self.max_lag = max(self.max_lag, incident['lag_ms'] / 1000)
+        print(f"ℹ️ Event loop освободился, задержка {incident['lag_ms']} мс")
+
+    def stats(self):
+        """Сводка для веб-панели (без стеков)"""
+        last = self.incidents[-1] if self.incidents else None
+        return {
+            'threshold_ms': round(self.threshold * 1000),
+            'incidents': self.total_incidents,
+            'max_lag_ms': round(self.max_lag * 1000),
+            'last_lag_ms': last['lag_ms'] if last else None,
+            'last_at': last['time'] if last else None,
+        }
+
+    def recent(self):
+        """Последние инциденты со стеками, новые первыми"""
+        return [dict(incident) for incident in reversed(self.incidents)]
@@ -0,0 +1,212 @@
+"""
+Метрики бота в текстовом формате Prometheus (/metrics)
+
+Счётчики и гистограммы обновляются в местах, где происходит событие (поиск трека,
+запрос к Spotify, команда), а значения, которые и так хранятся в боте (очереди,
+голосовые подключения, задержка шлюза), считываются функциями в момент запроса.
+"""
+import math
+import time
+from contextlib import contextmanager
+
+# Время запуска процесса
+STARTED_AT = time.monotonic()
+
+# Границы гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+EXTRACTION_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+
+def uptime():
+    """Время работы процесса в секундах"""
+    return time.monotonic() - STARTED_AT
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Строки вида 'имя{метки} значение'"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик"""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {} if labelnames else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам (для задержек)"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}  # метки -> [счётчики корзин, сумма, количество]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время блока (работает и внутри корутин)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Gauge(Metric):
+    """Текущее значение, которое считывается функцией в момент запроса.
+
+    Функция возвращает число или (для метрик с метками) dict "кортеж меток -> число".
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        if not self.labelnames:
+            yield f'{self.name} {_format_value(value)}'
+            return
+        for key, item in value.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(item)}'
+
+
+class FunctionCounter(Gauge):
+    """Счётчик, который и так ведётся в боте и считывается функцией в момент запроса.
+
+    Функция должна возвращать монотонно растущее значение (например, число инцидентов сторожа).
+    """
+    type = 'counter'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, function, labelnames=()):
+        return self.register(Gauge(name, documentation, function, labelnames))
+
+    def function_counter(self, name, documentation, function, labelnames=()):
+        return self.register(FunctionCounter(name, documentation, function, labelnames))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        blocks = []
+        for metric in list(self._metrics.values()):
+            try:
+                blocks.append(metric.render())
+            except Exception as e:
+                # Одна сломанная функция не должна ломать весь ответ
+                print(f'⚠️ Ошибка метрики {metric.name}: {e}')
+        return '\n'.join(blocks) + '\n'
+
+
+registry = MetricsRegistry()
+
+registry.gauge('bot_uptime_seconds', 'Время работы процесса', uptime)
+
+# Заполняется сторожем event loop (loop_watchdog.py)
+LOOP_LAG = registry.histogram(
+    'bot_event_loop_lag_seconds', 'Опоздание event loop относительно запланированного пробуждения',
+    buckets=LOOP_LAG_BUCKETS
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+async def start_metrics_server(host='0.0.0.0', port=9100):
+    """Отдельный HTTP-сервер с /metrics (когда веб-панель отключена или в кластере)"""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,551 @@
+"""
+Движок воспроизведения сервера: непрерывный поток без пауз между треками
+
+Один долгоживущий источник звука на сервер вместо нового voice_client.play() на каждый трек:
+- следующий трек запускается заранее (FFmpeg уже декодирует его в буфер), пока играет текущий;
+- переключение происходит на границе кадра, без перехода через event loop и без паузы;
+- при PLAYER_CROSSFADE > 0 конец трека плавно смешивается с началом следующего (только PCM);
+- каждый трек читается в буфер отдельным потоком, поэтому задержки сети не останавливают
+  поток отправки звука: вместо этого отправляется тишина и считается "недогрузка" (underrun);
+- если поток трека оборвался раньше конца (FFmpeg упал, истекла подписанная ссылка), трек
+  перезапускается с позиции обрыва с новой ссылкой - ограниченное число попыток подряд.
+  Код выхода FFmpeg не решает дело: с -reconnect он завершается с кодом 0, даже если
+  источник ответил ошибкой посреди трека. Поэтому при известной длительности обрыв
+  определяется по оставшемуся времени, а перезапуск, не давший ни одного кадра, считается
+  концом трека (длительность из метаданных оказалась больше настоящей).
+"""
+import asyncio
+import queue
+import subprocess
+import threading
+import time
+from array import array
+
+import discord
+from discord.opus import OPUS_SILENCE, Encoder
+
+FRAME_SECONDS = Encoder.FRAME_LENGTH / 1000
+# Признак конца трека в буфере
+_EOF = b''
+# Трек, оборвавшийся дальше чем за столько секунд до конца, перезапускается с позиции обрыва
+RESUME_MIN_REMAINING = 5.0
+# Если трек после перезапуска отыграл столько секунд, счётчик попыток начинается заново
+RESUME_STABLE_SECONDS = 60.0
+# Пауза перед повторной попыткой перезапуска: 1, 2, 4... секунд, но не больше RESUME_MAX_BACKOFF
+RESUME_BACKOFF = 1.0
+RESUME_MAX_BACKOFF = 10.0
+# Сколько ждать завершения FFmpeg после конца его вывода, чтобы узнать код выхода
+FFMPEG_EXIT_TIMEOUT = 2.0
+
+
+def mix_frames(outgoing, incoming, fade_in):
+    """Смешивает два PCM-кадра (16 бит, знаковые) с долей fade_in второго.
+
+    Без audioop (удалён в Python 3.13). Сумма весов равна 1, поэтому результат
+    всегда в пределах 16 бит и не требует ограничения.
+    """
+    fade_out = 1.0 - fade_in
+    mixed = array('h', [
+        int(a * fade_out + b * fade_in) for a, b in zip(array('h', outgoing), array('h', incoming))
+    ])
+    return mixed.tobytes()
+
+
+def _exit_code(source):
+    """Код выхода FFmpeg источника после конца вывода; None - неизвестен (не FFmpeg или ещё работает)"""
+    process = getattr(getattr(source, 'original', source), '_process', None)
+    if not hasattr(process, 'wait'):
+        return None
+    try:
+        return process.wait(timeout=FFMPEG_EXIT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+class BufferedTrack:
+    """Источник трека, который читается в буфер фоновым потоком"""
+
+    def __init__(self, track, source, *, buffer_frames=100):
+        self.track = track
+        self.source = source
+        self.start_at = getattr(source, 'start_at', 0.0)
+        self.frames = 0  # Сколько кадров отдано в Discord
+        self.resumes = 0  # Перезапусков подряд после обрыва потока
+        self.error = None
+        self.exit_code = None  # Код выхода FFmpeg после конца потока (None - неизвестен)
+        self.finished = False
+
+        self._opus = source.is_opus()
+        self._buffer = queue.Queue(maxsize=buffer_frames)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._fill, name='track-buffer', daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            while not self._closed.is_set():
+                data = self.source.read()
+                if not data:
+                    self.exit_code = _exit_code(self.source)
+                    break
+                while not self._closed.is_set():
+                    try:
+                        self._buffer.put(data, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put_eof()
+
+    def _put_eof(self):
+        while not self._closed.is_set():
+            try:
+                self._buffer.put(_EOF, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def read_frame(self):
+        """Следующий кадр; None - буфер пуст (недогрузка), b'' - трек закончился"""
+        if self.finished:
+            return _EOF
+        try:
+            data = self._buffer.get_nowait()
+        except queue.Empty:
+            return None
+        if not data:
+            self.finished = True
+            return _EOF
+        self.frames += 1
+        return data
+
+    def is_opus(self):
+        return self._opus
+
+    @property
+    def buffered(self):
+        return self._buffer.qsize()
+
+    @property
+    def position(self):
+        """Позиция воспроизведения в секундах (по отданным кадрам, а не по прочитанным в буфер)"""
+        return self.start_at + self.frames * FRAME_SECONDS
+
+    @property
+    def remaining(self):
+        """Сколько секунд осталось до конца трека (None, если длительность неизвестна)"""
+        if not self.track.duration:
+            return None
+        return self.track.duration - self.position
+
+    def close(self):
+        self._closed.set()
+        self.finished = True
+        try:
+            self.source.cleanup()
+        finally:
+            # Освобождаем место в буфере, чтобы поток чтения не ждал
+            while True:
+                try:
+                    self._buffer.get_nowait()
+                except queue.Empty:
+                    break
+
+
+class GuildPlayer(discord.AudioSource):
+    """Непрерывный источник звука сервера, который сам переключает треки очереди.
+
+    prepare(track) - корутина, которая возвращает AudioSource трека (или None, если подготовка
+    отменена); resume(track, position) - такая же корутина для перезапуска оборвавшегося
+    трека с позиции position (без неё обрыв считается концом трека); callbacks вызываются в event loop:
+    on_track_start(track, source, gap), on_track_error(track, error), где gap - пауза перед
+    треком в секундах (None для первого трека).
+    """
+
+    def __init__(self, guild_id, track_queue, *, loop, prepare, on_track_start=None, on_track_error=None,
+                 opus=False, crossfade=0.0, preload_seconds=15.0, buffer_frames=100, resume=None, max_resumes=3):
+        self.guild_id = guild_id
+        self.queue = track_queue
+        self.loop = loop
+        self.prepare = prepare
+        self.on_track_start = on_track_start
+        self.on_track_error = on_track_error
+        self.crossfade = crossfade
+        self.preload_seconds = preload_seconds
+        self.buffer_frames = buffer_frames
+        self.resume = resume
+        self.max_resumes = max_resumes
+
+        self.current = None  # BufferedTrack, который играет сейчас
+        self.incoming = None  # Следующий трек во время плавного перехода
+        self.upcoming = None  # Заранее запущенный следующий трек
+        self._lock = threading.RLock()
+        self._opus = opus  # Тип последнего отданного кадра (AudioPlayer проверяет его после read)
+        self._preload_task = None
+        self._preloading = False
+        self._resuming = None  # Оборвавшийся трек, который сейчас перезапускается
+        self._resume_task = None
+        self._idle_since = None  # Когда закончился предыдущий трек, а следующий ещё не готов
+        self._starving = False  # Сейчас идёт недогрузка буфера
+        self._closed = False
+
+        self.tracks_played = 0
+        self.underruns = 0
+        self.underrun_frames = 0
+        self.gapless_switches = 0
+        self.crossfades = 0
+        self.track_errors = 0
+        self.resumes = 0
+        self.resume_failures = 0
+
+    # ---------- Поток отправки звука ----------
+
+    def read(self):
+        with self._lock:
+            while True:
+                if self.current is None:
+                    if self._resuming is not None:
+                        # Трек перезапускается с позиции обрыва - следующий трек не начинаем
+                        self._opus = True
+                        return OPUS_SILENCE
+                    if not self._advance():
+                        return self._idle_frame()
+                if self.incoming is not None and self.current.remaining <= 0:
+                    # Переход закончился раньше, чем поток текущего трека (неточная длительность)
+                    self._end_current()
+                    continue
+                self._check_upcoming()
+                frame = self.current.read_frame()
+                if frame == _EOF:
+                    self._end_current()
+                    continue
+                break
+
+            if frame is None:
+                # Поток трека не успевает: отправляем тишину, но не останавливаем плеер
+                if not self._starving:
+                    self._starving = True
+                    self.underruns += 1
+                self.underrun_frames += 1
+                self._opus = True
+                return OPUS_SILENCE
+            self._starving = False
+
+            if self.crossfade and not self.current.is_opus():
+                frame = self._crossfade_frame(frame)
+            self._opus = self.current.is_opus()
+            return frame
+
+    def is_opus(self):
+        return self._opus
+
+    def _advance(self):
+        """Делает следующий трек текущим; False, если он ещё не готов"""
+        if self.incoming is not None:
+            self.current, self.incoming = self.incoming, None
+            return True
+        upcoming = self.upcoming
+        if upcoming is None:
+            self._request_preload()
+            return False
+        self.upcoming = None
+        if not self.queue.pop_if_first(upcoming.track):
+            # Очередь изменилась, пока трек готовился (skip, move, shuffle...)
+            upcoming.close()
+            self._request_preload()
+            return False
+        self._start(upcoming)
+        return True
+
+    def _start(self, buffered):
+        # Пауза перед треком; для первого трека сеанса - None
+        gap = 0.0 if self.tracks_played else None
+        if self._idle_since is not None:
+            if self.tracks_played:
+                gap = time.monotonic() - self._idle_since
+            self._idle_since = None
+        elif self.tracks_played:
+            self.gapless_switches += 1
+        self.current = buffered
+        self.tracks_played += 1
+        if self.on_track_start:
+            self.loop.call_soon_threadsafe(self.on_track_start, buffered.track, buffered.source, gap)
+
+    def _end_current(self):
+        finished = self.current
+        self.current = None
+        finished.close()
+        error = finished.error
+        if self.resume is not None and self.incoming is None and self._cut_short(finished):
+            # Счётчик попыток сбрасывается, если после прошлого перезапуска трек долго играл нормально
+            stable = finished.frames * FRAME_SECONDS >= RESUME_STABLE_SECONDS
+            attempt = 1 if stable else finished.resumes + 1
+            if attempt <= self.max_resumes:
+                self._resuming = finished
+                print(f'🔁 Поток трека {finished.track} оборвался на {finished.position:.0f} с, '
+                      f'перезапуск с этой позиции (попытка {attempt}/{self.max_resumes})')
+                self.loop.call_soon_threadsafe(self._spawn_resume, finished, attempt)
+                return
+            self.resume_failures += 1
+            if error is None:
+                error = ConnectionError(f'поток оборвался на {finished.position:.0f} с')
+        if error is not None:
+            self._report_error(finished.track, error)
+        if self.incoming is None and self.upcoming is None:
+            self._idle_since = time.monotonic()
+
+    @staticmethod
+    def _cut_short(buffered):
+        """Поток трека оборвался раньше конца трека"""
+        if buffered.resumes and not buffered.frames and buffered.error is None and buffered.exit_code == 0:
+            # Перезапуск с позиции обрыва сразу закончился штатно - трек на самом деле короче метаданных
+            return False
+        remaining = buffered.remaining
+        if remaining is None:
+            return buffered.error is not None or buffered.exit_code not in (None, 0)
+        return remaining > RESUME_MIN_REMAINING
+
+    def _idle_frame(self):
+        """Кадр, пока следующий трек готовится; b'' останавливает плеер, если очередь пуста"""
+        if self._closed or (not self._preloading and not self.queue):
+            return _EOF
+        if self._idle_since is None:
+            self._idle_since = time.monotonic()
+        self._opus = True
+        return OPUS_SILENCE
+
+    def _check_upcoming(self):
+        """Запускает подготовку следующего трека заранее и выбрасывает устаревшую"""
+        head = self.queue.peek(1)
+        if self.upcoming is not None:
+            if not head or head[0] is not self.upcoming.track:
+                self.upcoming.close()
+                self.upcoming = None
+            return
+        if not head or self.incoming is not None:
+            return
+        remaining = self.current.remaining
+        if remaining is None or remaining <= self.preload_seconds:
+            self._request_preload()
+
+    def _crossfade_frame(self, frame):
+        """Смешивает конец текущего трека с началом следующего"""
+        remaining = self.current.remaining
+        if remaining is None or remaining > self.crossfade:
+            return frame
+        if self.incoming is None:
+            upcoming = self.upcoming
+            if upcoming is None or upcoming.is_opus() or not self.queue.pop_if_first(upcoming.track):
+                return frame
+            self.upcoming = None
+            self.incoming = upcoming
+            self.crossfades += 1
+            self._start_incoming()
+        incoming = self.incoming.read_frame()
+        if not incoming:
+            return frame
+        if len(incoming) != len(frame):
+            return frame
+        fade_in = min(1.0, max(0.0, 1.0 - remaining / self.crossfade))
+        return mix_frames(frame, incoming, fade_in)
+
+    def _start_incoming(self):
+        """Сообщает о начале следующего трека в момент начала перехода"""
+        self.tracks_played += 1
+        self.gapless_switches += 1
+        if self.on_track_start:
+            self.loop.call_soon_threadsafe(self.on_track_start, self.incoming.track, self.incoming.source, 0.0)
+
+    def _report_error(self, track, error):
+        self.track_errors += 1
+        print(f'⚠️ Ошибка воспроизведения трека {track}: {error}')
+        if self.on_track_error:
+            self.loop.call_soon_threadsafe(self.on_track_error, track, error)
+
+    # ---------- Event loop ----------
+
+    def _request_preload(self):
+        if self._preloading or self._closed or not self.queue:
+            return
+        self._preloading = True
+        self.loop.call_soon_threadsafe(self._spawn_preload)
+
+    def _spawn_preload(self):
+        if self._closed:
+            self._preloading = False
+            return
+        self._preload_task = self.loop.create_task(self._preload())
+
+    async def _preload(self):
+        """Готовит первый трек очереди: находит его и запускает FFmpeg с чтением в буфер"""
+        try:
+            while not self._closed:
+                head = self.queue.peek(1)
+                if not head:
+                    return
+                track = head[0]
+                try:
+                    source = await self.prepare(track)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Трек не удалось подготовить - убираем его и берём следующий
+                    self.queue.pop_if_first(track)
+                    self.track_errors += 1
+                    print(f'⚠️ Не удалось подготовить трек {track}: {e}')
+                    if self.on_track_error:
+                        self.on_track_error(track, e)
+                    continue
+                if source is None:
+                    return
+                buffered = BufferedTrack(track, source, buffer_frames=self.buffer_frames)
+                with self._lock:
+                    if self._closed:
+                        buffered.close()
+                        return
+                    if self.upcoming is not None:
+                        self.upcoming.close()
+                    self.upcoming = buffered
+                return
+        finally:
+            self._preloading = False
+
+    def _spawn_resume(self, failed, attempt):
+        if self._resuming is failed and not self._closed:
+            self._resume_task = self.loop.create_task(self._resume(failed, attempt))
+
+    async def _resume(self, failed, attempt):
+        """Перезапускает оборвавшийся трек с позиции обрыва; повторяет попытки с паузой"""
+        position = failed.position
+        source = error = None
+        while True:
+            if attempt > 1:
+                await asyncio.sleep(min(RESUME_BACKOFF * 2 ** (attempt - 2), RESUME_MAX_BACKOFF))
+            try:
+                source = await self.resume(failed.track, position)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                print(f'⚠️ Не удалось перезапустить трек {failed.track} '
+                      f'(попытка {attempt}/{self.max_resumes}): {e}')
+                if attempt >= self.max_resumes:
+                    break
+                attempt += 1
+
+        buffered = None
+        if source is not None:
+            buffered = BufferedTrack(failed.track, source, buffer_frames=self.buffer_frames)
+            buffered.resumes = attempt
+        with self._lock:
+            if self._resuming is not failed or self._closed:
+                # Пока трек перезапускался, его пропустили или плеер остановили
+                if buffered is not None:
+                    buffered.close()
+                return
+            self._resuming = None
+            self._resume_task = None
+            if buffered is not None:
+                self.current = buffered
+                self.resumes += 1
+                return
+            # Попытки кончились (или перезапуск отменён) - переходим к следующему треку
+            if error is not None:
+                self.resume_failures += 1
+                self._report_error(failed.track, error)
+            if self.incoming is None and self.upcoming is None:
+                self._idle_since = time.monotonic()
+
+    def _cancel_resume(self):
+        # Вызывается под self._lock из любого потока
+        self._resuming = None
+        task, self._resume_task = self._resume_task, None
+        if task is not None:
+            self.loop.call_soon_threadsafe(task.cancel)
+
+    def skip(self):
+        """Переходит к следующему треку без остановки плеера"""
+        with self._lock:
+            if self.current is not None:
+                self.current.close()
+                self.current = None
+            self._cancel_resume()
+            if self.incoming is None and self.upcoming is None:
+                self._idle_since = time.monotonic()
+
+    def set_volume(self, volume):
+        """Меняет громкость текущего и подготовленных треков.
+
+        PCM-источникам громкость меняется сразу; источники, у которых громкость применяет
+        FFmpeg (метод restarted), перезапускаются с текущей позиции.
+        """
+        with self._lock:
+            tracks = [t for t in (self.current, self.incoming, self.upcoming) if t is not None]
+        for buffered in tracks:
+            source = buffered.source
+            if isinstance(source, discord.PCMVolumeTransformer):
+                source.volume = volume
+            elif hasattr(source, 'restarted'):
+                replacement = BufferedTrack(
+                    buffered.track,
+                    source.restarted(volume=volume, start_at=buffered.position),
+                    buffer_frames=self.buffer_frames
+                )
+                with self._lock:
+                    for slot in ('current', 'incoming', 'upcoming'):
+                        if getattr(self, slot) is buffered:
+                            setattr(self, slot, replacement)
+                            buffered.close()
+                            break
+                    else:
+                        replacement.close()
+
+    @property
+    def title(self):
+        current = self.current or self._resuming
+        return current.track.title if current else None
+
+    @property
+    def volume(self):
+        current = self.current or self._resuming
+        return getattr(current.source, 'volume', None) if current else None
+
+    @property
+    def position(self):
+        current = self.current or self._resuming
+        return current.position if current else None
+
+    def stats(self):
+        """Счётчики плеера сервера для веб-панели"""
+        current = self.current
+        return {
+            'title': self.title,
+            'position': round(current.position, 1) if current else None,
+            'buffered_frames': current.buffered if current else 0,
+            'upcoming_ready': self.upcoming is not None,
+            'tracks_played': self.tracks_played,
+            'gapless_switches': self.gapless_switches,
+            'crossfades': self.crossfades,
+            'underruns': self.underruns,
+            'underrun_ms': round(self.underrun_frames * FRAME_SECONDS * 1000),
+            'track_errors': self.track_errors,
+            'resuming': self._resuming is not None,
+            'resumes': self.resumes,
+            'resume_failures': self.resume_failures,
+        }
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            for buffered in (self.current, self.incoming, self.upcoming):
+                if buffered is not None:
+                    buffered.close()
+            self.current = self.incoming = self.upcoming = None
+            self._cancel_resume()
+        task = self._preload_task
+        if task is not None:
+            self.loop.call_soon_threadsafe(task.cancel)
+
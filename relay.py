@@ -0,0 +1,341 @@
+"""
+Повтор сообщений из исходных текстовых каналов в целевые
+
+Маршруты "исходный канал -> целевые каналы" (с фильтрами) хранятся в словаре по ID
+исходного канала, поэтому сообщение в любом другом канале отсекается одной проверкой.
+Обработчик on_message только ставит сообщение в очередь целевого канала и сразу
+переходит к командам; отправкой занимается отдельная задача на каждый целевой канал.
+Сообщения отправляются через вебхук канала - с именем и аватаром автора, без лишних
+запросов. Если Discord ограничил частоту отправки, накопившиеся сообщения одного автора
+склеиваются в одно. Переполненная очередь отбрасывает новые сообщения (и считает их).
+
+Фильтр regex проверяется в on_message прямо в event loop, поэтому выражения
+ограничены по длине, а вложенные неограниченные повторы (вроде (a+)+) и обратные
+ссылки, из-за которых поиск может идти экспоненциально долго, не принимаются.
+"""
+import asyncio
+import re
+import time
+from collections import deque
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+import discord
+
+WEBHOOK_NAME = 'Повтор сообщений'
+MAX_CONTENT_LENGTH = 2000
+# Через сколько секунд снова пробовать получить вебхук, если у бота нет прав на вебхуки
+WEBHOOK_RETRY_INTERVAL = 600
+# Вебхук может упоминать @everyone без прав бота - такие упоминания не пересылаются
+ALLOWED_MENTIONS = discord.AllowedMentions(everyone=False, roles=False)
+
+# Фильтры маршрутов
+FILTER_ALL = 'all'
+FILTER_ATTACHMENTS = 'attachments'
+FILTER_PREFIX = 'prefix'
+FILTER_REGEX = 'regex'
+# Максимальная длина регулярного выражения фильтра
+MAX_REGEX_LENGTH = 100
+# Повтор с верхней границей больше этой считается неограниченным
+MAX_BOUNDED_REPEAT = 100
+
+
+def _regex_risk(items, in_repeat=False):
+    """Причина, по которой выражение может выполняться экспоненциально долго, или None"""
+    for op, av in items:
+        name = str(op)
+        if name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+            low, high, sub = av
+            unbounded = high == sre_parse.MAXREPEAT or high > MAX_BOUNDED_REPEAT
+            if unbounded and in_repeat:
+                return 'вложенные повторы'
+            risk = _regex_risk(sub, in_repeat or unbounded)
+        elif name == 'SUBPATTERN':
+            risk = _regex_risk(av[-1], in_repeat)
+        elif name == 'BRANCH':
+            risk = next(filter(None, (_regex_risk(branch, in_repeat) for branch in av[1])), None)
+        elif name in ('ASSERT', 'ASSERT_NOT', 'ATOMIC_GROUP'):
+            risk = _regex_risk(av[-1], in_repeat)
+        elif name in ('GROUPREF', 'GROUPREF_EXISTS', 'GROUPREF_IGNORE'):
+            return 'обратные ссылки'
+        else:
+            risk = None
+        if risk:
+            return risk
+    return None
+
+
+def check_regex(pattern):
+    """Проверяет выражение фильтра; ValueError - неверное или слишком сложное"""
+    if len(pattern) > MAX_REGEX_LENGTH:
+        raise ValueError(f'Регулярное выражение длиннее {MAX_REGEX_LENGTH} символов')
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        raise ValueError(f'Неверное регулярное выражение: {e}')
+    risk = _regex_risk(parsed)
+    if risk:
+        raise ValueError(f'Слишком сложное регулярное выражение ({risk})')
+
+
+def parse_filter(text):
+    """Фильтр из аргумента команды: attachments, prefix:<текст>, regex:<выражение> -> (фильтр, шаблон)"""
+    if not text or text == FILTER_ALL:
+        return FILTER_ALL, None
+    if text == FILTER_ATTACHMENTS:
+        return FILTER_ATTACHMENTS, None
+    kind, _, pattern = text.partition(':')
+    if kind in (FILTER_PREFIX, FILTER_REGEX) and pattern:
+        if kind == FILTER_REGEX:
+            check_regex(pattern)
+        return kind, pattern
+    raise ValueError(f'Неизвестный фильтр: {text}')
+
+
+class RelayRoute:
+    __slots__ = ('source_id', 'target_id', 'guild_id', 'filter', 'pattern', '_regex')
+
+    def __init__(self, source_id, target_id, guild_id=None, filter=FILTER_ALL, pattern=None):
+        self.source_id = source_id
+        self.target_id = target_id
+        self.guild_id = guild_id
+        self.filter = filter
+        self.pattern = pattern
+        self._regex = re.compile(pattern) if filter == FILTER_REGEX else None
+
+    @property
+    def echo(self):
+        """Повтор в том же канале"""
+        return self.source_id == self.target_id
+
+    def matches(self, message):
+        if self.filter == FILTER_ATTACHMENTS:
+            return bool(message.attachments)
+        if self.filter == FILTER_PREFIX:
+            return message.content.startswith(self.pattern)
+        if self.filter == FILTER_REGEX:
+            return self._regex.search(message.content) is not None
+        return True
+
+    def describe(self):
+        if self.filter == FILTER_ATTACHMENTS:
+            return 'только с вложениями'
+        if self.filter == FILTER_PREFIX:
+            return f'начинается с `{self.pattern}`'
+        if self.filter == FILTER_REGEX:
+            return f'regex `{self.pattern}`'
+        return 'все сообщения'
+
+
+class RelayTable:
+    """Маршруты повтора: ID исходного канала -> список маршрутов"""
+
+    def __init__(self):
+        self._routes = {}
+
+    def get(self, source_id):
+        return self._routes.get(source_id)
+
+    def add(self, route):
+        """Добавляет маршрут (заменяет маршрут между теми же каналами)"""
+        routes = [r for r in self._routes.get(route.source_id, ()) if r.target_id != route.target_id]
+        routes.append(route)
+        self._routes[route.source_id] = routes
+
+    def remove(self, source_id, target_id=None):
+        """Удаляет маршруты из канала (все или в один целевой канал) и возвращает удалённые"""
+        routes = self._routes.pop(source_id, [])
+        removed = [r for r in routes if target_id is None or r.target_id == target_id]
+        kept = [r for r in routes if r not in removed]
+        if kept:
+            self._routes[source_id] = kept
+        return removed
+
+    def has_target(self, channel_id):
+        """Есть ли маршрут, который повторяет сообщения в канал channel_id"""
+        return any(route.target_id == channel_id for routes in self._routes.values() for route in routes)
+
+    def for_guild(self, guild):
+        """Маршруты из каналов сервера"""
+        return [
+            route for source_id, routes in list(self._routes.items()) if guild.get_channel(source_id)
+            for route in routes
+        ]
+
+    def __len__(self):
+        return sum(len(routes) for routes in self._routes.values())
+
+
+class RelayItem:
+    __slots__ = ('author_id', 'username', 'avatar_url', 'content', 'echo')
+
+    def __init__(self, message, echo):
+        self.author_id = message.author.id
+        self.username = message.author.display_name
+        self.avatar_url = message.author.display_avatar.url
+        if echo:
+            self.content = message.content
+        else:
+            # Текст со ссылками на вложения собирается один раз, при постановке в очередь
+            self.content = '\n'.join(
+                [message.content] * bool(message.content) + [attachment.url for attachment in message.attachments]
+            )
+        self.echo = echo  # Повтор в том же канале - от имени бота, без вебхука
+
+    def plain(self):
+        """Текст для отправки от имени бота"""
+        if self.echo:
+            return f'🔄 {self.content}'
+        return f'**{self.username}**: {self.content}'
+
+
+class MessageRelay:
+    def __init__(self, *, queue_size=100, on_sent=None, on_dropped=None):
+        self.queue_size = queue_size
+        self.on_sent = on_sent  # (способ отправки, сообщений, секунд) -> None
+        self.on_dropped = on_dropped  # (причина, сообщений) -> None
+        self._queues = {}  # channel_id -> deque[RelayItem]
+        self._channels = {}  # channel_id -> целевой канал
+        self._workers = {}  # channel_id -> задача отправки
+        self._webhooks = {}  # channel_id -> Webhook или время неудачной попытки получить его
+
+        self.submitted = 0
+        self.sent_messages = 0
+        self.sent_batches = 0
+        self.dropped = 0
+
+    def submit(self, channel, message, *, echo=False):
+        """Ставит сообщение в очередь канала channel (не ждёт отправки)"""
+        item = RelayItem(message, echo)
+        if not item.content:
+            return False
+        queue = self._queues.setdefault(channel.id, deque())
+        if len(queue) >= self.queue_size:
+            self._drop('queue_full', 1)
+            return False
+        queue.append(item)
+        self._channels[channel.id] = channel
+        self.submitted += 1
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = asyncio.get_running_loop().create_task(self._run(channel.id))
+        return True
+
+    async def _run(self, channel_id):
+        queue = self._queues[channel_id]
+        while queue:
+            batch = self._take_batch(queue)
+            try:
+                await self._send(self._channels[channel_id], batch)
+            except asyncio.CancelledError:
+                # forget(): маршрутов в канал больше нет
+                self._drop('route_removed', len(batch))
+                raise
+            except Exception as e:
+                print(f'❌ Ошибка повтора сообщения: {e}')
+                self._drop('error', len(batch))
+        # Очередь опустела: состояние канала создаётся заново со следующим сообщением
+        # (вебхук остаётся в кэше, пока в канал ведёт хотя бы один маршрут)
+        self._queues.pop(channel_id, None)
+        self._channels.pop(channel_id, None)
+        self._workers.pop(channel_id, None)
+
+    def forget(self, channel_id):
+        """Удаляет всё состояние канала, в который больше не ведёт ни один маршрут"""
+        worker = self._workers.pop(channel_id, None)
+        if worker is not None:
+            worker.cancel()
+        queue = self._queues.pop(channel_id, None)
+        if queue:
+            self._drop('route_removed', len(queue))
+        self._channels.pop(channel_id, None)
+        self._webhooks.pop(channel_id, None)
+
+    def _take_batch(self, queue):
+        """Первое сообщение очереди и следующие за ним сообщения того же автора, пока влезают в лимит"""
+        batch = [queue.popleft()]
+        length = len(batch[0].plain())
+        while queue:
+            item = queue[0]
+            if item.author_id != batch[0].author_id or item.echo != batch[0].echo:
+                break
+            # Длина с форматированием от имени бота - не меньше длины для вебхука
+            length += 1 + len(item.plain())
+            if length > MAX_CONTENT_LENGTH:
+                break
+            batch.append(queue.popleft())
+        return batch
+
+    async def _send(self, channel, batch):
+        start = time.perf_counter()
+        first = batch[0]
+        if not first.echo:
+            # Вебхук могли удалить вручную - тогда создаём новый и пробуем ещё раз
+            for _ in range(2):
+                webhook = await self._get_webhook(channel)
+                if webhook is None:
+                    break
+                try:
+                    await webhook.send(
+                        '\n'.join(item.content for item in batch),
+                        username=first.username,
+                        avatar_url=first.avatar_url,
+                        allowed_mentions=ALLOWED_MENTIONS
+                    )
+                except discord.NotFound:
+                    self._webhooks.pop(channel.id, None)
+                    continue
+                self._sent('webhook', batch, start)
+                return
+        await channel.send('\n'.join(item.plain() for item in batch), allowed_mentions=ALLOWED_MENTIONS)
+        self._sent('bot', batch, start)
+
+    async def _get_webhook(self, channel):
+        cached = self._webhooks.get(channel.id)
+        if isinstance(cached, discord.Webhook):
+            return cached
+        if cached is not None and time.monotonic() - cached < WEBHOOK_RETRY_INTERVAL:
+            return None
+        if not hasattr(channel, 'create_webhook'):
+            # Ветки и личные сообщения не поддерживают вебхуки
+            return None
+        try:
+            webhook = discord.utils.find(
+                lambda w: w.name == WEBHOOK_NAME and w.token, await channel.webhooks()
+            )
+            if webhook is None:
+                webhook = await channel.create_webhook(name=WEBHOOK_NAME)
+        except discord.HTTPException as e:
+            print(f'⚠️ Не удалось получить вебхук канала {channel.name} ({e}), сообщения отправляются от имени бота')
+            self._webhooks[channel.id] = time.monotonic()
+            return None
+        self._webhooks[channel.id] = webhook
+        return webhook
+
+    def _sent(self, method, batch, start):
+        self.sent_messages += len(batch)
+        self.sent_batches += 1
+        if self.on_sent:
+            self.on_sent(method, len(batch), time.perf_counter() - start)
+
+    def _drop(self, reason, count):
+        self.dropped += count
+        if self.on_dropped:
+            self.on_dropped(reason, count)
+
+    def queue_depths(self):
+        """channel_id -> сообщений в очереди"""
+        return {str(channel_id): len(queue) for channel_id, queue in list(self._queues.items())}
+
+    def stats(self):
+        """Счётчики для веб-панели"""
+        return {
+            'queued': sum(len(queue) for queue in list(self._queues.values())),
+            'submitted': self.submitted,
+            'sent_messages': self.sent_messages,
+            'sent_batches': self.sent_batches,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,154 @@
+"""
+Постоянный кэш результатов поиска треков (SQLite)
+
+Хранит соответствие "поисковый запрос / Spotify ID -> видео на YouTube",
+чтобы популярные треки не искались заново при каждом запросе.
+Записи устаревают через заданное время и вытесняются по давности использования (LRU).
+Время использования при попадании копится в памяти и пишется в базу пачкой,
+а не отдельной транзакцией на каждый поиск.
+"""
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+
+# Накопленное время использования записей пишется в базу не реже этого (секунд) или при таком числе записей
+LAST_USED_FLUSH_INTERVAL = 60.0
+LAST_USED_FLUSH_BATCH = 500
+
+
+def normalize_query(query):
+    """Приводит поисковый запрос к единому виду для ключа кэша"""
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def query_key(query):
+    return f'query:{normalize_query(query)}'
+
+
+def spotify_key(track_id):
+    return f'spotify:{track_id}'
+
+
+class SearchCache:
+    """Кэш "ключ -> видео на YouTube" с TTL и вытеснением по давности использования"""
+
+    def __init__(self, path, *, ttl=7 * 24 * 60 * 60, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Кэш общий для процессов кластера - ждём блокировку, а не падаем
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS search_cache ('
+            ' key TEXT PRIMARY KEY,'
+            ' video_id TEXT,'
+            ' webpage_url TEXT NOT NULL,'
+            ' title TEXT,'
+            ' duration REAL,'
+            ' created_at REAL NOT NULL,'
+            ' last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS search_cache_last_used ON search_cache(last_used)')
+        self._conn.commit()
+        self._touched = {}  # key -> время последнего попадания, ещё не записанное в базу
+        self._touched_flushed = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT video_id, webpage_url, title, duration, created_at FROM search_cache WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            video_id, webpage_url, title, duration, created_at = row
+            if now - created_at > self.ttl:
+                self._touched.pop(key, None)
+                self._conn.execute('DELETE FROM search_cache WHERE key = ?', (key,))
+                self._conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if (len(self._touched) >= LAST_USED_FLUSH_BATCH
+                    or time.monotonic() - self._touched_flushed >= LAST_USED_FLUSH_INTERVAL):
+                self._flush_touched()
+                self._conn.commit()
+            self.hits += 1
+        return {'id': video_id, 'webpage_url': webpage_url, 'title': title, 'duration': duration}
+
+    def _put(self, keys, data):
+        now = time.time()
+        rows = [
+            (key, data.get('id'), data['webpage_url'], data.get('title'), data.get('duration'), now, now)
+            for key in keys
+        ]
+        with self._lock:
+            # Вытеснение смотрит на last_used - сначала записываем накопленные попадания
+            self._flush_touched()
+            self._conn.executemany('INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            count = self._conn.execute('SELECT COUNT(*) FROM search_cache').fetchone()[0]
+            if count > self.max_entries:
+                # Вытесняем давно не использовавшиеся записи
+                excess = count - self.max_entries
+                self._conn.execute(
+                    'DELETE FROM search_cache WHERE key IN '
+                    '(SELECT key FROM search_cache ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+                self.evicted += excess
+            self._conn.commit()
+
+    def _flush_touched(self):
+        """Пишет накопленное время использования (под self._lock, commit - за вызывающим)"""
+        self._touched_flushed = time.monotonic()
+        if not self._touched:
+            return
+        self._conn.executemany(
+            'UPDATE search_cache SET last_used = ? WHERE key = ?',
+            [(used, key) for key, used in self._touched.items()]
+        )
+        self._touched = {}
+
+    def _flush(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    async def get(self, key):
+        """Возвращает закэшированное видео или None (запрос выполняется вне event loop)"""
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, keys, data):
+        """Сохраняет найденное видео под одним или несколькими ключами"""
+        if not data.get('webpage_url'):
+            return
+        await asyncio.to_thread(self._put, keys, data)
+
+    async def flush(self):
+        """Записывает накопленное время использования записей (при завершении работы)"""
+        await asyncio.to_thread(self._flush)
+
+    def stats(self):
+        """Счётчики попаданий и промахов для веб-панели"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else None,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,154 @@
+"""
+Асинхронный клиент Spotify Web API на aiohttp
+
+Не блокирует event loop бота: переиспользует соединения, кэширует токен
+(client credentials) до истечения срока и ограничивает число одновременных запросов.
+"""
+import asyncio
+import time
+
+import aiohttp
+
+
+class SpotifyError(Exception):
+    """Ошибка обращения к Spotify API"""
+
+
+class SpotifyClient:
+    TOKEN_URL = 'https://accounts.spotify.com/api/token'
+    API_URL = 'https://api.spotify.com/v1'
+
+    # Токен обновляется заранее, за столько секунд до истечения
+    TOKEN_REFRESH_MARGIN = 60
+    # Максимальная пауза, которую клиент готов ждать по заголовку Retry-After
+    MAX_RETRY_AFTER = 10
+
+    def __init__(self, client_id, client_secret, *, max_concurrency=4, connection_limit=10, timeout=10,
+                 on_request=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.max_concurrency = max_concurrency
+        self.connection_limit = connection_limit
+        self.timeout = timeout
+        # Необязательный обработчик (endpoint, секунды, HTTP-статус или 'error') - для метрик
+        self.on_request = on_request
+
+        self._session = None
+        self._token = None
+        self._token_expires_at = 0
+        # Примитивы asyncio создаются при первом запросе, уже внутри event loop
+        self._token_lock = None
+        self._semaphore = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._token_lock = asyncio.Lock()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _get_token(self):
+        """Возвращает действующий токен, при необходимости запрашивая новый"""
+        if self._token and time.time() < self._token_expires_at:
+            return self._token
+        async with self._token_lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            if self._token and time.time() < self._token_expires_at:
+                return self._token
+            start = time.perf_counter()
+            try:
+                async with self._get_session().post(
+                    self.TOKEN_URL,
+                    data={'grant_type': 'client_credentials'},
+                    auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+                ) as response:
+                    self._observe('token', start, response.status)
+                    if response.status != 200:
+                        raise SpotifyError(f'Не удалось получить токен Spotify: HTTP {response.status}')
+                    payload = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self._observe('token', start, 'error')
+                raise
+            self._token = payload['access_token']
+            self._token_expires_at = time.time() + payload.get('expires_in', 3600) - self.TOKEN_REFRESH_MARGIN
+            return self._token
+
+    def _observe(self, endpoint, start, status):
+        if self.on_request:
+            self.on_request(endpoint, time.perf_counter() - start, status)
+
+    async def _request(self, path, params=None):
+        session = self._get_session()
+        # Первый сегмент пути (tracks, search, albums, playlists) - без ID, чтобы не плодить метки
+        endpoint = path.split('/')[1]
+        async with self._semaphore:
+            for attempt in range(3):
+                token = await self._get_token()
+                start = time.perf_counter()
+                try:
+                    response = await session.get(
+                        f'{self.API_URL}{path}',
+                        params=params,
+                        headers={'Authorization': f'Bearer {token}'},
+                    )
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    self._observe(endpoint, start, 'error')
+                    raise
+                async with response:
+                    if response.status == 200:
+                        payload = await response.json()
+                        self._observe(endpoint, start, response.status)
+                        return payload
+                    self._observe(endpoint, start, response.status)
+                    if response.status == 401:
+                        # Токен отозван раньше срока - запросим новый
+                        self._token = None
+                        continue
+                    if response.status == 429:
+                        retry_after = int(response.headers.get('Retry-After', 1))
+                        if retry_after > self.MAX_RETRY_AFTER:
+                            raise SpotifyError(f'Превышен лимит запросов Spotify, повтор через {retry_after} с')
+                        await asyncio.sleep(retry_after)
+                        continue
+                    raise SpotifyError(f'Ошибка Spotify API: HTTP {response.status}')
+        raise SpotifyError('Spotify API не ответил после нескольких попыток')
+
+    async def track(self, track_id):
+        """Информация о треке"""
+        return await self._request(f'/tracks/{track_id}')
+
+    async def search(self, query, *, limit=5):
+        """Поиск треков"""
+        return await self._request('/search', {'q': query, 'type': 'track', 'limit': limit})
+
+    async def album_tracks(self, album_id, *, page_size=50):
+        """Треки альбома постранично (асинхронный генератор списков треков)"""
+        async for items in self._paged(f'/albums/{album_id}/tracks', page_size):
+            yield items
+
+    async def playlist_tracks(self, playlist_id, *, page_size=100):
+        """Треки плейлиста постранично (подкасты и удалённые треки пропускаются)"""
+        fields = 'items(track(name,artists(name),external_urls,type)),next'
+        async for items in self._paged(f'/playlists/{playlist_id}/tracks', page_size, fields=fields):
+            yield [
+                item['track'] for item in items
+                if item.get('track') and item['track'].get('type', 'track') == 'track'
+            ]
+
+    async def _paged(self, path, page_size, **params):
+        """Обходит страницы коллекции, запрашивая следующую только когда она нужна"""
+        offset = 0
+        while True:
+            payload = await self._request(path, {'limit': page_size, 'offset': offset, **params})
+            items = payload.get('items', [])
+            yield items
+            if not items or not payload.get('next'):
+                return
+            offset += len(items)
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,99 @@
+"""
+Быстрый запуск: замер этапов и синхронизация слэш-команд только при их изменении
+
+tree.sync() - глобальный запрос к Discord с жёстким лимитом. Схема команд хешируется,
+и хеш хранится в файле (по ID приложения): при перезапуске с теми же командами
+синхронизация пропускается.
+"""
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Названия этапов для лога
+PHASE_TITLES = {
+    'imports': 'импорт модулей и инициализация',
+    'setup_hook': 'запуск служб (setup_hook)',
+    'gateway': 'подключение к Discord',
+    'reconcile': 'сверка временных каналов',
+    'command_sync': 'синхронизация команд',
+    'ready': 'запуск целиком',
+}
+
+
+class StartupTimer:
+    """Длительности этапов запуска (для лога и метрики bot_startup_phase_seconds)"""
+
+    def __init__(self, started):
+        self.started = started  # time.perf_counter() в самом начале запуска
+        self.phases = {}  # этап -> секунд
+        self._open = {}
+
+    def record(self, phase, seconds):
+        self.phases[phase] = seconds
+        print(f'⏱️ {PHASE_TITLES.get(phase, phase)}: {seconds * 1000:.0f} мс')
+
+    def begin(self, phase):
+        self._open[phase] = time.perf_counter()
+
+    def end(self, phase):
+        started = self._open.pop(phase, None)
+        if started is not None:
+            self.record(phase, time.perf_counter() - started)
+
+    @contextmanager
+    def phase(self, phase):
+        self.begin(phase)
+        try:
+            yield
+        finally:
+            self.end(phase)
+
+    def since_start(self, phase):
+        """Этап, длившийся с начала запуска до текущего момента"""
+        self.record(phase, time.perf_counter() - self.started)
+
+
+def _command_dict(command, tree):
+    """Схема команды: discord.py 2.4+ принимает дерево, 2.3 - нет"""
+    try:
+        return command.to_dict(tree)
+    except TypeError:
+        return command.to_dict()
+
+
+def command_tree_hash(tree):
+    """Хеш схемы всех глобальных команд дерева (то, что отправляет tree.sync())"""
+    payload = sorted(
+        (_command_dict(command, tree) for command in tree.get_commands()),
+        key=lambda command: (command.get('type', 1), command['name'])
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def _load_hashes(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+async def sync_commands(tree, application_id, path, *, force=False):
+    """Синхронизирует команды, если их схема изменилась с прошлой синхронизации.
+
+    Возвращает число синхронизированных команд или None, если синхронизация не нужна.
+    """
+    digest = command_tree_hash(tree)
+    hashes = _load_hashes(path)
+    key = str(application_id)
+    if not force and hashes.get(key) == digest:
+        return None
+    synced = await tree.sync()
+    hashes[key] = digest
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(hashes, f)
+    os.replace(temp_path, path)
+    return len(synced)
@@ -0,0 +1,394 @@
+"""
+Временные голосовые каналы: создание по заходу в исходный канал без гонок и лавины запросов
+
+На каждый сервер - один менеджер. Все обращения к Discord (создание, перемещение,
+удаление) выполняет одна задача сервера строго по очереди, поэтому канал не может быть
+удалён, пока в него перемещают участника, а повторное событие не создаёт второй канал.
+Создание каналов ограничено по частоте.
+
+Каждый канал проходит состояния creating -> occupied -> empty_grace -> deleting
+(или pooled - свободный канал из запаса). Занятость считается по событиям голосовых
+каналов, без перебора channel.members. Опустевший канал удаляется после задержки,
+а вернувшийся участник попадает обратно в свой канал.
+"""
+import asyncio
+import time
+from collections import Counter, OrderedDict, deque
+
+import discord
+
+POOL_CHANNEL_NAME = '🎵 Свободный канал'
+# Максимальный битрейт: обычные серверы - 96000, буст 1 - 128000, буст 2 - 256000, буст 3 - 384000
+MAX_BITRATE = 384000
+
+# Состояния временного канала
+CREATING = 'creating'  # Запрос на создание отправлен
+POOLED = 'pooled'  # Свободный канал из запаса
+OCCUPIED = 'occupied'  # В канале есть участники или кого-то в него перемещают
+EMPTY_GRACE = 'empty_grace'  # Канал опустел и будет удалён, если никто не зайдёт
+DELETING = 'deleting'  # Запрос на удаление отправлен
+
+# Неудачное удаление повторяется с задержкой delete_delay, 2*delete_delay... но не больше этой
+DELETE_RETRY_MAX_DELAY = 300.0
+
+
+class RateBucket:
+    """Клиентский лимит: не больше rate операций за per секунд.
+
+    Discord всё равно ограничит частые запросы, но очередь на нашей стороне не даёт
+    отправить их пачкой и получить 429 на весь маршрут сервера.
+    """
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self._times = deque()
+        self._blocked_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            while self._times and now - self._times[0] >= self.per:
+                self._times.popleft()
+            wait = self._blocked_until - now
+            if wait <= 0 and len(self._times) < self.rate:
+                self._times.append(now)
+                return
+            if wait <= 0:
+                wait = self._times[0] + self.per - now
+            await asyncio.sleep(wait)
+
+    def penalize(self, retry_after):
+        """Ответ 429: не отправлять запросы, пока Discord не разрешит"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+
+class TempChannel:
+    __slots__ = ('id', 'state', 'occupants', 'incoming', 'grace', 'channel', 'delete_failures')
+
+    def __init__(self, channel_id, state, channel=None):
+        self.id = channel_id
+        self.state = state
+        self.channel = channel  # Объект канала discord.py из ответа на создание (или из кэша сервера)
+        self.occupants = set()  # ID участников в канале (по событиям голосовых каналов)
+        self.incoming = set()  # ID участников, которых бот сейчас перемещает в канал
+        self.grace = None  # Таймер удаления опустевшего канала
+        self.delete_failures = 0  # Неудачных попыток удаления подряд
+
+    @property
+    def is_empty(self):
+        return not self.occupants and not self.incoming
+
+
+class TempChannelManager:
+    def __init__(self, guild, *, source_channel_id, is_temp, on_created=None, on_deleted=None, on_error=None,
+                 bucket, pool_size=0, delete_delay=10.0):
+        self.guild = guild
+        self.source_channel_id = source_channel_id  # () -> ID исходного канала или None
+        self.is_temp = is_temp  # (channel_id) -> создан ли канал ботом (для каналов прошлого запуска)
+        self.on_created = on_created  # (channel_id) -> None
+        self.on_deleted = on_deleted  # (channel_id) -> None
+        self.on_error = on_error  # (операция, ошибка) -> None
+        self.bucket = bucket
+        self.pool_size = pool_size
+        self.delete_delay = delete_delay
+
+        self.channels = {}  # channel_id -> TempChannel
+        self._pool = []  # ID свободных каналов в порядке создания
+        self._owners = {}  # member_id -> ID канала, созданного для участника
+        self._incoming = {}  # member_id -> ID канала, в который его перемещают
+        # Очередь операций: заходы в исходный канал и удаления опустевших каналов
+        self._joins = OrderedDict()
+        self._deletes = OrderedDict()
+        self._worker = None
+
+        self.pool_hits = 0
+        self.reused = 0
+
+    # ---------- События (синхронно, из обработчика on_voice_state_update) ----------
+
+    def voice_update(self, member, before, after):
+        """Участник перешёл из канала before в after (любой из них может быть None)"""
+        if before is not None:
+            channel = self._get(before)
+            if channel is not None:
+                channel.occupants.discard(member.id)
+                self._check_empty(channel)
+
+        if after is not None:
+            channel = self._get(after)
+            if channel is not None:
+                self._occupy(channel, member.id)
+            elif after.id == self.source_channel_id():
+                self._joins[member.id] = None
+                self._wake()
+
+    def track(self, channel):
+        """Берёт под управление временный канал прошлого запуска (занятость - по channel.members один раз)"""
+        state = self.channels.get(channel.id)
+        if state is not None:
+            return state
+        state = self.channels[channel.id] = TempChannel(channel.id, OCCUPIED, channel)
+        state.occupants.update(m.id for m in channel.members if not m.bot)
+        if state.is_empty and channel.name == POOL_CHANNEL_NAME and self._pool_deficit():
+            state.state = POOLED
+            self._pool.append(channel.id)
+        else:
+            self._check_empty(state)
+        return state
+
+    @property
+    def is_idle(self):
+        """Нет каналов под управлением и работы в очереди - менеджер можно удалить"""
+        return not self.channels and not self._joins and not self._deletes and (
+            self._worker is None or self._worker.done()
+        )
+
+    def ensure_pool(self):
+        """Пополняет запас свободных каналов (после настройки исходного канала или запуска)"""
+        self._wake()
+
+    def drain_pool(self):
+        """Удаляет свободные каналы (исходный канал снят или перенесён в другую категорию)"""
+        for channel_id in self._pool:
+            self.channels[channel_id].state = EMPTY_GRACE
+            self._deletes[channel_id] = None
+        self._pool = []
+        self._wake()
+
+    # ---------- Переходы состояний ----------
+
+    def _get(self, channel):
+        state = self.channels.get(channel.id)
+        if state is None and self.is_temp(channel.id):
+            state = self.track(channel)
+        return state
+
+    def _occupy(self, channel, member_id):
+        channel.occupants.add(member_id)
+        # Перемещение завершено. Ожидание снимается только событием захода в этот канал:
+        # события, отправленные до перемещения, могут прийти позже его ответа
+        channel.incoming.discard(member_id)
+        if self._incoming.get(member_id) == channel.id:
+            del self._incoming[member_id]
+        if channel.state == POOLED:
+            # Зашли в свободный канал напрямую - он больше не в запасе
+            self._pool.remove(channel.id)
+            channel.state = OCCUPIED
+            self._wake()
+        elif channel.state == EMPTY_GRACE:
+            self._cancel_grace(channel)
+            channel.state = OCCUPIED
+            channel.delete_failures = 0
+
+    def _check_empty(self, channel):
+        if channel.state != OCCUPIED or not channel.is_empty:
+            return
+        channel.state = EMPTY_GRACE
+        self._schedule_delete(channel, self.delete_delay)
+
+    def _schedule_delete(self, channel, delay):
+        channel.grace = asyncio.get_running_loop().call_later(delay, self._grace_expired, channel.id)
+
+    def _cancel_grace(self, channel):
+        if channel.grace is not None:
+            channel.grace.cancel()
+            channel.grace = None
+        self._deletes.pop(channel.id, None)
+
+    def _grace_expired(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is not None and channel.state == EMPTY_GRACE and channel.is_empty:
+            channel.grace = None
+            self._deletes[channel_id] = None
+            self._wake()
+
+    # ---------- Очередь операций ----------
+
+    def _wake(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                if self._joins:
+                    member_id, _ = self._joins.popitem(last=False)
+                    await self._serve(member_id)
+                elif self._deletes:
+                    channel_id, _ = self._deletes.popitem(last=False)
+                    await self._delete(channel_id)
+                elif self._pool_deficit():
+                    if not await self._create_pool_channel():
+                        return
+                else:
+                    return
+            except Exception as e:
+                self._report('worker', e)
+
+    def _pool_deficit(self):
+        return self.source_channel_id() is not None and len(self._pool) < self.pool_size
+
+    def _discord_channel(self, channel_id):
+        # Ответ на создание канала приходит раньше события CHANNEL_CREATE, и до него
+        # канала нет в кэше сервера (move_to(None) отключил бы участника от голоса)
+        channel = self.guild.get_channel(channel_id)
+        if channel is None and channel_id in self.channels:
+            channel = self.channels[channel_id].channel
+        return channel
+
+    def _source_channel(self):
+        source_id = self.source_channel_id()
+        return self.guild.get_channel(source_id) if source_id else None
+
+    async def _serve(self, member_id):
+        member = self.guild.get_member(member_id)
+        source = self._source_channel()
+        # Пока запрос ждал очереди, участник мог уйти из исходного канала (или уже перемещён)
+        if member is None or source is None or not member.voice or member.voice.channel != source:
+            return
+
+        # Вернувшийся участник попадает в свой канал, если тот ещё не удаляется
+        channel = self.channels.get(self._owners.get(member_id))
+        if channel is not None and channel.state in (OCCUPIED, EMPTY_GRACE):
+            self.reused += 1
+            await self._move(member, channel)
+            return
+
+        channel = self._take_from_pool()
+        if channel is not None:
+            self.pool_hits += 1
+            self._owners[member_id] = channel.id
+            await self._move(member, channel)
+            # Переименование не задерживает перемещение участника
+            asyncio.get_running_loop().create_task(self._rename(channel.id, f'🎵 {member.display_name}'))
+            return
+
+        channel = await self._create(f'🎵 {member.display_name}', source.category)
+        if channel is None:
+            return
+        self._owners[member_id] = channel.id
+        await self._move(member, channel)
+        print(f'✅ Создан новый голосовой канал 🎵 {member.display_name} для {member.display_name}')
+
+    async def _move(self, member, channel):
+        # Канал занят с момента решения о перемещении: удаление его не тронет
+        if channel.state == EMPTY_GRACE:
+            self._cancel_grace(channel)
+        channel.state = OCCUPIED
+        previous = self.channels.get(self._incoming.get(member.id))
+        if previous is not None and previous is not channel:
+            previous.incoming.discard(member.id)
+            self._check_empty(previous)
+        channel.incoming.add(member.id)
+        self._incoming[member.id] = channel.id
+        try:
+            await member.move_to(self._discord_channel(channel.id))
+        except Exception as e:
+            if self._incoming.get(member.id) == channel.id:
+                del self._incoming[member.id]
+            channel.incoming.discard(member.id)
+            self._check_empty(channel)
+            self._report('move', e)
+
+    def _take_from_pool(self):
+        while self._pool:
+            channel = self.channels[self._pool.pop(0)]
+            if self.guild.get_channel(channel.id) is not None:
+                return channel
+            # Канал удалили вручную
+            del self.channels[channel.id]
+        return None
+
+    async def _create_pool_channel(self):
+        source = self._source_channel()
+        if source is None:
+            return False
+        channel = await self._create(POOL_CHANNEL_NAME, source.category, state=POOLED)
+        if channel is None:
+            return False
+        if channel.state == POOLED:
+            self._pool.append(channel.id)
+        return True
+
+    async def _create(self, name, category, *, state=OCCUPIED):
+        await self.bucket.acquire()
+        try:
+            created = await self.guild.create_voice_channel(
+                name=name,
+                category=category,
+                bitrate=min(MAX_BITRATE, self.guild.bitrate_limit),
+                user_limit=0  # Без ограничения пользователей
+            )
+        except discord.HTTPException as e:
+            self._report('create', e)
+            return None
+        channel = self.channels.get(created.id)
+        if channel is None:
+            # Событие о заходе в новый канал могло прийти раньше ответа на создание
+            channel = self.channels[created.id] = TempChannel(created.id, CREATING)
+        channel.channel = created
+        channel.state = OCCUPIED if channel.occupants else state
+        if self.on_created:
+            self.on_created(created.id)
+        return channel
+
+    async def _rename(self, channel_id, name):
+        try:
+            await self._discord_channel(channel_id).edit(name=name)
+        except (AttributeError, discord.NotFound):
+            pass  # Канал уже удалён
+        except discord.HTTPException as e:
+            self._report('rename', e)
+
+    async def _delete(self, channel_id):
+        channel = self.channels.get(channel_id)
+        # Пока удаление ждало очереди, в канал могли зайти
+        if channel is None or channel.state != EMPTY_GRACE or not channel.is_empty:
+            return
+        channel.state = DELETING
+        discord_channel = self._discord_channel(channel_id)
+        try:
+            if discord_channel is not None:
+                await discord_channel.delete()
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            # Канал остаётся в ожидании удаления: повтор по таймеру с растущей задержкой
+            channel.state = EMPTY_GRACE
+            channel.delete_failures += 1
+            delay = min(self.delete_delay * 2 ** channel.delete_failures, DELETE_RETRY_MAX_DELAY)
+            self._schedule_delete(channel, delay)
+            self._report('delete', e)
+            return
+        del self.channels[channel_id]
+        for member_id, owned in list(self._owners.items()):
+            if owned == channel_id:
+                del self._owners[member_id]
+        if self.on_deleted:
+            self.on_deleted(channel_id)
+        name = discord_channel.name if discord_channel is not None else channel_id
+        print(f'🗑️ Удалён пустой голосовой канал {name}')
+
+    def _report(self, operation, error):
+        if isinstance(error, discord.HTTPException) and error.status == 429:
+            retry_after = getattr(error, 'retry_after', None) or 5
+            self.bucket.penalize(retry_after)
+        if isinstance(error, discord.Forbidden):
+            print(f'❌ Нет прав для операции с голосовым каналом ({operation})')
+        else:
+            print(f'❌ Ошибка операции с голосовым каналом ({operation}): {error}')
+        if self.on_error:
+            self.on_error(operation, error)
+
+    def stats(self):
+        states = Counter(channel.state for channel in self.channels.values())
+        return {
+            'pending_requests': len(self._joins),
+            'pending_deletes': len(self._deletes),
+            'pool': len(self._pool),
+            'occupied': states[OCCUPIED],
+            'empty_grace': states[EMPTY_GRACE],
+            'pool_hits': self.pool_hits,
+            'reused': self.reused,
+        }
@@ -0,0 +1,198 @@
+"""
+Очередь воспроизведения и записи треков
+
+TrackQueue - очередь сервера на основе deque: извлечение из начала и добавление
+в оба конца за O(1), операции над диапазонами - за O(k). Все операции защищены
+блокировкой, поэтому веб-панель может читать начало очереди из своего потока,
+не копируя её целиком.
+"""
+import random
+import threading
+import time
+from collections import deque
+from itertools import islice
+from urllib.parse import parse_qs, urlparse
+
+# Запас (в секундах) до истечения подписанной ссылки на поток, после которого её нужно обновить
+STREAM_URL_EXPIRY_MARGIN = 60
+# Время жизни ссылки на поток, если в ней нет параметра expire (YouTube выдаёт ссылки на ~6 часов)
+STREAM_URL_DEFAULT_TTL = 5 * 60 * 60
+
+
+def parse_stream_expiry(stream_url):
+    """Возвращает время истечения подписанной ссылки на поток (unix time)"""
+    try:
+        params = parse_qs(urlparse(stream_url).query)
+        if 'expire' in params:
+            return float(params['expire'][0])
+    except (ValueError, TypeError):
+        pass
+    return time.time() + STREAM_URL_DEFAULT_TTL
+
+
+class ResolvedTrack:
+    """Трек, найденный один раз: метаданные и прямая ссылка на поток.
+
+    Хранится в очереди и повторно используется при воспроизведении,
+    заново извлекается только ссылка на поток, когда её подпись истекла.
+    Трек может лежать в очереди и ненайденным (заготовка) - тогда его найдёт предзагрузка.
+    """
+
+    # Большие плейлисты - это тысячи записей, поэтому без __dict__ у каждой
+    __slots__ = (
+        'query', 'search_query', 'video_id', 'title', 'webpage_url',
+        'stream_url', 'duration', 'expires_at', '_resolving',
+    )
+
+    def __init__(self, query, data=None, search_query=None):
+        self.query = query  # Исходный запрос пользователя (текст или Spotify URL)
+        self.search_query = search_query  # Что искать на YouTube, если трек ещё не найден
+        self.video_id = None
+        self.title = None
+        self.webpage_url = None
+        self.stream_url = None
+        self.duration = None
+        self.expires_at = 0
+        self._resolving = None  # Задача поиска/обновления, чтобы не запускать её дважды
+        if data:
+            self.update(data)
+
+    @property
+    def is_resolved(self):
+        """Найден ли трек на YouTube"""
+        return self.stream_url is not None
+
+    @property
+    def data(self):
+        """Основные поля трека в виде dict (как ответ yt-dlp)"""
+        return {
+            'id': self.video_id,
+            'title': self.title,
+            'url': self.stream_url,
+            'webpage_url': self.webpage_url,
+            'duration': self.duration,
+        }
+
+    @property
+    def key(self):
+        """Ключ для поиска дубликатов в очереди"""
+        return self.webpage_url or self.query
+
+    def update(self, data):
+        """Обновляет метаданные и ссылку на поток из ответа yt-dlp"""
+        self.video_id = data.get('id')
+        self.title = data.get('title')
+        self.webpage_url = data.get('webpage_url') or data.get('original_url')
+        self.stream_url = data.get('url')
+        self.duration = data.get('duration')
+        self.expires_at = parse_stream_expiry(self.stream_url)
+
+    def is_expired(self, margin=STREAM_URL_EXPIRY_MARGIN):
+        """Истекла ли (или скоро истечёт) ссылка на поток"""
+        return time.time() + margin >= self.expires_at
+
+    def __str__(self):
+        return self.title or self.search_query or self.query
+
+
+class TrackQueue:
+    """Потокобезопасная очередь треков сервера на основе deque"""
+
+    def __init__(self, tracks=()):
+        self._items = deque(tracks)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def append(self, track):
+        """Добавляет трек в конец очереди"""
+        with self._lock:
+            self._items.append(track)
+
+    def extend(self, tracks):
+        """Добавляет несколько треков в конец очереди"""
+        with self._lock:
+            self._items.extend(tracks)
+
+    def play_next(self, track):
+        """Ставит трек первым в очереди"""
+        with self._lock:
+            self._items.appendleft(track)
+
+    def popleft(self):
+        """Извлекает следующий трек (None, если очередь пуста)"""
+        with self._lock:
+            return self._items.popleft() if self._items else None
+
+    def pop_if_first(self, track):
+        """Извлекает трек, только если он всё ещё первый в очереди"""
+        with self._lock:
+            if self._items and self._items[0] is track:
+                self._items.popleft()
+                return True
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def peek(self, count):
+        """Первые count треков без копирования всей очереди"""
+        with self._lock:
+            return list(islice(self._items, count))
+
+    def shuffle(self):
+        """Перемешивает очередь"""
+        with self._lock:
+            items = list(self._items)
+            random.shuffle(items)
+            self._items = deque(items)
+
+    def move(self, source, target):
+        """Перемещает трек с позиции source на позицию target (с нуля)"""
+        with self._lock:
+            size = len(self._items)
+            if source < 0:
+                source += size
+            if not 0 <= source < size:
+                raise IndexError('deque index out of range')
+            # Позиции как у insert() после удаления трека: отрицательные - с конца, лишние - к краям
+            last = size - 1
+            target = max(0, target + last) if target < 0 else min(target, last)
+            # Повороты вместо del и insert: O(source + |source - target| + target), не O(n)
+            self._items.rotate(-source)
+            track = self._items.popleft()
+            self._items.rotate(source - target)
+            self._items.appendleft(track)
+            self._items.rotate(target)
+            return track
+
+    def remove_range(self, start, stop):
+        """Удаляет треки с позиций [start, stop) и возвращает их"""
+        with self._lock:
+            start = max(0, start)
+            stop = min(len(self._items), stop)
+            if start >= stop:
+                return []
+            # Поворачиваем очередь так, чтобы диапазон оказался в начале: O(start + k)
+            self._items.rotate(-start)
+            removed = [self._items.popleft() for _ in range(stop - start)]
+            self._items.rotate(start)
+            return removed
+
+    def dedupe(self):
+        """Удаляет повторяющиеся треки, оставляя первое вхождение; возвращает число удалённых"""
+        with self._lock:
+            seen = set()
+            unique = deque()
+            for track in self._items:
+                if track.key not in seen:
+                    seen.add(track.key)
+                    unique.append(track)
+            removed = len(self._items) - len(unique)
+            self._items = unique
+            return removed
@@ -1,14 +1,25 @@
 """
 Веб-панель для управления Discord ботом
+
+Работает на aiohttp в event loop самого бота: обработчики читают состояние бота
+и управляют воспроизведением без обращений из других потоков.
+
+Вкладки браузера подписываются на поток событий /api/events (Server-Sent Events):
+при подключении приходит снимок состояния, затем только изменившиеся поля.
 """
-from flask import Flask, render_template, jsonify, request
-from flask_cors import CORS
-import threading
 import asyncio
-from datetime import datetime
+import inspect
+import json
+import os
+import time
+from collections import Counter
+
+from aiohttp import web
 
-app = Flask(__name__)
-CORS(app)
+import metrics
+from cluster import query_clusters
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 
 # Глобальная ссылка на бота (будет установлена при запуске)
 bot_instance = None
@@ -16,6 +27,24 @@ music_queues = {}
 source_voice_channels = {}
 created_voice_channels = {}
 
+# Источники дополнительной статистики для /api/status: имя -> функция, возвращающая dict
+stats_providers = {}
+
+# Кластерный режим: панель работает в первом процессе и опрашивает остальные через Unix-сокеты
+CLUSTER_MODE = os.getenv('CLUSTER_ID') is not None
+
+# Функция бота для установки громкости сервера: (guild_id, volume 0.0-1.0) -> применена ли сразу
+volume_setter = None
+
+# Функция бота, возвращающая громкость сервера (0.0-1.0), в том числе когда ничего не играет
+volume_getter = None
+
+# Функция бота для остановки воспроизведения как по !stop: (guild_id, voice_client) -> None
+stop_handler = None
+
+# Функция бота, возвращающая последние блокировки event loop со стеками
+loop_incidents_provider = None
+
 
 def init_web_panel(bot, queues, source_channels, created_channels):
     """Инициализация веб-панели с ссылками на данные бота"""
@@ -26,237 +55,630 @@ def init_web_panel(bot, queues, source_channels, created_channels):
     created_voice_channels = created_channels
 
 
-def run_async(coro):
-    """Запуск асинхронной функции в синхронном контексте"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+def register_stats_provider(name, provider):
+    """Регистрирует источник статистики, который будет отдан в /api/status"""
+    stats_providers[name] = provider
+
+
+def register_volume_setter(setter):
+    """Регистрирует функцию бота для установки громкости сервера"""
+    global volume_setter
+    volume_setter = setter
+
+
+def register_volume_getter(getter):
+    """Регистрирует функцию бота, возвращающую сохранённую громкость сервера"""
+    global volume_getter
+    volume_getter = getter
+
+
+def register_stop_handler(handler):
+    """Регистрирует функцию бота для остановки воспроизведения и очистки очереди сервера"""
+    global stop_handler
+    stop_handler = handler
+
+
+def register_loop_incidents(provider):
+    """Регистрирует источник инцидентов сторожа event loop для /api/loop-incidents"""
+    global loop_incidents_provider
+    loop_incidents_provider = provider
+
+
+def collect_stats():
+    """Собирает статистику со всех зарегистрированных источников"""
+    stats = {}
+    for name, provider in stats_providers.items():
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {'error': str(e)}
+    return stats
+
+
+# Сколько секунд отдавать один и тот же снимок статуса и списка серверов
+PANEL_CACHE_TTL = float(os.getenv('PANEL_CACHE_TTL', 2))
+# Размер страницы /api/guilds по умолчанию и максимальный
+GUILDS_PAGE_SIZE = 50
+GUILDS_MAX_PAGE_SIZE = 200
+
+
+class SnapshotCache:
+    """Короткоживущий кэш снимков состояния.
+
+    Запросы нескольких вкладок и поток событий в пределах ttl получают один и тот же
+    снимок, а не пересчитывают его (список всех серверов, опрос процессов кластера).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}  # ключ -> (время построения, снимок)
+
+    async def get(self, key, builder):
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now - entry[0] < self.ttl:
+            return entry[1]
+        value = builder()
+        if inspect.isawaitable(value):
+            value = await value
+        self._entries[key] = (now, value)
+        return value
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+
+snapshot_cache = SnapshotCache(PANEL_CACHE_TTL)
+
+
+# Как часто пересчитывать статус бота для подписчиков потока событий (секунды)
+STATUS_EVENT_INTERVAL = 5
+# Интервал служебных сообщений, чтобы прокси не закрывали простаивающее соединение
+EVENT_KEEPALIVE_INTERVAL = 15
+
+
+class _Subscriber:
+    __slots__ = ('queue', 'guild_id', 'dropped')
+
+    def __init__(self, guild_id, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.guild_id = guild_id  # None - только общие события
+        self.dropped = False
+
+
+class PanelEventBus:
+    """Рассылка изменений состояния подписчикам /api/events.
+
+    Бот сообщает, что изменилось (notify(kind, guild_id)), состояние пересчитывается
+    один раз на все вкладки в следующей итерации event loop, а подписчикам уходят
+    только поля, отличающиеся от прошлой рассылки. Без подписчиков ничего не считается.
+    """
+
+    def __init__(self, builders, *, queue_size=100):
+        self.builders = builders  # kind -> функция (guild_id) -> dict (или корутина)
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._watched_guilds = Counter()  # guild_id -> число вкладок, открытых на этом сервере
+        self._state = {}  # (kind, guild_id) -> последнее разосланное состояние
+        self._pending = set()
+        self._flush_task = None
+        self._status_task = None
+
+    def notify(self, kind, guild_id=None):
+        """Помечает состояние как изменившееся; рассылка объединяет частые изменения"""
+        if not self._subscribers or (guild_id is not None and not self._watched_guilds[guild_id]):
+            return
+        self._pending.add((kind, guild_id))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self):
+        await asyncio.sleep(0)
+        while self._pending:
+            kind, guild_id = self._pending.pop()
+            try:
+                await self._publish(kind, guild_id, await self._build(kind, guild_id))
+            except Exception as e:
+                print(f'⚠️ Ошибка рассылки события панели {kind}: {e}')
+
+    async def _build(self, kind, guild_id):
+        state = self.builders[kind](guild_id)
+        if inspect.isawaitable(state):
+            state = await state
+        return state
+
+    async def _publish(self, kind, guild_id, state):
+        key = (kind, guild_id)
+        previous = self._state.get(key)
+        if previous is None:
+            changes = state
+        else:
+            changes = {k: v for k, v in state.items() if previous.get(k) != v}
+        self._state[key] = state
+        if not changes:
+            return
+        event = {'type': kind, 'guild_id': guild_id, 'changes': changes}
+        for subscriber in list(self._subscribers):
+            if guild_id is not None and guild_id != subscriber.guild_id:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Вкладка не успевает читать - отключаем, при переподключении она получит снимок
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+
+    async def subscribe(self, guild_id=None):
+        """Регистрирует подписчика; возвращает (подписчик, снимок состояния)"""
+        snapshot = []
+        kinds = [('status', None), ('guilds', None)]
+        if guild_id is not None:
+            kinds += [('music', guild_id), ('voice_channels', guild_id)]
+        for kind, kind_guild in kinds:
+            state = await self._build(kind, kind_guild)
+            # Остальные подписчики получают изменения до нового базового состояния
+            await self._publish(kind, kind_guild, state)
+            snapshot.append({'type': kind, 'guild_id': kind_guild, 'changes': state, 'snapshot': True})
+        subscriber = _Subscriber(guild_id, self.queue_size)
+        self._subscribers.add(subscriber)
+        if guild_id is not None:
+            self._watched_guilds[guild_id] += 1
+        if self._status_task is None or self._status_task.done():
+            self._status_task = asyncio.get_running_loop().create_task(self._refresh_status())
+        return subscriber, snapshot
+
+    def unsubscribe(self, subscriber):
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.discard(subscriber)
+        if subscriber.guild_id is not None:
+            self._watched_guilds[subscriber.guild_id] -= 1
+            if not self._watched_guilds[subscriber.guild_id]:
+                del self._watched_guilds[subscriber.guild_id]
+                # Состояние сервера без зрителей больше не нужно
+                self._state.pop(('music', subscriber.guild_id), None)
+                self._state.pop(('voice_channels', subscriber.guild_id), None)
+        if not self._subscribers:
+            # Следующий подписчик начнёт со снимка, сохранённое состояние больше не нужно
+            self._state.clear()
+            self._pending.clear()
+
+    async def _refresh_status(self):
+        """Статистика меняется постоянно - пересчитываем её по таймеру, один раз на все вкладки"""
+        while self._subscribers:
+            await asyncio.sleep(STATUS_EVENT_INTERVAL)
+            self.notify('status')
+
+
+def json_response(data, status=200):
+    return web.json_response(data, status=status)
+
+
+async def read_json_object(request):
+    """Тело запроса как JSON-объект; None - тело не JSON или не объект"""
     try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return body if isinstance(body, dict) else None
 
 
-@app.route('/')
-def index():
+def get_voice_client(guild_id):
+    # discord.py сам ведёт словарь guild_id -> голосовое подключение, поиск без перебора
+    guild = bot_instance.get_guild(guild_id)
+    return guild.voice_client if guild else None
+
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+}
+
+
+@web.middleware
+async def panel_middleware(request, handler):
+    """CORS для всех ответов и единая обработка ошибок API"""
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    elif request.path.startswith('/api/') and not bot_instance:
+        response = json_response({'error': 'Bot not initialized'}, status=500)
+    else:
+        try:
+            response = await handler(request)
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            response = json_response({'error': str(e)}, status=500)
+    if not response.prepared:
+        # Поток событий отправляет заголовки сам, до возврата из обработчика
+        response.headers.update(CORS_HEADERS)
+    return response
+
+
+routes = web.RouteTableDef()
+
+
+@routes.get('/')
+async def index(request):
     """Главная страница веб-панели"""
-    return render_template('index.html')
+    return web.FileResponse(os.path.join(TEMPLATES_DIR, 'index.html'))
+
 
+def format_uptime(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f'{days}д {hours:02}:{minutes:02}:{seconds:02}' if days else f'{hours:02}:{minutes:02}:{seconds:02}'
 
-@app.route('/api/status')
-def get_status():
+
+async def build_status():
+    """Статус бота: для /api/status и потока событий"""
+    return await snapshot_cache.get('status', _build_status)
+
+
+async def _build_status():
+    guilds_count = len(bot_instance.guilds)
+    is_ready = bot_instance.is_ready()
+
+    # Подсчитываем активные голосовые подключения
+    active_voice = len(bot_instance.voice_clients)
+
+    status = {
+        'status': 'online' if is_ready else 'offline',
+        'guilds': guilds_count,
+        'active_voice_connections': active_voice,
+        'bot_name': str(bot_instance.user) if bot_instance.user else 'Unknown',
+        'uptime': format_uptime(metrics.uptime()),
+        'uptime_seconds': int(metrics.uptime()),
+        'stats': collect_stats()
+    }
+    if CLUSTER_MODE:
+        # Серверы и подключения суммируются по всем процессам кластера
+        clusters = await asyncio.to_thread(query_clusters)
+        online = [c for c in clusters if c.get('status') == 'online']
+        status['guilds'] = sum(c.get('guilds', 0) for c in online)
+        status['active_voice_connections'] = sum(c.get('voice_connections', 0) for c in online)
+        status['clusters'] = {'total': len(clusters), 'online': len(online)}
+    return status
+
+
+@routes.get('/api/status')
+async def get_status(request):
     """Получение статуса бота"""
-    if not bot_instance:
-        return jsonify({'error': 'Bot not initialized'}), 500
-    
-    try:
-        guilds_count = len(bot_instance.guilds)
-        is_ready = bot_instance.is_ready()
-        
-        # Подсчитываем активные голосовые подключения
-        active_voice = len(bot_instance.voice_clients)
-        
-        return jsonify({
-            'status': 'online' if is_ready else 'offline',
-            'guilds': guilds_count,
-            'active_voice_connections': active_voice,
-            'bot_name': str(bot_instance.user) if bot_instance.user else 'Unknown',
-            'uptime': 'N/A'  # Можно добавить отслеживание времени работы
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-
-@app.route('/api/guilds')
-def get_guilds():
-    """Получение списка серверов"""
-    if not bot_instance:
-        return jsonify({'error': 'Bot not initialized'}), 500
-    
-    try:
-        guilds = []
-        for guild in bot_instance.guilds:
-            guild_info = {
-                'id': guild.id,
-                'name': guild.name,
-                'member_count': guild.member_count,
-                'has_voice': any(vc.guild == guild for vc in bot_instance.voice_clients),
-                'source_channel_set': guild.id in source_voice_channels,
-                'created_channels_count': len(created_voice_channels.get(guild.id, set()))
-            }
-            guilds.append(guild_info)
-        
-        return jsonify({'guilds': guilds})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-
-@app.route('/api/guild/<int:guild_id>/music')
-def get_music_status(guild_id):
+    return json_response(await build_status())
+
+
+@routes.get('/metrics')
+async def get_metrics(request):
+    """Метрики процесса в текстовом формате Prometheus"""
+    return web.Response(body=metrics.registry.render().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+@routes.get('/api/loop-incidents')
+async def get_loop_incidents(request):
+    """Последние блокировки event loop со стеком блокирующего кода"""
+    return json_response({'incidents': loop_incidents_provider() if loop_incidents_provider else []})
+
+
+@routes.get('/api/clusters')
+async def get_clusters(request):
+    """Состояние всех процессов кластера"""
+    if not CLUSTER_MODE:
+        return json_response({'clusters': []})
+    return json_response({'clusters': await asyncio.to_thread(query_clusters)})
+
+
+def _build_guild_rows():
+    """Все серверы бота, отсортированные по имени"""
+    guilds = []
+    for guild in bot_instance.guilds:
+        guild_info = {
+            'id': guild.id,
+            'name': guild.name,
+            'member_count': guild.member_count,
+            'has_voice': guild.voice_client is not None,
+            'source_channel_set': guild.id in source_voice_channels,
+            'created_channels_count': len(created_voice_channels.get(guild.id, ()))
+        }
+        guilds.append(guild_info)
+    guilds.sort(key=lambda g: (g['name'].casefold(), g['id']))
+    return guilds
+
+
+async def build_guilds(query='', page=1, per_page=GUILDS_PAGE_SIZE, voice_only=False):
+    """Страница списка серверов с фильтром по имени или ID"""
+    rows = await snapshot_cache.get('guilds', _build_guild_rows)
+    query = query.strip().casefold()
+    if query:
+        rows = [g for g in rows if query in g['name'].casefold() or query == str(g['id'])]
+    if voice_only:
+        rows = [g for g in rows if g['has_voice']]
+
+    per_page = max(1, min(per_page, GUILDS_MAX_PAGE_SIZE))
+    pages = max(1, -(-len(rows) // per_page))
+    page = max(1, min(page, pages))
+    start = (page - 1) * per_page
+    return {
+        'guilds': rows[start:start + per_page],
+        'total': len(rows),
+        'page': page,
+        'per_page': per_page,
+        'pages': pages,
+    }
+
+
+def int_param(request, name, default):
+    value = request.query.get(name, '')
+    return int(value) if value.isdigit() else default
+
+
+@routes.get('/api/guilds')
+async def get_guilds(request):
+    """Получение списка серверов: ?q=фильтр&page=1&per_page=50&voice=1"""
+    return json_response(await build_guilds(
+        query=request.query.get('q', ''),
+        page=int_param(request, 'page', 1),
+        per_page=int_param(request, 'per_page', GUILDS_PAGE_SIZE),
+        voice_only=request.query.get('voice') in ('1', 'true'),
+    ))
+
+
+def build_music_status(guild_id):
+    """Статус музыки сервера; None, если сервер не найден"""
+    guild = bot_instance.get_guild(guild_id)
+    if not guild:
+        return None
+
+    voice_client = get_voice_client(guild_id)
+    queue = music_queues.get(guild_id)
+    current_track = None
+    is_playing = False
+    is_paused = False
+    volume = 50
+    if volume_getter:
+        # Громкость сервера, сохранённая без трека, применится к следующему
+        volume = int(volume_getter(guild_id) * 100)
+
+    if voice_client:
+        is_playing = voice_client.is_playing()
+        is_paused = voice_client.is_paused()
+        if voice_client.source:
+            current_track = getattr(voice_client.source, 'title', 'Unknown')
+            source_volume = getattr(voice_client.source, 'volume', None)
+            if source_volume is not None:
+                volume = int(source_volume * 100)
+
+    return {
+        'connected': voice_client is not None,
+        'is_playing': is_playing,
+        'is_paused': is_paused,
+        'current_track': current_track,
+        'volume': volume,
+        # Первые 10 треков: очередь читается под блокировкой, без копирования целиком
+        'queue': [str(track) for track in queue.peek(10)] if queue else [],
+        'queue_length': len(queue) if queue else 0
+    }
+
+
+@routes.get('/api/guild/{guild_id:\\d+}/music')
+async def get_music_status(request):
     """Получение статуса музыки для сервера"""
-    if not bot_instance:
-        return jsonify({'error': 'Bot not initialized'}), 500
-    
-    try:
-        guild = bot_instance.get_guild(guild_id)
-        if not guild:
-            return jsonify({'error': 'Guild not found'}), 404
-        
-        voice_client = None
-        for vc in bot_instance.voice_clients:
-            if vc.guild.id == guild_id:
-                voice_client = vc
-                break
-        
-        queue = music_queues.get(guild_id, [])
-        current_track = None
-        is_playing = False
-        is_paused = False
-        volume = 50
-        
-        if voice_client:
-            is_playing = voice_client.is_playing()
-            is_paused = voice_client.is_paused()
-            if voice_client.source:
-                current_track = getattr(voice_client.source, 'title', 'Unknown')
-                volume = int(getattr(voice_client.source, 'volume', 0.5) * 100)
-        
-        return jsonify({
-            'connected': voice_client is not None,
-            'is_playing': is_playing,
-            'is_paused': is_paused,
-            'current_track': current_track,
-            'volume': volume,
-            'queue': queue[:10],  # Первые 10 треков
-            'queue_length': len(queue)
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-
-@app.route('/api/guild/<int:guild_id>/music/control', methods=['POST'])
-def control_music(guild_id):
-    """Управление воспроизведением музыки"""
-    if not bot_instance:
-        return jsonify({'error': 'Bot not initialized'}), 500
-    
-    try:
-        action = request.json.get('action')
-        guild = bot_instance.get_guild(guild_id)
-        if not guild:
-            return jsonify({'error': 'Guild not found'}), 404
-        
-        voice_client = None
-        for vc in bot_instance.voice_clients:
-            if vc.guild.id == guild_id:
-                voice_client = vc
-                break
-        
-        if not voice_client:
-            return jsonify({'error': 'Bot not connected to voice channel'}), 400
-        
-        if action == 'pause':
-            if voice_client.is_playing():
-                voice_client.pause()
-                return jsonify({'success': True, 'message': 'Playback paused'})
-            return jsonify({'error': 'Nothing is playing'}), 400
-        
-        elif action == 'resume':
-            if voice_client.is_paused():
-                voice_client.resume()
-                return jsonify({'success': True, 'message': 'Playback resumed'})
-            return jsonify({'error': 'Playback is not paused'}), 400
-        
-        elif action == 'stop':
-            voice_client.stop()
-            if guild_id in music_queues:
-                music_queues[guild_id].clear()
-            return jsonify({'success': True, 'message': 'Playback stopped'})
-        
-        elif action == 'skip':
-            if voice_client.is_playing() or voice_client.is_paused():
-                voice_client.stop()
-                return jsonify({'success': True, 'message': 'Track skipped'})
-            return jsonify({'error': 'Nothing is playing'}), 400
-        
+    status = build_music_status(int(request.match_info['guild_id']))
+    if status is None:
+        return json_response({'error': 'Guild not found'}, status=404)
+    return json_response(status)
+
+
+# Действия управления воспроизведением: корутины (voice_client, guild_id) -> (ответ, код)
+
+async def control_pause(voice_client, guild_id):
+    if voice_client.is_playing():
+        voice_client.pause()
+        return {'success': True, 'message': 'Playback paused'}, 200
+    return {'error': 'Nothing is playing'}, 400
+
+
+async def control_resume(voice_client, guild_id):
+    if voice_client.is_paused():
+        voice_client.resume()
+        return {'success': True, 'message': 'Playback resumed'}, 200
+    return {'error': 'Playback is not paused'}, 400
+
+
+async def control_stop(voice_client, guild_id):
+    if stop_handler:
+        # То же, что !stop: очередь, загрузка плейлистов и ожидающие поиски сервера
+        stop_handler(guild_id, voice_client)
+    else:
+        # Очередь очищается до остановки, чтобы плеер не перешёл к следующему треку
+        if guild_id in music_queues:
+            music_queues[guild_id].clear()
+        voice_client.stop()
+    return {'success': True, 'message': 'Playback stopped'}, 200
+
+
+async def control_skip(voice_client, guild_id):
+    if voice_client.is_playing() or voice_client.is_paused():
+        # Плеер сервера переходит к следующему треку сам, без остановки
+        skip = getattr(voice_client.source, 'skip', None)
+        if skip:
+            skip()
         else:
-            return jsonify({'error': 'Invalid action'}), 400
-    
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+            voice_client.stop()
+        return {'success': True, 'message': 'Track skipped'}, 200
+    return {'error': 'Nothing is playing'}, 400
+
+
+control_actions = {
+    'pause': control_pause,
+    'resume': control_resume,
+    'stop': control_stop,
+    'skip': control_skip,
+}
+
+
+@routes.post('/api/guild/{guild_id:\\d+}/music/control')
+async def control_music(request):
+    """Управление воспроизведением музыки"""
+    guild_id = int(request.match_info['guild_id'])
+    body = await read_json_object(request)
+    if body is None:
+        return json_response({'error': 'Request body must be a JSON object'}, status=400)
+    action = body.get('action')
+    guild = bot_instance.get_guild(guild_id)
+    if not guild:
+        return json_response({'error': 'Guild not found'}, status=404)
+
+    voice_client = get_voice_client(guild_id)
+    if not voice_client:
+        return json_response({'error': 'Bot not connected to voice channel'}, status=400)
+
+    handler = control_actions.get(action)
+    if handler is None:
+        return json_response({'error': 'Invalid action'}, status=400)
 
+    result, status = await handler(voice_client, guild_id)
+    event_bus.notify('music', guild_id)
+    return json_response(result, status=status)
 
-@app.route('/api/guild/<int:guild_id>/music/volume', methods=['POST'])
-def set_volume(guild_id):
+
+@routes.post('/api/guild/{guild_id:\\d+}/music/volume')
+async def set_volume(request):
     """Установка громкости"""
-    if not bot_instance:
-        return jsonify({'error': 'Bot not initialized'}), 500
-    
-    try:
-        volume = request.json.get('volume')
-        if volume is None or not (0 <= volume <= 100):
-            return jsonify({'error': 'Volume must be between 0 and 100'}), 400
-        
-        guild = bot_instance.get_guild(guild_id)
-        if not guild:
-            return jsonify({'error': 'Guild not found'}), 404
-        
-        voice_client = None
-        for vc in bot_instance.voice_clients:
-            if vc.guild.id == guild_id:
-                voice_client = vc
-                break
-        
-        if not voice_client or not voice_client.source:
-            return jsonify({'error': 'Bot not playing anything'}), 400
-        
+    guild_id = int(request.match_info['guild_id'])
+    body = await read_json_object(request)
+    if body is None:
+        return json_response({'error': 'Request body must be a JSON object'}, status=400)
+    volume = body.get('volume')
+    # bool - подкласс int, но true/false громкостью не считаются
+    if not isinstance(volume, (int, float)) or isinstance(volume, bool) or not (0 <= volume <= 100):
+        return json_response({'error': 'Volume must be a number between 0 and 100'}, status=400)
+
+    guild = bot_instance.get_guild(guild_id)
+    if not guild:
+        return json_response({'error': 'Guild not found'}, status=404)
+
+    voice_client = get_voice_client(guild_id)
+    if not voice_client:
+        return json_response({'error': 'Bot not connected to voice channel'}, status=400)
+
+    if volume_setter:
+        # Громкость запоминается для сервера: без трека она применится к следующему
+        applied = volume_setter(guild_id, volume / 100)
+    elif not voice_client.source:
+        return json_response({'error': 'Bot not playing anything'}, status=400)
+    else:
         voice_client.source.volume = volume / 100
-        return jsonify({'success': True, 'volume': volume})
-    
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        applied = True
+    event_bus.notify('music', guild_id)
+    return json_response({'success': True, 'volume': volume, 'applied': applied})
+
+
+def build_voice_channels_info(guild_id):
+    """Настройки голосовых каналов сервера; None, если сервер не найден"""
+    guild = bot_instance.get_guild(guild_id)
+    if not guild:
+        return None
+
+    source_channel_id = source_voice_channels.get(guild_id)
+    source_channel = None
+    if source_channel_id:
+        source_channel = guild.get_channel(source_channel_id)
 
+    created_channels = created_voice_channels.get(guild_id, set())
+    created_channels_info = []
 
-@app.route('/api/guild/<int:guild_id>/voice-channels')
-def get_voice_channels_info(guild_id):
+    for channel_id in created_channels:
+        channel = guild.get_channel(channel_id)
+        if channel:
+            created_channels_info.append({
+                'id': channel.id,
+                'name': channel.name,
+                'members': len([m for m in channel.members if not m.bot])
+            })
+
+    return {
+        'source_channel': {
+            'id': source_channel.id,
+            'name': source_channel.name
+        } if source_channel else None,
+        'created_channels': created_channels_info,
+        'created_channels_count': len(created_channels)
+    }
+
+
+@routes.get('/api/guild/{guild_id:\\d+}/voice-channels')
+async def get_voice_channels_info(request):
     """Получение информации о настройках голосовых каналов"""
-    if not bot_instance:
-        return jsonify({'error': 'Bot not initialized'}), 500
-    
+    info = build_voice_channels_info(int(request.match_info['guild_id']))
+    if info is None:
+        return json_response({'error': 'Guild not found'}, status=404)
+    return json_response(info)
+
+
+event_bus = PanelEventBus({
+    'status': lambda guild_id: build_status(),
+    'guilds': lambda guild_id: build_guilds(),
+    'music': lambda guild_id: build_music_status(guild_id) or {'error': 'Guild not found'},
+    'voice_channels': lambda guild_id: build_voice_channels_info(guild_id) or {'error': 'Guild not found'},
+})
+
+
+def notify(kind, guild_id=None):
+    """Сообщает вкладкам панели, что состояние изменилось (вызывается ботом)"""
+    if kind in ('status', 'guilds'):
+        snapshot_cache.invalidate(kind)
+    event_bus.notify(kind, guild_id)
+
+
+async def send_event(response, event):
+    payload = json.dumps(event, ensure_ascii=False)
+    await response.write(f"event: {event['type']}\ndata: {payload}\n\n".encode())
+
+
+@routes.get('/api/events')
+async def events(request):
+    """Поток событий (SSE): снимок состояния при подключении, затем изменения"""
+    guild_id = request.query.get('guild_id', '')
+    guild_id = int(guild_id) if guild_id.isdigit() else None
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        **CORS_HEADERS,
+    })
+    await response.prepare(request)
+
+    subscriber, snapshot = await event_bus.subscribe(guild_id)
     try:
-        guild = bot_instance.get_guild(guild_id)
-        if not guild:
-            return jsonify({'error': 'Guild not found'}), 404
-        
-        source_channel_id = source_voice_channels.get(guild_id)
-        source_channel = None
-        if source_channel_id:
-            source_channel = guild.get_channel(source_channel_id)
-        
-        created_channels = created_voice_channels.get(guild_id, set())
-        created_channels_info = []
-        
-        for channel_id in created_channels:
-            channel = guild.get_channel(channel_id)
-            if channel:
-                created_channels_info.append({
-                    'id': channel.id,
-                    'name': channel.name,
-                    'members': len([m for m in channel.members if not m.bot])
-                })
-        
-        return jsonify({
-            'source_channel': {
-                'id': source_channel.id,
-                'name': source_channel.name
-            } if source_channel else None,
-            'created_channels': created_channels_info,
-            'created_channels_count': len(created_channels)
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-
-def run_web_panel(host='0.0.0.0', port=5000):
-    """Запуск веб-панели"""
-    app.run(host=host, port=port, debug=False, threaded=True)
+        for event in snapshot:
+            await send_event(response, event)
+        while not subscriber.dropped:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b': keepalive\n\n')
+                continue
+            await send_event(response, event)
+    except ConnectionResetError:
+        pass
+    finally:
+        event_bus.unsubscribe(subscriber)
+    return response
+
+
+def create_app():
+    app = web.Application(middlewares=[panel_middleware])
+    app.add_routes(routes)
+    return app
+
 
+async def start_web_panel(host='0.0.0.0', port=5000):
+    """Запуск веб-панели в текущем event loop; возвращает AppRunner для остановки"""
+    runner = web.AppRunner(create_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner